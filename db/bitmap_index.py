@@ -0,0 +1,113 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# set bits per byte value, counts a packed bitmap without unpacking it
+POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], np.uint8)
+
+
+class RowSet:
+    """
+    A set of row positions of the columnar store. Like a roaring container it is
+    held as sorted positions while sparse and as a packed bitmap (little bit
+    order, one bit per row) once that is smaller.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        positions: Optional[np.ndarray] = None,
+        bits: Optional[np.ndarray] = None,
+    ):
+        self.size = size
+        self.positions_array = positions
+        self.bits = bits
+        self.__count = None
+
+    @classmethod
+    def full(cls, size: int) -> "RowSet":
+        return cls(size, bits=np.packbits(np.ones(size, dtype=bool), bitorder="little"))
+
+    @classmethod
+    def from_positions(cls, positions: np.ndarray, size: int) -> "RowSet":
+        """positions must be sorted and unique."""
+        # 4 bytes per position against size / 8 bytes for the bitmap
+        if len(positions) * 32 < size:
+            return cls(size, positions=positions.astype(np.uint32))
+        mask = np.zeros(size, dtype=bool)
+        mask[positions] = True
+        return cls(size, bits=np.packbits(mask, bitorder="little"))
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "RowSet":
+        return cls.from_positions(np.flatnonzero(mask), len(mask))
+
+    @property
+    def is_bitmap(self) -> bool:
+        return self.bits is not None
+
+    def count(self) -> int:
+        if self.__count is None:
+            if self.is_bitmap:
+                self.__count = int(POPCOUNT_TABLE[self.bits].sum(dtype=np.int64))
+            else:
+                self.__count = len(self.positions_array)
+        return self.__count
+
+    def positions(self) -> np.ndarray:
+        if self.is_bitmap:
+            return np.flatnonzero(
+                np.unpackbits(self.bits, count=self.size, bitorder="little")
+            )
+        return self.positions_array.astype(np.int64)
+
+    def mask(self) -> np.ndarray:
+        if self.is_bitmap:
+            return np.unpackbits(self.bits, count=self.size, bitorder="little").astype(
+                bool
+            )
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.positions_array] = True
+        return mask
+
+    def contains(self, positions: np.ndarray) -> np.ndarray:
+        """Membership of every position in positions, as a boolean array."""
+        if self.is_bitmap:
+            shifts = (positions & 7).astype(np.uint8)
+            return ((self.bits[positions >> 3] >> shifts) & 1).astype(bool)
+        index = np.searchsorted(self.positions_array, positions)
+        index[index == len(self.positions_array)] = 0
+        return self.positions_array[index] == positions
+
+    def intersect(self, other: "RowSet") -> "RowSet":
+        if self.is_bitmap and other.is_bitmap:
+            return RowSet(self.size, bits=self.bits & other.bits)
+        sparse, dense = (other, self) if self.is_bitmap else (self, other)
+        positions = sparse.positions_array
+        return RowSet(self.size, positions=positions[dense.contains(positions)])
+
+
+class BitmapIndex:
+    """Row set per distinct value of a column, missing values are not indexed."""
+
+    def __init__(self, codes: np.ndarray, categories: np.ndarray):
+        self.size = len(codes)
+        self.categories = categories
+        # a stable sort keeps the positions of every value sorted
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+        self.rows = [
+            RowSet.from_positions(order[start:end], self.size)
+            for start, end in zip(boundaries[:-1], boundaries[1:])
+        ]
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> "BitmapIndex":
+        codes, categories = pd.factorize(values)
+        return cls(codes, np.asarray(categories))
+
+    def lookup(self, value) -> RowSet:
+        matches = np.flatnonzero(self.categories == value)
+        if len(matches) == 0:
+            return RowSet(self.size, positions=np.empty(0, dtype=np.uint32))
+        return self.rows[matches[0]]
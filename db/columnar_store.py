@@ -0,0 +1,268 @@
+import os
+import threading
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from db import sqlite_setup
+from db.bitmap_index import BitmapIndex, RowSet
+from pydantic_models.property import PropertyQueryParams
+
+# set COLUMNAR_ENGINE=1 to serve statistics, outliers and visualizations from memory
+COLUMNAR_ENGINE_ENABLED = os.environ.get("COLUMNAR_ENGINE", "0") == "1"
+
+CATEGORICAL_COLUMNS = ("address", "city", "state", "zipcode")
+# equality filters of PropertyQueryParams, answered from bitmap indexes
+BITMAP_INDEXED_COLUMNS = ("city", "state", "zipcode", "bedrooms", "bathrooms")
+# range filters of PropertyQueryParams, answered from sorted range indexes
+RANGE_INDEXED_COLUMNS = ("price", "price_per_square_feet", "squarefeet")
+# int16 sentinel for a missing bedroom count
+MISSING_BEDROOMS = np.iinfo(np.int16).min
+
+
+class ColumnarPropertyStore:
+    """
+    The `properties` table held as typed numpy arrays, ordered by id. Filters of
+    PropertyQueryParams are evaluated as boolean masks with the same semantics as
+    filter_property_query (missing values never match a filter).
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.size = len(data)
+        self.id = data["id"].to_numpy(dtype=np.int64)
+        self.propertyid = data["propertyid"].to_numpy(dtype=np.int64)
+        self.price = data["price"].to_numpy(dtype=np.float64)
+        self.price_per_square_feet = data["price_per_square_feet"].to_numpy(
+            dtype=np.float64
+        )
+        self.squarefeet = self.__compact_float(data["squarefeet"])
+        self.bathrooms = self.__compact_float(data["bathrooms"])
+        self.bedrooms = (
+            data["bedrooms"].fillna(MISSING_BEDROOMS).to_numpy(dtype=np.int16)
+        )
+        self.datelisted = pd.to_datetime(
+            data["datelisted"], format="ISO8601"
+        ).to_numpy()
+        self.is_latest = data["is_latest"].to_numpy(dtype=bool)
+
+        # categorical columns as int32 codes into a categories array, -1 is null
+        self.codes = {}
+        self.categories = {}
+        for column in CATEGORICAL_COLUMNS:
+            codes, categories = pd.factorize(data[column])
+            self.codes[column] = codes.astype(np.int32)
+            self.categories[column] = np.asarray(categories, dtype=object)
+
+        self.bitmaps = {
+            column: (
+                BitmapIndex(self.codes[column], self.categories[column])
+                if column in self.codes
+                else BitmapIndex.from_values(self.column(column))
+            )
+            for column in BITMAP_INDEXED_COLUMNS
+        }
+        self.latest_rows = RowSet.from_mask(self.is_latest)
+
+        # positions ordered by value, a range filter is a slice found by binary
+        # search (nan sorts last and is left out of every slice)
+        self.sorted_positions = {}
+        self.sorted_values = {}
+        self.non_null_counts = {}
+        for column in RANGE_INDEXED_COLUMNS:
+            values = self.column(column)
+            order = np.argsort(values, kind="stable").astype(np.int32)
+            self.sorted_positions[column] = order
+            self.sorted_values[column] = values[order]
+            self.non_null_counts[column] = int(np.count_nonzero(~np.isnan(values)))
+
+    @classmethod
+    def from_database(cls, bind: Engine) -> "ColumnarPropertyStore":
+        with bind.connect() as connection:
+            data = pd.read_sql_query(
+                "SELECT id, propertyid, address, city, state, zipcode, price, "
+                "bedrooms, bathrooms, squarefeet, price_per_square_feet, "
+                "datelisted, is_latest FROM properties ORDER BY id",
+                connection,
+            )
+        return cls(data)
+
+    def category_code(self, column: str, value) -> int:
+        """Code of value in a categorical column, -2 (matches nothing) if unseen."""
+        matches = np.flatnonzero(self.categories[column] == value)
+        return int(matches[0]) if len(matches) else -2
+
+    def filter_rows(
+        self, query_params: Optional[PropertyQueryParams], latest: bool = True
+    ) -> RowSet:
+        """
+        Rows matching query_params. The most selective of the bitmap and range
+        indexes drives and the other predicates are only checked on its rows, so
+        a narrow filter costs about its result size rather than the table size.
+        """
+        # like filter_property_query, no params means no filter at all
+        if query_params is None:
+            return RowSet.full(self.size)
+
+        row_sets = [self.latest_rows] if latest else []
+        for column in BITMAP_INDEXED_COLUMNS:
+            value = getattr(query_params, column)
+            if value is not None:
+                row_sets.append(self.bitmaps[column].lookup(value))
+        row_sets.sort(key=RowSet.count)
+
+        bounds = {
+            column: self.__range_bounds(query_params, column)
+            for column in RANGE_INDEXED_COLUMNS
+        }
+        ranges = {
+            column: self.range_slice(column, minimum, maximum)
+            for column, (minimum, maximum) in bounds.items()
+            if minimum is not None or maximum is not None
+        }
+
+        narrowest = min(ranges, key=lambda c: len(ranges[c]), default=None)
+        if narrowest is not None and (
+            not row_sets or len(ranges[narrowest]) < row_sets[0].count()
+        ):
+            # the narrowest range drives, everything else is checked on its rows
+            positions = np.sort(ranges.pop(narrowest))
+            keep = np.ones(len(positions), dtype=bool)
+            for rows in row_sets:
+                keep &= rows.contains(positions)
+        else:
+            rows = row_sets[0] if row_sets else RowSet.full(self.size)
+            for other in row_sets[1:]:
+                rows = rows.intersect(other)
+            if not ranges:
+                return rows
+            positions = rows.positions()
+            keep = np.ones(len(positions), dtype=bool)
+
+        for column in ranges:
+            minimum, maximum = bounds[column]
+            values = self.column(column, positions)
+            if minimum is not None:
+                keep &= values >= minimum
+            if maximum is not None:
+                keep &= values <= maximum
+        return RowSet.from_positions(positions[keep], self.size)
+
+    def range_slice(self, column: str, minimum=None, maximum=None) -> np.ndarray:
+        """Positions (in value order) of the rows with minimum <= column <= maximum."""
+        sorted_values = self.sorted_values[column]
+        start = 0
+        end = self.non_null_counts[column]
+        if minimum is not None:
+            start = np.searchsorted(sorted_values[:end], minimum, side="left")
+        if maximum is not None:
+            end = np.searchsorted(sorted_values[:end], maximum, side="right")
+        return self.sorted_positions[column][start:end]
+
+    def filter_mask(
+        self, query_params: Optional[PropertyQueryParams], latest: bool = True
+    ) -> np.ndarray:
+        return self.filter_rows(query_params, latest=latest).mask()
+
+    def condition_mask(
+        self, positive=(), not_null=(), equals: Optional[dict] = None
+    ) -> np.ndarray:
+        """Mask for the extra `column > 0`, `IS NOT NULL` and equality conditions."""
+        mask = np.ones(self.size, dtype=bool)
+        for column in positive:
+            mask &= getattr(self, column) > 0
+        for column in not_null:
+            mask &= self.__not_null(column)
+        for column, value in (equals or {}).items():
+            if column in self.codes:
+                mask &= self.codes[column] == self.category_code(column, value)
+            else:
+                mask &= getattr(self, column) == value
+        return mask
+
+    def column(self, column: str, positions=None) -> np.ndarray:
+        """Decoded values of a column, as the database would return them."""
+        positions = slice(None) if positions is None else positions
+        if column in self.codes:
+            codes = self.codes[column][positions]
+            values = self.categories[column][np.maximum(codes, 0)]
+            return np.where(codes >= 0, values, None)
+        if column == "bedrooms":
+            bedrooms = self.bedrooms[positions]
+            return np.where(
+                bedrooms == MISSING_BEDROOMS, np.nan, bedrooms.astype(np.float64)
+            )
+        values = getattr(self, column)[positions]
+        if values.dtype == np.float32:
+            return values.astype(np.float64)
+        return values
+
+    def frame(self, columns: list, positions=None) -> pd.DataFrame:
+        return pd.DataFrame(
+            {column: self.column(column, positions) for column in columns}
+        )
+
+    def select(
+        self,
+        query_params: Optional[PropertyQueryParams],
+        columns: list,
+        latest: bool = True,
+        positive=(),
+        not_null=(),
+        equals: Optional[dict] = None,
+    ) -> pd.DataFrame:
+        """In-memory counterpart of filter_property_query(...).filter(...).all()."""
+        mask = self.filter_mask(query_params, latest=latest)
+        mask &= self.condition_mask(positive=positive, not_null=not_null, equals=equals)
+        return self.frame(columns, np.flatnonzero(mask))
+
+    @staticmethod
+    def __compact_float(series: pd.Series) -> np.ndarray:
+        # float32 halves the memory wherever it represents every value exactly
+        values = series.to_numpy(dtype=np.float64)
+        compact = values.astype(np.float32)
+        if np.array_equal(compact.astype(np.float64), values, equal_nan=True):
+            return compact
+        return values
+
+    @staticmethod
+    def __range_bounds(query_params: PropertyQueryParams, column: str) -> tuple:
+        if column == "price":
+            return query_params.price_min, query_params.price_max
+        if column == "price_per_square_feet":
+            return (
+                query_params.price_per_square_feet_min,
+                query_params.price_per_square_feet_max,
+            )
+        return query_params.squarefeet_min, query_params.squarefeet_max
+
+    def __not_null(self, column: str) -> np.ndarray:
+        if column in self.codes:
+            return self.codes[column] >= 0
+        if column == "bedrooms":
+            return self.bedrooms != MISSING_BEDROOMS
+        if column == "datelisted":
+            return ~np.isnat(self.datelisted)
+        return ~np.isnan(getattr(self, column))
+
+
+__store: Optional[ColumnarPropertyStore] = None
+__store_version = None
+__store_lock = threading.Lock()
+
+
+def get_columnar_store(db_session: Session) -> Optional[ColumnarPropertyStore]:
+    """
+    The store for the served database, rebuilt after every load. None when the
+    engine is disabled or the session is bound to another database.
+    """
+    global __store, __store_version
+    if not COLUMNAR_ENGINE_ENABLED or db_session.get_bind() is not sqlite_setup.engine:
+        return None
+    with __store_lock:
+        if __store is None or __store_version != sqlite_setup.dataset_version:
+            version = sqlite_setup.dataset_version
+            __store = ColumnarPropertyStore.from_database(sqlite_setup.engine)
+            __store_version = version
+        return __store
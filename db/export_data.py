@@ -0,0 +1,158 @@
+import csv
+import io
+from typing import Iterator, Optional
+import numpy as np
+import orjson
+import pandas as pd
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from db.columnar_store import get_columnar_store
+from db.sqlite_setup import fetch_db_session
+from pydantic_models.property import (
+    INTEGER_FIELDS,
+    PropertyQueryParams,
+    PropertyResponse,
+)
+from middleware.pagination import PageRequest
+from sqlalchemy_schemas.property import (
+    Property,
+    filter_properties_frame,
+    filter_property_query,
+)
+from utils.arrow import ARROW_MEDIA_TYPES, arrow_schema, encode_frames
+from utils.dataframe import sanitize_pandas_dataframe
+
+# rows fetched from the cursor (or decoded from the store) and written per chunk,
+# this bounds the memory of an export whatever it matches
+EXPORT_BATCH_SIZE = 2000
+# rows per arrow record batch / parquet row group, columnar formats want them big
+COLUMNAR_BATCH_SIZE = 65536
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    **ARROW_MEDIA_TYPES,
+}
+
+# the PropertyResponse fields, one json object / csv row per property, a column each
+# in arrow and parquet
+EXPORT_COLUMNS = list(PropertyResponse.model_fields)
+
+
+def export_properties(
+    query_params: PropertyQueryParams,
+    export_format: str,
+    bind: Optional[Engine] = None,
+) -> Iterator[bytes]:
+    """
+    Streams the properties matching query_params (ordered by id) as ndjson, csv,
+    an arrow IPC stream or parquet, one chunk per EXPORT_BATCH_SIZE rows
+    (COLUMNAR_BATCH_SIZE for arrow and parquet) as the cursor returns them.
+    Opens its own session, the request's is closed before the response is
+    streamed.
+    """
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise ValueError(
+            f"Unknown export format {export_format}, "
+            f"expected one of {tuple(EXPORT_MEDIA_TYPES)}."
+        )
+    db_session = Session(bind=bind) if bind is not None else next(fetch_db_session())
+    try:
+        if export_format in ARROW_MEDIA_TYPES:
+            yield from encode_frames(
+                __property_frames(query_params, db_session),
+                arrow_schema(PropertyResponse),
+                export_format,
+            )
+            return
+        if export_format == "csv":
+            yield __encode_csv(records=[], header=True)
+        for records in __property_batches(query_params, db_session):
+            if export_format == "csv":
+                yield __encode_csv(records, header=False)
+            else:
+                yield __encode_ndjson(records)
+    finally:
+        db_session.close()
+
+
+def export_properties_page(
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    export_format: str,
+) -> bytes:
+    """
+    The `/property/` page as arrow or parquet, built from its columns. total,
+    page, page_size and next_cursor are kept in the schema metadata.
+    """
+    frame, page = filter_properties_frame(
+        query_params=query_params, pagination=pagination, db_session=db_session
+    )
+    schema = arrow_schema(
+        PropertyResponse, metadata=page.model_dump(exclude={"results"})
+    )
+    return b"".join(encode_frames([frame], schema, export_format))
+
+
+def __property_batches(
+    query_params: PropertyQueryParams, db_session: Session
+) -> Iterator[list]:
+    store = get_columnar_store(db_session)
+    if store is not None:
+        positions = np.flatnonzero(store.filter_mask(query_params))
+        for start in range(0, len(positions), EXPORT_BATCH_SIZE):
+            batch = positions[start : start + EXPORT_BATCH_SIZE]
+            yield sanitize_pandas_dataframe(
+                store.frame(EXPORT_COLUMNS, batch), integer_columns=INTEGER_FIELDS
+            )
+        return
+
+    for rows in __property_rows(query_params, db_session, EXPORT_BATCH_SIZE):
+        yield [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+
+def __property_frames(
+    query_params: PropertyQueryParams, db_session: Session
+) -> Iterator[pd.DataFrame]:
+    # columns are converted as whole arrays, no per row records
+    store = get_columnar_store(db_session)
+    if store is not None:
+        positions = np.flatnonzero(store.filter_mask(query_params))
+        for start in range(0, len(positions), COLUMNAR_BATCH_SIZE):
+            yield store.frame(
+                EXPORT_COLUMNS, positions[start : start + COLUMNAR_BATCH_SIZE]
+            )
+        return
+
+    for rows in __property_rows(query_params, db_session, COLUMNAR_BATCH_SIZE):
+        yield pd.DataFrame.from_records(rows, columns=EXPORT_COLUMNS)
+
+
+def __property_rows(
+    query_params: PropertyQueryParams, db_session: Session, batch_size: int
+) -> Iterator[list]:
+    query = filter_property_query(
+        query_params=query_params,
+        db_session=db_session,
+        columns=[getattr(Property, column) for column in EXPORT_COLUMNS],
+    ).order_by(Property.id)
+    # a server side cursor, only batch_size rows are held at a time
+    result = db_session.execute(query.statement.execution_options(yield_per=batch_size))
+    yield from result.partitions()
+
+
+def __encode_ndjson(records: list) -> bytes:
+    return b"".join(
+        orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records
+    )
+
+
+def __encode_csv(records: list, header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    # records hold EXPORT_COLUMNS in order
+    writer.writerows(record.values() for record in records)
+    return buffer.getvalue().encode()
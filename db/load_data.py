@@ -1,66 +1,456 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import io
+import multiprocessing
+import os
+import time
 import pandas as pd
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from db import sqlite_setup
 from db.sqlite_setup import fetch_db_session
-from sqlalchemy_schemas.property import Property
-
-
-def load_data(csv_file, is_filtered):
-    db_session = next(fetch_db_session())
-    data = pd.read_csv(csv_file)
-    print("loading data...")
-    print("this may take a minute...")
-    properties: list[Property] = []
-    for _, row in data.iterrows():
-        property_entry = Property(
-            propertyid=row["propertyid"],
-            address=row["address"],
-            city=row["city"],
-            state=row["state"],
-            zipcode=row["zipcode"],
-            price=row["price"],
-            bedrooms=row["bedrooms"],
-            bathrooms=row["bathrooms"],
-            squarefeet=row["squarefeet"],
-            datelisted=(
-                datetime.strptime(row["datelisted"], "%Y-%m-%d %H:%M:%S")
-                if pd.notnull(row["datelisted"])
-                else None
-            ),
+from sqlalchemy_schemas.load_checkpoint import LoadCheckpoint
+from sqlalchemy_schemas.property import (
+    Property,
+    fetch_zipcodes_of_properties,
+    refresh_latest_listing_flags,
+)
+from sqlalchemy_schemas.property_cube import refresh_property_cube
+from sqlalchemy_schemas.property_monthly_stats import (
+    monthly_listings,
+    refresh_property_monthly_stats,
+)
+from sqlalchemy_schemas.property_sketch import (
+    refresh_property_sketches,
+    sketched_listings,
+)
+
+# garbage/extreme outlier thresholds, applied when loading with is_filtered
+EXTREME_PRICE_MIN = 150
+EXTREME_PRICE_MAX = 500000000
+EXTREME_PPSF_MIN = 1
+EXTREME_PPSF_MAX = 100000
+
+# rows handed to a single sqlite executemany call
+INSERT_BATCH_SIZE = 50000
+
+# csv records parsed and committed per chunk, this bounds the loader's memory
+DEFAULT_CHUNK_SIZE = 50000
+
+# columns written to the `properties` table, in insert order
+PROPERTY_COLUMNS = [
+    "propertyid",
+    "address",
+    "city",
+    "state",
+    "zipcode",
+    "price",
+    "bedrooms",
+    "bathrooms",
+    "squarefeet",
+    "price_per_square_feet",
+    "datelisted",
+]
+
+LOAD_MODES = ("replace", "append")
+
+# temp table holding one chunk while it is upserted in append mode
+STAGING_TABLE = "property_staging"
+
+# sqlalchemy's sqlite DateTime storage format
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def load_data(
+    csv_file,
+    is_filtered,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    resume=False,
+    workers=1,
+    mode="replace",
+    on_progress=None,
+    bind=None,
+):
+    """
+    Streams the csv into the `properties` table chunk by chunk. Every chunk is
+    committed in its own transaction together with a LoadCheckpoint, so with
+    resume=True an interrupted load continues after the last committed chunk.
+    With workers > 1 chunks are parsed and cleaned in a process pool while this
+    thread stays the only sqlite writer.
+    mode="replace" inserts every row (the caller recreates the tables first),
+    mode="append" upserts on (propertyid, datelisted) into the existing table.
+    on_progress is called with the LoadCheckpoint before the first chunk and
+    after every committed chunk.
+    bind loads into another engine (the shadow database) instead of the served one.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode {mode}, expected one of {LOAD_MODES}.")
+    db_session = Session(bind=bind) if bind is not None else next(fetch_db_session())
+    try:
+        checkpoint = __fetch_checkpoint(csv_file, resume, db_session)
+        if checkpoint.is_complete:
+            print(f"{csv_file} is already loaded")
+            return
+
+        print("loading data...")
+        started_at = time.monotonic()
+        rows_at_start = checkpoint.rows_loaded
+        inserted, updated = 0, 0
+        if on_progress is not None:
+            on_progress(checkpoint)
+        for data, end_offset, rows_read in parse_csv_chunks(
+            csv_file, chunk_size, checkpoint.byte_offset, is_filtered, workers
+        ):
+            if mode == "append":
+                chunk_inserted, chunk_updated = upsert_property_dataframe(
+                    data, db_session
+                )
+            else:
+                insert_property_dataframe(data, db_session)
+                chunk_inserted, chunk_updated = len(data), 0
+            inserted += chunk_inserted
+            updated += chunk_updated
+
+            checkpoint.byte_offset = end_offset
+            checkpoint.rows_read += rows_read
+            checkpoint.rows_loaded += chunk_inserted + chunk_updated
+            checkpoint.updated_at = datetime.now()
+            db_session.commit()
+            if bind is None:
+                # visible to the api right away, a shadow build waits for the swap
+                sqlite_setup.bump_dataset_version()
+
+            rows_per_second = (checkpoint.rows_loaded - rows_at_start) / max(
+                time.monotonic() - started_at, 1e-9
+            )
+            print(
+                f"loaded {checkpoint.rows_loaded} rows "
+                f"({checkpoint.byte_offset}/{checkpoint.file_size} bytes, "
+                f"{rows_per_second:.0f} rows/sec)"
+            )
+            if on_progress is not None:
+                on_progress(checkpoint)
+
+        if mode == "replace":
+            refresh_latest_listing_flags(db_session)
+            refresh_property_sketches(db_session)
+            refresh_property_cube(db_session)
+            refresh_property_monthly_stats(db_session)
+        checkpoint.is_complete = True
+        checkpoint.updated_at = datetime.now()
+        db_session.commit()
+        if bind is None:
+            sqlite_setup.bump_dataset_version()
+        print(f"done, {inserted} rows inserted and {updated} rows updated")
+    finally:
+        # anything not committed with a checkpoint is rolled back here
+        db_session.close()
+
+
+def reload_data(
+    csv_file,
+    is_filtered,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    resume=False,
+    workers=1,
+    on_progress=None,
+    on_phase=None,
+):
+    """
+    Full reload without downtime: the csv is loaded into a shadow database,
+    indexed and analyzed there, and only then swapped in for the served one.
+    resume=True continues an interrupted shadow build.
+    on_phase is called with "loading", "indexing" and "swapping".
+    """
+    on_phase = on_phase or (lambda phase: None)
+    shadow_engine = sqlite_setup.create_shadow_database(fresh=not resume)
+    try:
+        # bulk inserts are cheaper without the secondary indexes, built afterwards
+        for index in Property.__table__.indexes:
+            index.drop(bind=shadow_engine, checkfirst=True)
+
+        on_phase("loading")
+        load_data(
+            csv_file,
+            is_filtered,
+            chunk_size=chunk_size,
+            resume=resume,
+            workers=workers,
+            on_progress=on_progress,
+            bind=shadow_engine,
         )
-        if property_entry.price > 0 and property_entry.squarefeet > 0:
-            property_entry.price_per_square_feet = (
-                property_entry.price / property_entry.squarefeet
+
+        on_phase("indexing")
+        for index in Property.__table__.indexes:
+            index.create(bind=shadow_engine, checkfirst=True)
+        refresh_query_planner_statistics(shadow_engine)
+    except Exception:
+        shadow_engine.dispose()
+        raise
+
+    on_phase("swapping")
+    sqlite_setup.swap_in_database(shadow_engine)
+
+
+def refresh_query_planner_statistics(bind: Engine):
+    with bind.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+
+def migrate_database(bind: Engine):
+    """
+    Upgrades a database loaded before is_latest and the precomputed tables
+    existed so it can be appended to (create_all doesn't alter existing tables):
+    adds the is_latest column, creates any missing index, then flags the latest
+    listings and builds the sketches, cube and monthly stats once.
+    """
+    with Session(bind=bind) as db_session:
+        connection = db_session.connection()
+        columns = inspect(connection).get_columns(Property.__tablename__)
+        is_migrated = "is_latest" in {column["name"] for column in columns}
+        if not is_migrated:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {Property.__tablename__} "
+                "ADD COLUMN is_latest BOOLEAN NOT NULL DEFAULT 1"
             )
+        # CREATE INDEX IF NOT EXISTS, the filter indexes include is_latest
+        for index in Property.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+        if not is_migrated:
+            refresh_latest_listing_flags(db_session)
+            refresh_property_sketches(db_session)
+            refresh_property_cube(db_session)
+            refresh_property_monthly_stats(db_session)
+        db_session.commit()
+
 
-        if is_filtered and property_entry.price == 0:
-            property_entry.price = None  # setting this to None to not skew our analysis
+def __fetch_checkpoint(csv_file, resume: bool, db_session: Session) -> LoadCheckpoint:
+    file_size = os.path.getsize(csv_file)
+    checkpoint = db_session.get(LoadCheckpoint, csv_file)
+    if checkpoint is not None and resume:
+        if checkpoint.file_size != file_size:
+            raise ValueError(f"{csv_file} has changed since it was checkpointed.")
+        return checkpoint
 
+    if checkpoint is not None:
+        db_session.delete(checkpoint)
+        db_session.flush()
+    checkpoint = LoadCheckpoint(
+        csv_file=csv_file,
+        file_size=file_size,
+        byte_offset=0,
+        rows_read=0,
+        rows_loaded=0,
+        is_complete=False,
+    )
+    db_session.add(checkpoint)
+    return checkpoint
+
+
+def read_csv_chunks(csv_file, chunk_size: int, start_offset: int = 0):
+    """
+    Yields (header, body, end_offset, rows_read) for blocks of at most chunk_size
+    csv records, read as raw bytes so end_offset can be used to resume.
+    """
+    with open(csv_file, "rb") as file:
+        header = file.readline()
+        if start_offset:
+            file.seek(start_offset)
+        while True:
+            lines = []
+            while len(lines) < chunk_size:
+                line = file.readline()
+                # a quoted field can span several physical lines
+                while line.count(b'"') % 2:
+                    continuation = file.readline()
+                    if not continuation:
+                        break
+                    line += continuation
+                if not line:
+                    break
+                lines.append(line)
+            if not lines:
+                return
+            yield header, b"".join(lines), file.tell(), len(lines)
+
+
+def parse_csv_chunks(
+    csv_file, chunk_size: int, start_offset: int, is_filtered: bool, workers: int
+):
+    """
+    Yields (data, end_offset, rows_read) for every chunk in file order. With
+    workers > 1 up to 2 * workers chunks are parsed ahead in a process pool, this
+    bounded window is the queue between the parsers and the single writer.
+    """
+    chunks = read_csv_chunks(csv_file, chunk_size, start_offset=start_offset)
+    if workers <= 1:
+        for header, body, end_offset, rows_read in chunks:
+            yield parse_csv_chunk(header, body, is_filtered), end_offset, rows_read
+        return
+
+    # spawn instead of fork, the loader runs inside a threaded api server
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        for header, body, end_offset, rows_read in chunks:
+            future = pool.submit(parse_csv_chunk, header, body, is_filtered)
+            pending.append((future, end_offset, rows_read))
+            if len(pending) >= 2 * workers:
+                future, end_offset, rows_read = pending.popleft()
+                yield future.result(), end_offset, rows_read
+        while pending:
+            future, end_offset, rows_read = pending.popleft()
+            yield future.result(), end_offset, rows_read
+
+
+def parse_csv_chunk(header: bytes, body: bytes, is_filtered: bool) -> pd.DataFrame:
+    data = pd.read_csv(io.BytesIO(header + body))
+    return clean_property_dataframe(data, is_filtered)
+
+
+def clean_property_dataframe(data: pd.DataFrame, is_filtered: bool) -> pd.DataFrame:
+    """
+    Column-wise equivalent of the old per-row load: derives price per square feet,
+    parses datelisted in one pass and applies the is_filtered rules.
+    """
+    data = data.reindex(columns=PROPERTY_COLUMNS)
+    data["datelisted"] = pd.to_datetime(data["datelisted"], format="%Y-%m-%d %H:%M:%S")
+
+    price = data["price"]
+    squarefeet = data["squarefeet"]
+    data["price_per_square_feet"] = (price / squarefeet).where(
+        (price > 0) & (squarefeet > 0)
+    )
+
+    if is_filtered:
+        # setting zero prices to null to not skew our analysis
+        data["price"] = price.mask(price == 0)
         # filter out garbage/extreme outlier data before load
-        if is_filtered and check_if_extreme_outlier_during_load(
-            property_entry=property_entry
-        ):
-            continue
+        data = data[~extreme_outlier_mask(data)]
+
+    return data
 
-        properties.append(property_entry)
-        if len(properties) == 5000:
-            db_session.bulk_save_objects(properties)
-            db_session.commit()
-            properties = []
 
-    db_session.bulk_save_objects(properties)
-    db_session.commit()
-    properties = []
-    db_session.close()
+def extreme_outlier_mask(data: pd.DataFrame) -> pd.Series:
+    # comparisons against NaN are False, so missing values never count as outliers
+    price = data["price"]
+    ppsf = data["price_per_square_feet"]
+    price_check = (price > EXTREME_PRICE_MAX) | (price < EXTREME_PRICE_MIN)
+    ppsf_check = (ppsf < EXTREME_PPSF_MIN) | (ppsf > EXTREME_PPSF_MAX)
+    return price_check | ppsf_check
+
+
+def property_dataframe_to_rows(data: pd.DataFrame) -> list[tuple]:
+    # datelisted is pre-formatted the way sqlalchemy stores DateTime in sqlite
+    datelisted = data["datelisted"].dt.strftime(SQLITE_DATETIME_FORMAT)
+    data = data.assign(datelisted=datelisted).astype(object)
+    data = data.where(data.notna(), None)
+    return list(data.itertuples(index=False, name=None))
+
+
+def __insert_statement(table: str) -> str:
+    return "INSERT INTO {} ({}) VALUES ({})".format(
+        table, ", ".join(PROPERTY_COLUMNS), ", ".join("?" * len(PROPERTY_COLUMNS))
+    )
+
+
+def insert_property_dataframe(data: pd.DataFrame, db_session: Session):
+    statement = __insert_statement(Property.__tablename__)
+    connection = db_session.connection()
+    for start in range(0, len(data), INSERT_BATCH_SIZE):
+        rows = property_dataframe_to_rows(data.iloc[start : start + INSERT_BATCH_SIZE])
+        connection.exec_driver_sql(statement, rows)
+
+
+def upsert_property_dataframe(data: pd.DataFrame, db_session: Session) -> tuple:
+    """
+    Upserts a chunk keyed on (propertyid, datelisted): unknown listings are
+    inserted, listings whose columns changed are updated and identical ones are
+    skipped. Both statements probe ix_property_propertyid_datelisted, so the
+    cost follows the chunk size and not the table size.
+    Returns (inserted, updated).
+    """
+    # the last occurrence of a listing within the chunk wins
+    data = data.drop_duplicates(subset=["propertyid", "datelisted"], keep="last")
+    connection = db_session.connection()
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} AS "
+        f"SELECT {', '.join(PROPERTY_COLUMNS)} FROM {Property.__tablename__} WHERE 0"
+    )
+    connection.exec_driver_sql(f"DELETE FROM {STAGING_TABLE}")
+    connection.exec_driver_sql(
+        __insert_statement(STAGING_TABLE), property_dataframe_to_rows(data)
+    )
+
+    # what the chunk's properties look like before it, an update can move their
+    # listings out of a zipcode or supersede the ones the sketches count
+    previous_zipcodes = fetch_zipcodes_of_properties(db_session, STAGING_TABLE)
+    previous_sketched = sketched_listings(db_session, STAGING_TABLE)
+    previous_monthly = monthly_listings(db_session, STAGING_TABLE)
+    table = Property.__tablename__
+    key_match = (
+        f"{table}.propertyid = staged.propertyid "
+        f"AND {table}.datelisted IS staged.datelisted"
+    )
+    value_columns = [
+        column
+        for column in PROPERTY_COLUMNS
+        if column not in ("propertyid", "datelisted")
+    ]
+    updated = connection.exec_driver_sql(
+        "UPDATE {table} SET {assignments} FROM {staging} AS staged "
+        "WHERE {key_match} AND ({changed})".format(
+            table=table,
+            assignments=", ".join(f"{c} = staged.{c}" for c in value_columns),
+            staging=STAGING_TABLE,
+            key_match=key_match,
+            changed=" OR ".join(
+                f"{table}.{c} IS NOT staged.{c}" for c in value_columns
+            ),
+        )
+    ).rowcount
+    inserted = connection.exec_driver_sql(
+        "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} AS staged "
+        "WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {key_match})".format(
+            table=table,
+            columns=", ".join(PROPERTY_COLUMNS),
+            staging=STAGING_TABLE,
+            key_match=key_match,
+        )
+    ).rowcount
+    # only the properties touched by this chunk can change their latest listing
+    refresh_latest_listing_flags(db_session, propertyids_from=STAGING_TABLE)
+    refresh_property_sketches(
+        db_session,
+        propertyids_from=STAGING_TABLE,
+        previous_listings=previous_sketched,
+    )
+    refresh_property_cube(
+        db_session,
+        propertyids_from=STAGING_TABLE,
+        previous_zipcodes=previous_zipcodes,
+    )
+    refresh_property_monthly_stats(
+        db_session,
+        propertyids_from=STAGING_TABLE,
+        previous_listings=previous_monthly,
+    )
+    return inserted, updated
 
 
 def check_if_extreme_outlier_during_load(property_entry) -> bool:
     price_check = False
     if property_entry.price is not None:
-        price_check = property_entry.price > 500000000 or property_entry.price < 150
+        price_check = (
+            property_entry.price > EXTREME_PRICE_MAX
+            or property_entry.price < EXTREME_PRICE_MIN
+        )
     ppsf_check = False
     if property_entry.price_per_square_feet is not None:
         ppsf_check = (
-            property_entry.price_per_square_feet < 1
-            or property_entry.price_per_square_feet > 100000
+            property_entry.price_per_square_feet < EXTREME_PPSF_MIN
+            or property_entry.price_per_square_feet > EXTREME_PPSF_MAX
         )
     return price_check or ppsf_check
@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+from db import sqlite_setup
+from db.load_data import (
+    load_data,
+    migrate_database,
+    refresh_query_planner_statistics,
+    reload_data,
+)
+from pydantic_models.load_job import LoadJobResponse
+from sqlalchemy_schemas.load_checkpoint import LoadCheckpoint
+
+ACTIVE_PHASES = ("queued", "preparing", "loading", "indexing", "swapping")
+
+__jobs: dict[str, LoadJobResponse] = {}
+__jobs_lock = threading.Lock()
+
+
+def submit_load_job(
+    csv_file, is_filtered, chunk_size, resume, workers, mode
+) -> Optional[LoadJobResponse]:
+    """
+    Starts a load in a background thread and returns its job, or None if another
+    load is still running (sqlite only takes one writer).
+    """
+    with __jobs_lock:
+        if fetch_active_load_job() is not None:
+            return None
+        job = LoadJobResponse(
+            job_id=uuid.uuid4().hex,
+            csv_file=csv_file,
+            mode=mode,
+            submitted_at=datetime.now(),
+        )
+        __jobs[job.job_id] = job
+
+    thread = threading.Thread(
+        target=__run_load_job,
+        args=(job, is_filtered, chunk_size, resume, workers),
+        name=f"load-job-{job.job_id}",
+        daemon=True,
+    )
+    thread.start()
+    return job.model_copy()
+
+
+def fetch_load_job(job_id: str) -> Optional[LoadJobResponse]:
+    job = __jobs.get(job_id)
+    return job.model_copy() if job is not None else None
+
+
+def fetch_active_load_job() -> Optional[LoadJobResponse]:
+    for job in list(__jobs.values()):
+        if job.phase in ACTIVE_PHASES:
+            return job.model_copy()
+    return None
+
+
+def __run_load_job(job: LoadJobResponse, is_filtered, chunk_size, resume, workers):
+    started_at = None
+    start_rows, start_bytes = 0, 0
+
+    def on_progress(checkpoint: LoadCheckpoint):
+        nonlocal started_at, start_rows, start_bytes
+        if started_at is None:
+            # a resumed load starts counting from its checkpoint
+            started_at = time.monotonic()
+            start_rows, start_bytes = checkpoint.rows_read, checkpoint.byte_offset
+        job.rows_read = checkpoint.rows_read
+        job.rows_loaded = checkpoint.rows_loaded
+        job.bytes_read = checkpoint.byte_offset
+        job.total_bytes = checkpoint.file_size
+        elapsed = time.monotonic() - started_at
+        if elapsed > 0 and checkpoint.byte_offset > start_bytes:
+            job.rows_per_second = (checkpoint.rows_read - start_rows) / elapsed
+            bytes_per_second = (checkpoint.byte_offset - start_bytes) / elapsed
+            job.eta_seconds = (
+                checkpoint.file_size - checkpoint.byte_offset
+            ) / bytes_per_second
+
+    def on_phase(phase: str):
+        job.phase = phase
+
+    try:
+        job.phase = "preparing"
+        if job.mode == "replace":
+            # built in a shadow database, readers keep the old data until the swap
+            reload_data(
+                job.csv_file,
+                is_filtered,
+                chunk_size=chunk_size,
+                resume=resume,
+                workers=workers,
+                on_progress=on_progress,
+                on_phase=on_phase,
+            )
+        else:
+            sqlite_setup.create_db_tables(drop_existing=False)
+            migrate_database(sqlite_setup.engine)
+            on_phase("loading")
+            load_data(
+                job.csv_file,
+                is_filtered,
+                chunk_size=chunk_size,
+                resume=resume,
+                workers=workers,
+                mode=job.mode,
+                on_progress=on_progress,
+            )
+            on_phase("indexing")
+            refresh_query_planner_statistics(sqlite_setup.engine)
+        job.eta_seconds = 0
+        job.phase = "completed"
+    except Exception as e:
+        job.error = repr(e)
+        job.phase = "failed"
+    finally:
+        job.finished_at = datetime.now()
@@ -1,9 +1,52 @@
-from sqlalchemy import create_engine
+import glob
+import os
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./real_estate.db"
-engine = create_engine(DATABASE_URL)
+DATABASE_DIRECTORY = "."
+DEFAULT_DATABASE_FILE = "real_estate.db"
+# holds the name of the database file currently served, replaced on every reload
+CURRENT_DATABASE_POINTER = "real_estate.current"
+SHADOW_DATABASE_FILE = "real_estate.shadow.db"
+
+
+def __current_database_file() -> str:
+    pointer = os.path.join(DATABASE_DIRECTORY, CURRENT_DATABASE_POINTER)
+    if os.path.exists(pointer):
+        with open(pointer) as file:
+            return file.read().strip()
+    return DEFAULT_DATABASE_FILE
+
+
+def create_sqlite_engine(database_file: str) -> Engine:
+    sqlite_engine = create_engine(
+        "sqlite:///" + os.path.join(DATABASE_DIRECTORY, database_file)
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def enable_wal(dbapi_connection, connection_record):
+        # WAL lets api reads go on while a background load is writing
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+    return sqlite_engine
+
+
+# bumped whenever the served data changes, caches key their entries on it
+dataset_version = 0
+
+
+def bump_dataset_version():
+    global dataset_version
+    dataset_version += 1
+
+
+DATABASE_FILE = __current_database_file()
+engine = create_sqlite_engine(DATABASE_FILE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -16,7 +59,66 @@ def fetch_db_session():
         db.close()
 
 
-def create_db_tables():
+def create_db_tables(drop_existing: bool = True):
     # drop and create again on every restart (quick hacky way to ensure we dont overload data)
-    Base.metadata.drop_all(bind=engine)
+    if drop_existing:
+        Base.metadata.drop_all(bind=engine)
+        bump_dataset_version()
     Base.metadata.create_all(bind=engine)
+
+
+def create_shadow_database(fresh: bool = True) -> Engine:
+    """
+    Returns an engine on the shadow database file a full reload is built into,
+    the served database is not touched until swap_in_database.
+    fresh=False keeps an existing shadow file so an interrupted build can resume.
+    """
+    if fresh:
+        __remove_database_file(SHADOW_DATABASE_FILE)
+    shadow_engine = create_sqlite_engine(SHADOW_DATABASE_FILE)
+    Base.metadata.create_all(bind=shadow_engine)
+    return shadow_engine
+
+
+def swap_in_database(shadow_engine: Engine):
+    """
+    Promotes the finished shadow database to a new database generation and points
+    every new session at it. Sessions already open keep reading the previous file
+    until they close, the generation before that is removed.
+    """
+    global engine, DATABASE_FILE
+    # closing the shadow connections checkpoints its WAL into the file
+    shadow_engine.dispose()
+    database_file = f"real_estate.{time.time_ns()}.db"
+    os.replace(
+        os.path.join(DATABASE_DIRECTORY, SHADOW_DATABASE_FILE),
+        os.path.join(DATABASE_DIRECTORY, database_file),
+    )
+
+    pointer = os.path.join(DATABASE_DIRECTORY, CURRENT_DATABASE_POINTER)
+    with open(pointer + ".tmp", "w") as file:
+        file.write(database_file)
+    os.replace(pointer + ".tmp", pointer)
+
+    previous_engine, previous_file = engine, DATABASE_FILE
+    engine = create_sqlite_engine(database_file)
+    DATABASE_FILE = database_file
+    SessionLocal.configure(bind=engine)
+    # only idle connections are closed, checked out ones drain on the old file
+    previous_engine.dispose()
+    bump_dataset_version()
+
+    for stale_file in glob.glob(os.path.join(DATABASE_DIRECTORY, "real_estate.*.db")):
+        if os.path.basename(stale_file) not in (
+            database_file,
+            previous_file,
+            SHADOW_DATABASE_FILE,
+        ):
+            __remove_database_file(os.path.basename(stale_file))
+
+
+def __remove_database_file(database_file: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        path = os.path.join(DATABASE_DIRECTORY, database_file + suffix)
+        if os.path.exists(path):
+            os.remove(path)
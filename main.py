@@ -1,13 +1,15 @@
 from datetime import datetime
 import os
-from typing import Optional
-from fastapi import FastAPI, Query
+from typing import Literal, Optional
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from db import sqlite_setup
-from db.load_data import load_data
+from db.load_data import DEFAULT_CHUNK_SIZE
+from db.load_jobs import fetch_active_load_job, fetch_load_job, submit_load_job
+from pydantic_models.load_job import LoadJobResponse
+from routers.debug import debug_router
 from routers.property import property_router
 from routers.visualization import visualization_router
 
@@ -26,6 +28,7 @@ app.mount("/static", StaticFiles(directory="./static"), name="static")
 # add routers to main app
 app.include_router(property_router, prefix="/property")
 app.include_router(visualization_router, prefix="/visualization")
+app.include_router(debug_router, prefix="/debug")
 
 
 @app.get("/")
@@ -33,11 +36,38 @@ def health():
     return {"status": "this service is healthy @ " + datetime.now().__str__()}
 
 
-@app.get("/load/")
-def load_data_file(is_filtered: Optional[bool] = Query(False)):
-    sqlite_setup.create_db_tables()
-    load_data("./zoomprop_data_engineering.csv", is_filtered)
-    return {"status": "loaded data successfully"}
+@app.get("/load/", response_model=LoadJobResponse, status_code=202)
+def load_data_file(
+    is_filtered: Optional[bool] = Query(False),
+    resume: Optional[bool] = Query(False),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1),
+    workers: int = Query(1, ge=1, le=os.cpu_count()),
+    mode: Literal["replace", "append"] = Query("replace"),
+):
+    # loads run in the background, poll /load/{job_id} for progress
+    job = submit_load_job(
+        "./zoomprop_data_engineering.csv",
+        is_filtered,
+        chunk_size=chunk_size,
+        resume=resume,
+        workers=workers,
+        mode=mode,
+    )
+    if job is None:
+        active_job = fetch_active_load_job()
+        raise HTTPException(
+            status_code=409,
+            detail=f"load job {active_job.job_id if active_job else ''} is still running",
+        )
+    return job
+
+
+@app.get("/load/{job_id}", response_model=LoadJobResponse)
+def get_load_job(job_id: str):
+    job = fetch_load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"no load job {job_id}")
+    return job
 
 
 if __name__ == "__main__":
@@ -45,6 +75,7 @@ if __name__ == "__main__":
     # sqlite_setup.create_db_tables()
     # Load data
     # comment out the line below if you want sync load before app start (break heroku dyno due to timeouts)
+    # otherwise hit /load/, which runs the load as a background job
     # load_data('./zoomprop_data_engineering.csv', is_filtered=True)
 
     # Use the PORT environment variable provided by Heroku
@@ -0,0 +1,44 @@
+from typing import Optional
+from fastapi import HTTPException
+
+
+def negotiate_format(
+    requested: Optional[str], accept: Optional[str], media_types: dict, default: str
+) -> str:
+    """
+    The response format (a key of media_types) of a request, an explicit
+    `format` query param wins over the Accept header, which is matched in order
+    of its q values. A header that accepts none of media_types (a browser's
+    text/html) still gets the default, only an unknown `format` is a 406.
+    """
+    if requested is not None:
+        if requested not in media_types:
+            raise HTTPException(
+                status_code=406,
+                detail=f"Supported formats are {', '.join(media_types)}",
+            )
+        return requested
+    if not accept:
+        return default
+
+    ranges = []
+    for index, media_range in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, index, media_type.lower()))
+
+    for _, _, media_type in sorted(ranges):
+        if media_type in ("*/*", media_types[default].split("/")[0] + "/*"):
+            return default
+        for response_format, format_media_type in media_types.items():
+            if media_type == format_media_type:
+                return response_format
+    return default
@@ -1,16 +1,56 @@
-from fastapi import Query
+import base64
+import binascii
+import json
+from typing import Optional
+from fastapi import HTTPException, Query
 from pydantic import BaseModel
 
 
 class PageRequest(BaseModel):
     page: int = Query(1, ge=1)
     page_size: int = Query(10, ge=1)
+    # keyset mode - an empty cursor starts at the first row
+    cursor: Optional[str] = Query(None)
+    with_total: bool = Query(False)
 
 
 def pagination_params(
-    page: int = Query(1, ge=1), page_size: int = Query(10, ge=1)
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1),
+    cursor: Optional[str] = Query(
+        None,
+        description="Opaque keyset cursor, pass an empty value for the first page "
+        "and then the next_cursor of the previous response. Ignores page.",
+    ),
+    with_total: bool = Query(
+        False, description="Count the total in cursor mode (offset mode always does)."
+    ),
 ) -> PageRequest:
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
     return PageRequest(
         page=page,
         page_size=page_size,
+        cursor=cursor,
+        with_total=with_total,
     )
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """Returns the id after which the page starts (0 for an empty cursor)."""
+    if not cursor:
+        return 0
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError(f"invalid cursor {cursor}")
+    if not isinstance(last_id, int):
+        raise ValueError(f"invalid cursor {cursor}")
+    return last_id
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+
+
+class QueryPlanStep(BaseModel):
+    id: int
+    parent: int
+    detail: str
+
+
+class QueryPlanResponse(BaseModel):
+    sql: str
+    plan: list[QueryPlanStep] = []
+
+
+class CacheStatsResponse(BaseModel):
+    entries: int
+    max_entries: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    evictions: int
+    dataset_version: int
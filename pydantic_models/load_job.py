@@ -0,0 +1,20 @@
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+
+class LoadJobResponse(BaseModel):
+    job_id: str
+    # queued -> preparing -> loading -> indexing [-> swapping] -> completed | failed
+    phase: str = "queued"
+    csv_file: str
+    mode: str
+    rows_read: int = 0
+    rows_loaded: int = 0
+    bytes_read: int = 0
+    total_bytes: int = 0
+    rows_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    submitted_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
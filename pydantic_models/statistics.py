@@ -1,3 +1,4 @@
+from typing import Literal, Optional, Union
 from pydantic import BaseModel
 
 
@@ -16,3 +17,48 @@ class PropertyStatisticsResponse(BaseModel):
     total_properties: int
     percentiles: Percentiles
     outlier_properties_count: int
+    # set on approximate answers, percentiles and the outlier bounds are within
+    # this relative error of the exact values
+    relative_error: Optional[float] = None
+
+
+# statistics a grouped statistics response can be ordered by
+StatisticsOrderBy = Literal[
+    "total_properties",
+    "average_price",
+    "median_price",
+    "average_price_per_sqft",
+    "outlier_properties_count",
+    "percentile_25_price",
+    "percentile_75_price",
+    "percentile_90_price",
+    "percentile_99_price",
+]
+
+
+class PropertyGroupStatistics(BaseModel):
+    # value of the group_by column, None for the listings missing it
+    value: Optional[Union[int, float, str]] = None
+    statistics: PropertyStatisticsResponse
+
+
+class GroupedPropertyStatisticsResponse(BaseModel):
+    group_by: str
+    order_by: str
+    # number of groups before limit was applied
+    total_groups: int
+    groups: list[PropertyGroupStatistics] = []
+
+
+class PropertyRollupGroup(BaseModel):
+    # value of the group_by column, None for the listings missing it
+    value: Optional[Union[int, float, str]] = None
+    total_properties: int
+    average_price: Optional[float] = None
+    average_price_per_sqft: Optional[float] = None
+    average_squarefeet: Optional[float] = None
+
+
+class PropertyRollupResponse(BaseModel):
+    group_by: str
+    groups: list[PropertyRollupGroup] = []
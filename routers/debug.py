@@ -0,0 +1,55 @@
+from typing import Literal
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from db.sqlite_setup import fetch_db_session
+from pydantic_models.debug import (
+    CacheStatsResponse,
+    QueryPlanResponse,
+    QueryPlanStep,
+)
+from pydantic_models.property import PropertyQueryParams, property_query_params
+from sqlalchemy_schemas.property import (
+    Property,
+    explain_query_plan,
+    filter_property_query,
+)
+from utils.cache import bounds_cache, query_cache
+
+debug_router = APIRouter()
+
+
+@debug_router.get("/query-plan/", response_model=QueryPlanResponse)
+def get_query_plan(
+    query_params: PropertyQueryParams = Depends(property_query_params),
+    target: Literal["properties", "statistics"] = Query("properties"),
+    latest: bool = Query(True),
+    db_session: Session = Depends(fetch_db_session),
+):
+    # explains the query the /property/ (or /property/statistics/) route would run
+    if target == "statistics":
+        query = filter_property_query(
+            query_params=query_params,
+            db_session=db_session,
+            columns=[Property.price, Property.price_per_square_feet],
+            latest=latest,
+        ).filter(Property.price > 0, Property.price_per_square_feet > 0)
+    else:
+        query = filter_property_query(
+            query_params=query_params, db_session=db_session, latest=latest
+        )
+
+    plan = explain_query_plan(query, db_session)
+    db_session.close()
+    return QueryPlanResponse(
+        sql=str(query.statement.compile(dialect=db_session.get_bind().dialect)),
+        plan=[QueryPlanStep(id=row[0], parent=row[1], detail=row[3]) for row in plan],
+    )
+
+
+@debug_router.get("/cache/", response_model=CacheStatsResponse)
+def get_cache_stats(cache: Literal["query", "bounds"] = Query("query")):
+    # bounds holds the IQR quartiles shared by statistics and outlier pages
+    return CacheStatsResponse(
+        **(bounds_cache if cache == "bounds" else query_cache).stats()
+    )
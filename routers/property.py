@@ -1,71 +1,198 @@
-from fastapi import APIRouter, Depends
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from db.export_data import (
+    EXPORT_MEDIA_TYPES,
+    export_properties,
+    export_properties_page,
+)
 from db.sqlite_setup import fetch_db_session
+from middleware.content_negotiation import negotiate_format
 from middleware.pagination import PageRequest, pagination_params
 from pydantic_models.property import (
+    OutlierPaginatedResponse,
     PaginatedResponse,
     PropertyQueryParams,
     property_query_params,
 )
-from pydantic_models.statistics import PropertyStatisticsResponse
+from pydantic_models.statistics import (
+    GroupedPropertyStatisticsResponse,
+    PropertyRollupResponse,
+    PropertyStatisticsResponse,
+    StatisticsOrderBy,
+)
 from sqlalchemy_schemas.property import filter_properties
 from statistics_handlers.outlier_properties import (
     fetch_filtered_property_outliers_on_price,
     fetch_filtered_property_outliers_on_price_per_squarefeet,
 )
-from statistics_handlers.stats import calculate_property_statistics
+from statistics_handlers.rollup import calculate_property_rollup
+from statistics_handlers.stats import (
+    calculate_grouped_property_statistics,
+    calculate_property_statistics,
+)
+from utils.arrow import ARROW_MEDIA_TYPES, import_pyarrow
+from utils.json_response import ModelJSONResponse
 
 property_router = APIRouter()
 
+PROPERTY_MEDIA_TYPES = {"json": "application/json", **ARROW_MEDIA_TYPES}
+
 
 @property_router.get("/", response_model=PaginatedResponse)
 def get_properties(
     query_params: PropertyQueryParams = Depends(property_query_params),
     pagination: PageRequest = Depends(pagination_params),
+    response_format: Optional[Literal["json", "arrow", "parquet"]] = Query(
+        None,
+        alias="format",
+        description="Defaults to the Accept header, json if it accepts anything.",
+    ),
+    accept: Optional[str] = Header(None),
     db_session: Session = Depends(fetch_db_session),
 ):
+    response_format = negotiate_format(
+        response_format, accept, PROPERTY_MEDIA_TYPES, default="json"
+    )
+    if response_format in ARROW_MEDIA_TYPES:
+        __require_pyarrow()
+        return Response(
+            export_properties_page(
+                query_params=query_params,
+                pagination=pagination,
+                db_session=db_session,
+                export_format=response_format,
+            ),
+            media_type=ARROW_MEDIA_TYPES[response_format],
+        )
+
     properties: PaginatedResponse = filter_properties(
         query_params=query_params, pagination=pagination, db_session=db_session
     )
 
-    return properties
+    return ModelJSONResponse(properties)
+
+
+@property_router.get("/export/", response_class=StreamingResponse)
+def get_properties_export(
+    query_params: PropertyQueryParams = Depends(property_query_params),
+    export_format: Optional[Literal["ndjson", "csv", "arrow", "parquet"]] = Query(
+        None,
+        alias="format",
+        description="Defaults to the Accept header, ndjson if it accepts anything.",
+    ),
+    accept: Optional[str] = Header(None),
+):
+    export_format = negotiate_format(
+        export_format, accept, EXPORT_MEDIA_TYPES, default="ndjson"
+    )
+    if export_format in ARROW_MEDIA_TYPES:
+        __require_pyarrow()
+    # streamed as the cursor returns rows, without a total or pages
+    return StreamingResponse(
+        export_properties(query_params=query_params, export_format=export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f"attachment; filename=properties.{export_format}"
+        },
+    )
+
+
+def __require_pyarrow():
+    # checked before anything is streamed, an ImportError mid stream would only
+    # cut the response short
+    try:
+        import_pyarrow()
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail="arrow and parquet responses need pyarrow installed on the server",
+        )
 
 
 @property_router.get("/statistics/", response_model=PropertyStatisticsResponse)
 def get_statistics(
     query_params: PropertyQueryParams = Depends(property_query_params),
+    approximate: bool = False,
     db_session: Session = Depends(fetch_db_session),
 ):
     stats: PropertyStatisticsResponse = calculate_property_statistics(
-        query_params=query_params, db_session=db_session
+        query_params=query_params, db_session=db_session, approximate=approximate
     )
     return stats
 
 
-@property_router.get("/outliers/price/", response_model=PaginatedResponse)
+@property_router.get(
+    "/statistics/grouped/", response_model=GroupedPropertyStatisticsResponse
+)
+def get_grouped_statistics(
+    group_by: Literal["zipcode", "city", "state", "bedrooms"],
+    order_by: StatisticsOrderBy = "total_properties",
+    descending: bool = True,
+    limit: Optional[int] = Query(None, ge=1),
+    query_params: PropertyQueryParams = Depends(property_query_params),
+    db_session: Session = Depends(fetch_db_session),
+):
+    stats: GroupedPropertyStatisticsResponse = calculate_grouped_property_statistics(
+        query_params=query_params,
+        db_session=db_session,
+        group_by=group_by,
+        order_by=order_by,
+        descending=descending,
+        limit=limit,
+    )
+    return stats
+
+
+@property_router.get("/rollup/", response_model=PropertyRollupResponse)
+def get_rollup(
+    group_by: Literal["state", "city", "zipcode", "bedrooms", "bathrooms"],
+    query_params: PropertyQueryParams = Depends(property_query_params),
+    db_session: Session = Depends(fetch_db_session),
+):
+    rollup: PropertyRollupResponse = calculate_property_rollup(
+        query_params=query_params, db_session=db_session, group_by=group_by
+    )
+    return rollup
+
+
+@property_router.get("/outliers/price/", response_model=OutlierPaginatedResponse)
 def get_outliers_on_price(
     query_params: PropertyQueryParams = Depends(property_query_params),
     pagination: PageRequest = Depends(pagination_params),
+    method: Literal["iqr", "mad", "zscore"] = "iqr",
+    partition_by: Optional[Literal["zipcode", "city", "bedrooms"]] = None,
     db_session: Session = Depends(fetch_db_session),
 ):
-    page_response: PaginatedResponse = fetch_filtered_property_outliers_on_price(
-        query_params=query_params, pagination=pagination, db_session=db_session
+    page_response: OutlierPaginatedResponse = fetch_filtered_property_outliers_on_price(
+        query_params=query_params,
+        pagination=pagination,
+        db_session=db_session,
+        method=method,
+        partition_by=partition_by,
     )
-    return page_response
+    return ModelJSONResponse(page_response)
 
 
 @property_router.get(
-    "/outliers/price-per-squarefeet/", response_model=PaginatedResponse
+    "/outliers/price-per-squarefeet/", response_model=OutlierPaginatedResponse
 )
 def get_outliers_on_price_per_squarefeet(
     query_params: PropertyQueryParams = Depends(property_query_params),
     pagination: PageRequest = Depends(pagination_params),
+    method: Literal["iqr", "mad", "zscore"] = "iqr",
+    partition_by: Optional[Literal["zipcode", "city", "bedrooms"]] = None,
     db_session: Session = Depends(fetch_db_session),
 ):
-    page_response: PaginatedResponse = (
+    page_response: OutlierPaginatedResponse = (
         fetch_filtered_property_outliers_on_price_per_squarefeet(
-            query_params=query_params, pagination=pagination, db_session=db_session
+            query_params=query_params,
+            pagination=pagination,
+            db_session=db_session,
+            method=method,
+            partition_by=partition_by,
         )
     )
-    return page_response
+    return ModelJSONResponse(page_response)
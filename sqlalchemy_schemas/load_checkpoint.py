@@ -0,0 +1,18 @@
+from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from db.sqlite_setup import Base
+
+
+class LoadCheckpoint(Base):
+    """
+    Progress of a streaming csv load, committed together with every chunk so an
+    interrupted load can resume from byte_offset.
+    """
+
+    __tablename__ = "load_checkpoints"
+    csv_file = Column(String, primary_key=True)
+    file_size = Column(Integer)
+    byte_offset = Column(Integer, default=0)
+    rows_read = Column(Integer, default=0)
+    rows_loaded = Column(Integer, default=0)
+    is_complete = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
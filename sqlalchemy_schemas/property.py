@@ -1,9 +1,31 @@
-from sqlalchemy import Column, Index, Integer, String, Float, DateTime, and_, func
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Index,
+    Integer,
+    or_,
+    String,
+    Float,
+    DateTime,
+    text,
+)
 from db.sqlite_setup import Base
 from sqlalchemy.orm import Session
 
-from middleware.pagination import PageRequest
-from pydantic_models.property import PaginatedResponse, PropertyQueryParams
+from db.bitmap_index import RowSet
+from db.columnar_store import ColumnarPropertyStore, get_columnar_store
+from middleware.pagination import PageRequest, decode_cursor, encode_cursor
+from pydantic_models.property import (
+    PaginatedResponse,
+    PropertyQueryParams,
+    PropertyResponse,
+    construct_models,
+    convert_df_to_PropertyResponse,
+)
+from utils.cache import cached_query
 
 
 class Property(Base):
@@ -35,29 +57,211 @@ class Property(Base):
         DateTime,
         nullable=True,
     )
+    # materialized latest listing rule, maintained by refresh_latest_listing_flags
+    is_latest = Column(Boolean, nullable=False, server_default=text("1"))
 
+    # the equality filters of PropertyQueryParams lead, is_latest and the price
+    # columns follow so latest/statistics queries are answered from the index
     __table_args__ = (
         Index("ix_property_propertyid_datelisted", "propertyid", "datelisted"),
+        Index(
+            "ix_property_city_state",
+            "city",
+            "state",
+            "is_latest",
+            "price",
+            "price_per_square_feet",
+        ),
+        Index(
+            "ix_property_state", "state", "is_latest", "price", "price_per_square_feet"
+        ),
+        Index(
+            "ix_property_zipcode",
+            "zipcode",
+            "is_latest",
+            "price",
+            "price_per_square_feet",
+        ),
+        Index(
+            "ix_property_bedrooms_bathrooms",
+            "bedrooms",
+            "bathrooms",
+            "is_latest",
+            "price",
+            "price_per_square_feet",
+        ),
+        Index(
+            "ix_property_bathrooms",
+            "bathrooms",
+            "is_latest",
+            "price",
+            "price_per_square_feet",
+        ),
+        # range filters without any equality filter
+        Index(
+            "ix_property_latest_price", "is_latest", "price", "price_per_square_feet"
+        ),
+        Index("ix_property_latest_ppsf", "is_latest", "price_per_square_feet"),
+        Index("ix_property_latest_squarefeet", "is_latest", "squarefeet"),
     )
 
 
+# the PropertyResponse fields, id is kept for keyset pagination
+RESPONSE_FIELDS = list(PropertyResponse.model_fields)
+RESPONSE_COLUMNS = [Property.id] + [
+    getattr(Property, field) for field in RESPONSE_FIELDS
+]
+
+
+@cached_query
 def filter_properties(
     query_params: PropertyQueryParams, pagination: PageRequest, db_session: Session
 ) -> PaginatedResponse:
-    query = filter_property_query(query_params=query_params, db_session=db_session)
-    count = query.count()
+    store = get_columnar_store(db_session)
+    if store is not None:
+        db_session.close()
+        return paginate_store_rows(store, store.filter_rows(query_params), pagination)
+
+    query = filter_property_query(
+        query_params=query_params, db_session=db_session, columns=RESPONSE_COLUMNS
+    )
+    return paginate_query(query, pagination, db_session)
+
+
+def filter_properties_frame(
+    query_params: PropertyQueryParams, pagination: PageRequest, db_session: Session
+) -> tuple:
+    """
+    The filter_properties page as a DataFrame of the RESPONSE_FIELDS, for the
+    columnar formats, and the PaginatedResponse around it without results. No
+    per row objects are built.
+    """
+    store = get_columnar_store(db_session)
+    if store is not None:
+        db_session.close()
+        positions, page = __store_page(
+            store, store.filter_rows(query_params), pagination
+        )
+        return store.frame(RESPONSE_FIELDS, positions), page
+
+    query = filter_property_query(
+        query_params=query_params, db_session=db_session, columns=RESPONSE_COLUMNS
+    )
+    properties, page = __query_page(query, pagination, db_session)
+    frame = pd.DataFrame.from_records(properties, columns=["id", *RESPONSE_FIELDS])
+    return frame.drop(columns="id"), page
+
+
+def paginate_query(
+    query, pagination: PageRequest, db_session: Session, total: Optional[int] = None
+) -> PaginatedResponse:
+    """
+    A page of the rows of query (selecting RESPONSE_COLUMNS) ordered by id, by
+    offset or by keyset. Only the page itself is fetched, and the total too
+    unless it is already known.
+    """
+    properties, page = __query_page(query, pagination, db_session, total)
+    page.results = response_models(properties)
+    return page
+
+
+def response_models(rows) -> list[PropertyResponse]:
+    """PropertyResponses of rows selecting RESPONSE_COLUMNS, not validated again."""
+    # row[0] is the id
+    return construct_models(
+        PropertyResponse, [dict(zip(RESPONSE_FIELDS, row[1:])) for row in rows]
+    )
+
+
+def paginate_store_rows(
+    store: ColumnarPropertyStore, rows: RowSet, pagination: PageRequest
+) -> PaginatedResponse:
+    """A page of rows of the columnar store, offset or keyset like the sql path."""
+    positions, page = __store_page(store, rows, pagination)
+    page.results = convert_df_to_PropertyResponse(
+        store.frame(RESPONSE_FIELDS, positions)
+    )
+    return page
+
+
+def page_window(ids: np.ndarray, pagination: PageRequest) -> tuple:
+    """(start, end, next_cursor) of the page pagination asks for of sorted ids."""
+    if pagination.cursor is not None:
+        start = int(
+            np.searchsorted(ids, decode_cursor(pagination.cursor), side="right")
+        )
+    else:
+        start = (pagination.page - 1) * pagination.page_size
+    end = start + pagination.page_size
+    next_cursor = None
+    if pagination.cursor is not None and end < len(ids):
+        next_cursor = encode_cursor(int(ids[end - 1]))
+    return start, end, next_cursor
+
+
+def __store_page(
+    store: ColumnarPropertyStore, rows: RowSet, pagination: PageRequest
+) -> tuple:
+    # the total is the popcount of the row set, only the page itself is decoded
+    positions = rows.positions()
+    start, end, next_cursor = page_window(store.id[positions], pagination)
+    total = rows.count()
+    if pagination.cursor is not None and not pagination.with_total:
+        total = None
+    page = PaginatedResponse(
+        page=pagination.page,
+        page_size=pagination.page_size,
+        total=total,
+        next_cursor=next_cursor,
+    )
+    return positions[start:end], page
+
+
+def __query_page(
+    query, pagination: PageRequest, db_session: Session, total: Optional[int] = None
+) -> tuple:
+    if pagination.cursor is not None:
+        return __keyset_page(query, pagination, db_session, total)
+
+    count = query.count() if total is None else total
+    # ordered by id like the columnar store, pages don't depend on the index used
+    query = query.order_by(Property.id)
     query = query.offset((pagination.page - 1) * pagination.page_size).limit(
         pagination.page_size
     )
     properties = query.all()
     db_session.close()
 
-    return PaginatedResponse(
+    page = PaginatedResponse(
+        page=pagination.page, page_size=pagination.page_size, total=count
+    )
+    return properties, page
+
+
+def __keyset_page(
+    query, pagination: PageRequest, db_session: Session, total: Optional[int] = None
+) -> tuple:
+    # seeks past the last id instead of counting off (page - 1) * page_size rows
+    count = None
+    if pagination.with_total:
+        count = query.count() if total is None else total
+    properties = (
+        query.filter(Property.id > decode_cursor(pagination.cursor))
+        .order_by(Property.id)
+        .limit(pagination.page_size + 1)
+        .all()
+    )
+    db_session.close()
+
+    has_next = len(properties) > pagination.page_size
+    properties = properties[: pagination.page_size]
+    page = PaginatedResponse(
         page=pagination.page,
         page_size=pagination.page_size,
         total=count,
-        results=[property.__dict__ for property in properties],
+        next_cursor=encode_cursor(properties[-1].id) if has_next else None,
     )
+    return properties, page
 
 
 def filter_property_query(
@@ -117,25 +321,65 @@ def filter_property_query(
 
     # latest = false for historic data -> it would fetch all datelist prices in the table
     if latest:
-        subquery = (
-            db_session.query(
-                Property.propertyid,
-                func.max(Property.datelisted).label("max_datelisted"),
-            )
-            .filter(Property.datelisted.isnot(None))
-            .group_by(Property.propertyid)
-            .subquery()
-        )
+        query = query.filter(Property.is_latest.is_(True))
 
-        query = query.outerjoin(
-            subquery,
-            and_(
-                Property.propertyid == subquery.c.propertyid,
-                Property.datelisted == subquery.c.max_datelisted,
-            ),
-        ).filter(
-            (Property.datelisted == subquery.c.max_datelisted)
-            | (Property.datelisted.is_(None))
+    return query
+
+
+def explain_query_plan(query, db_session: Session) -> list:
+    """
+    Returns sqlite's EXPLAIN QUERY PLAN rows (id, parent, notused, detail) for a
+    query built by filter_property_query.
+    """
+    compiled = query.statement.compile(dialect=db_session.get_bind().dialect)
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    return (
+        db_session.connection()
+        .exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), parameters)
+        .all()
+    )
+
+
+def refresh_latest_listing_flags(
+    db_session: Session, propertyids_from: Optional[str] = None
+):
+    """
+    Sets is_latest on the most recent listing of every property (listings without
+    a datelisted always count as latest). propertyids_from names a table with a
+    propertyid column to only refresh those properties after an incremental load.
+    """
+    restriction = ""
+    if propertyids_from is not None:
+        restriction = f"WHERE propertyid IN (SELECT propertyid FROM {propertyids_from})"
+    statement = f"""
+        UPDATE properties SET is_latest = (
+            properties.datelisted IS NULL
+            OR properties.datelisted = latest.max_datelisted
         )
+        FROM (
+            SELECT propertyid, MAX(datelisted) AS max_datelisted FROM properties
+            {restriction} GROUP BY propertyid
+        ) AS latest
+        WHERE properties.propertyid = latest.propertyid
+    """
+    db_session.execute(text(statement))
 
-    return query
+
+def fetch_zipcodes_of_properties(db_session: Session, propertyids_from: str) -> set:
+    """Zipcodes any listing of the properties in the propertyids_from table has."""
+    return set(
+        db_session.execute(
+            text(
+                "SELECT DISTINCT zipcode FROM properties WHERE propertyid IN "
+                f"(SELECT propertyid FROM {propertyids_from})"
+            )
+        ).scalars()
+    )
+
+
+def zipcode_in(column, zipcodes: set):
+    # IN never matches null, a missing zipcode is matched explicitly
+    condition = column.in_([zipcode for zipcode in zipcodes if zipcode is not None])
+    if None in zipcodes:
+        condition = or_(condition, column.is_(None))
+    return condition
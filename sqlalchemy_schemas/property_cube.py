@@ -0,0 +1,142 @@
+from typing import Optional
+from sqlalchemy import Column, Float, Integer, String, case, func, insert, select
+from sqlalchemy.orm import Session
+
+from db.sqlite_setup import Base
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import (
+    Property,
+    fetch_zipcodes_of_properties,
+    zipcode_in,
+)
+import visualizations.constants as constants
+
+# the equality filters of PropertyQueryParams, a query filtering on anything
+# else (the range filters) is answered from the rows
+CUBE_DIMENSIONS = ("state", "city", "zipcode", "bedrooms", "bathrooms")
+# additive measures, averages are a sum over the matching count
+CUBE_MEASURES = (
+    "property_count",
+    "price_count",
+    "price_sum",
+    "price_per_square_feet_count",
+    "price_per_square_feet_sum",
+    "squarefeet_count",
+    "squarefeet_sum",
+)
+
+
+class PropertyCubeCell(Base):
+    """
+    Additive measures of the latest listings sharing one value of every
+    categorical dimension and one price histogram bin (an index into
+    constants.labels_price_histogram, null for rows without a positive price).
+    Measures of a column only count the rows where it is positive.
+    """
+
+    __tablename__ = "property_cube"
+    id = Column(Integer, primary_key=True, autoincrement="auto")
+    state = Column(String)
+    city = Column(String)
+    zipcode = Column(String, index=True)
+    bedrooms = Column(Integer)
+    bathrooms = Column(Float)
+    price_bin = Column(Integer)
+    property_count = Column(Integer)
+    price_count = Column(Integer)
+    price_sum = Column(Float)
+    price_per_square_feet_count = Column(Integer)
+    price_per_square_feet_sum = Column(Float)
+    squarefeet_count = Column(Integer)
+    squarefeet_sum = Column(Float)
+
+
+def property_measures() -> list:
+    """CUBE_MEASURES aggregated over `properties` rows, in the same order."""
+    measures = [func.count().label("property_count")]
+    for column in ("price", "price_per_square_feet", "squarefeet"):
+        value = getattr(Property, column)
+        measures += [
+            func.count(case((value > 0, 1))).label(f"{column}_count"),
+            func.coalesce(func.sum(case((value > 0, value))), 0.0).label(
+                f"{column}_sum"
+            ),
+        ]
+    return measures
+
+
+def price_histogram_bin():
+    """Index of the constants.bins_price_histogram bin a positive price falls in."""
+    bins = constants.bins_price_histogram
+    # highest lower edge first, the first bin takes every other positive price
+    return case(
+        *[
+            (Property.price >= bins[index], index)
+            for index in range(len(bins) - 2, 0, -1)
+        ],
+        (Property.price > 0, 0),
+        else_=None,
+    )
+
+
+def refresh_property_cube(
+    db_session: Session,
+    propertyids_from: Optional[str] = None,
+    previous_zipcodes: set = frozenset(),
+):
+    """
+    Rebuilds the cube from the `properties` table with a single GROUP BY.
+    propertyids_from names a table with a propertyid column to only rebuild the
+    zipcodes those properties are listed in after an incremental load, along
+    with the previous_zipcodes they were listed in before it updated them.
+    """
+    cells = db_session.query(PropertyCubeCell)
+    price_bin = price_histogram_bin().label("price_bin")
+    dimensions = [getattr(Property, column) for column in CUBE_DIMENSIONS]
+    rows = (
+        select(*dimensions, price_bin, *property_measures())
+        .where(Property.is_latest.is_(True))
+        .group_by(*dimensions, price_bin)
+    )
+    if propertyids_from is not None:
+        zipcodes = fetch_zipcodes_of_properties(db_session, propertyids_from)
+        zipcodes |= set(previous_zipcodes)
+        cells = cells.filter(zipcode_in(PropertyCubeCell.zipcode, zipcodes))
+        rows = rows.where(zipcode_in(Property.zipcode, zipcodes))
+    cells.delete(synchronize_session=False)
+
+    db_session.execute(
+        insert(PropertyCubeCell).from_select(
+            [*CUBE_DIMENSIONS, "price_bin", *CUBE_MEASURES], rows
+        )
+    )
+
+
+def rollup_property_cube(
+    query_params: Optional[PropertyQueryParams],
+    db_session: Session,
+    group_by: list,
+    not_null: list = (),
+) -> Optional[list]:
+    """
+    Rows of the group_by columns and the CUBE_MEASURES summed over the matching
+    cells, in group_by order with nulls first. None if query_params filters on
+    anything that is not a cube dimension.
+    """
+    columns = [getattr(PropertyCubeCell, column) for column in group_by]
+    query = db_session.query(
+        *columns,
+        *[
+            func.sum(getattr(PropertyCubeCell, measure)).label(measure)
+            for measure in CUBE_MEASURES
+        ],
+    )
+    if query_params is not None:
+        filters = query_params.model_dump(exclude_none=True)
+        if set(filters) - set(CUBE_DIMENSIONS):
+            return None
+        for column, value in filters.items():
+            query = query.filter(getattr(PropertyCubeCell, column) == value)
+    for column in not_null:
+        query = query.filter(getattr(PropertyCubeCell, column).isnot(None))
+    return query.group_by(*columns).order_by(*columns).all()
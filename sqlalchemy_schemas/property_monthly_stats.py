@@ -0,0 +1,547 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    String,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.orm import Session
+
+from db.sqlite_setup import Base
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import Property
+from utils.dataframe import sanitize_pandas_dataframe
+
+# the historical visualizations, each plots the monthly forward filled listings
+# with a positive price and a listing date, split by zipcode or not
+MONTHLY_SERIES = {
+    "price_trend": None,
+    "zipcode_heatmap": "zipcode",
+}
+# the equality filters a series is precomputed under, a scope of None is unfiltered
+MONTHLY_SCOPES = (None, "state", "city", "zipcode")
+# additive measures (like the cube's), averages are a sum over the matching count
+MONTHLY_MEASURES = {
+    "property_count": ("price", "size"),
+    "price_count": ("price", "count"),
+    "price_sum": ("price", "sum"),
+    "price_per_square_feet_count": ("price_per_square_feet", "count"),
+    "price_per_square_feet_sum": ("price_per_square_feet", "sum"),
+    "squarefeet_count": ("squarefeet", "count"),
+    "squarefeet_sum": ("squarefeet", "sum"),
+}
+# and the properties listed in the month, not carried forward: a scope_value's
+# stats end with the last month it has any
+STORED_MEASURES = [*MONTHLY_MEASURES, "listing_count"]
+STATS_KEYS = ["scope_value", "zipcode", "month"]
+# stands in for the null scope_value / zipcode of the unfiltered / unsplit series
+# while computing, so every key is a string pandas groups and looks up alike (no
+# loaded state, city or zipcode is empty, read_csv makes those NaN)
+UNSCOPED = ""
+LISTING_COLUMNS = [
+    "propertyid",
+    "state",
+    "city",
+    "zipcode",
+    "price",
+    "price_per_square_feet",
+    "squarefeet",
+    "datelisted",
+]
+# listings per batch read while building the stats
+MONTHLY_BATCH_SIZE = 16384
+# values of the cells x months x measures grid the stats are cumulated in at a time
+MONTHLY_GRID_SIZE = 1 << 22
+
+
+class PropertyMonthlyStats(Base):
+    """
+    Measures of one month of a MONTHLY_SERIES over the listings matching
+    scope == scope_value, every property counting with its last listing (in
+    the scope) up to that month. month is year * 12 + month - 1.
+    """
+
+    __tablename__ = "property_monthly_stats"
+    __table_args__ = (
+        Index("ix_property_monthly_stats_scope", "series", "scope", "scope_value"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement="auto")
+    series = Column(String)
+    scope = Column(String)
+    scope_value = Column(String)
+    zipcode = Column(String)
+    month = Column(Integer)
+    property_count = Column(Integer)
+    price_count = Column(Integer)
+    price_sum = Column(Float)
+    price_per_square_feet_count = Column(Integer)
+    price_per_square_feet_sum = Column(Float)
+    squarefeet_count = Column(Integer)
+    squarefeet_sum = Column(Float)
+    listing_count = Column(Integer)
+
+
+def refresh_property_monthly_stats(
+    db_session: Session,
+    propertyids_from: Optional[str] = None,
+    previous_listings: Optional[pd.DataFrame] = None,
+):
+    """
+    Rebuilds the monthly stats from the `properties` table, streaming the
+    listings in batches of whole properties. propertyids_from names a table
+    with a propertyid and datelisted column after an incremental load: only the
+    states, cities and zipcodes the properties are listed in now or were before
+    (previous_listings, their monthly_listings read before the load changed
+    them) and the unfiltered series are updated, from the month of the earliest
+    listing in the table on, by what the properties contribute now minus what
+    they contributed before. Earlier months can't change, a listing only counts
+    from its own month.
+    """
+    if propertyids_from is not None:
+        first_listed = db_session.execute(
+            text(f"SELECT min(datelisted) FROM {propertyids_from}")
+        ).scalar()
+        if first_listed is not None:
+            first_listed = pd.Timestamp(first_listed)
+            __update_stats(
+                db_session,
+                first_listed.year * 12 + first_listed.month - 1,
+                previous_listings,
+                monthly_listings(db_session, propertyids_from),
+            )
+        return
+
+    differences = {}
+    for listings in __listing_batches(db_session):
+        for series, scope, group_by, population in __populations(listings):
+            batch_differences = monthly_differences(population, scope, group_by)
+            if batch_differences.empty:
+                continue
+            key = (series, scope)
+            if key in differences:
+                batch_differences = pd.concat([differences[key], batch_differences])
+            # as many rows as scope values x zipcodes x months, whatever the listings
+            differences[key] = batch_differences.groupby(
+                STATS_KEYS, as_index=False, sort=False
+            ).sum()
+
+    db_session.query(PropertyMonthlyStats).delete(synchronize_session=False)
+    for (series, scope), scope_differences in differences.items():
+        stats, _ = __cumulated_stats(scope_differences)
+        __insert_stats(db_session, series, scope, stats)
+
+
+def monthly_listings(db_session: Session, propertyids_from: str) -> pd.DataFrame:
+    """
+    LISTING_COLUMNS of the listings the monthly stats count (a positive price
+    and a listing date) of the properties in the propertyids_from table.
+    """
+    rows = db_session.execute(
+        __listings_query().where(
+            Property.propertyid.in_(text(f"SELECT propertyid FROM {propertyids_from}"))
+        )
+    ).all()
+    return __listings_frame(rows)
+
+
+def monthly_differences(
+    listings: pd.DataFrame, scope: Optional[str], group_by: Optional[str]
+) -> pd.DataFrame:
+    """
+    Per scope_value, zipcode and month of the listings of whole properties, how
+    much every MONTHLY_MEASURES changes from the month before (what
+    forwardfilled_monthly_aggregates accumulates) and the listing_count. They
+    add up over disjoint sets of properties.
+    """
+    keys = list(dict.fromkeys(c for c in (scope, group_by) if c is not None))
+    if keys:
+        listings = listings[listings[keys].notna().all(axis=1)]
+    if listings.empty:
+        return pd.DataFrame(columns=[*STATS_KEYS, *STORED_MEASURES])
+    dates = listings["datelisted"].to_numpy()
+    month = dates.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+    # the cells (scope_value, zipcode) as codes, every key column as a factor
+    cells = np.zeros(len(listings), dtype=np.int64)
+    for key in keys:
+        codes, uniques = pd.factorize(listings[key])
+        cells = cells * len(uniques) + codes
+
+    # every value is its own filter, a property only carries forward its
+    # listings within it
+    properties = pd.factorize(listings["propertyid"])[0]
+    if scope is not None:
+        codes, uniques = pd.factorize(listings[scope])
+        properties = properties * len(uniques) + codes
+    order = np.lexsort((dates, properties))
+    properties, month = properties[order], month[order]
+    # and the earliest listing of a month is the one it has that month
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (properties[1:] != properties[:-1]) | (month[1:] != month[:-1])
+    order, properties, month = order[first], properties[first], month[first]
+    new_property = np.ones(len(order), dtype=bool)
+    new_property[1:] = properties[1:] != properties[:-1]
+    has_next = np.append(~new_property[1:], False)
+
+    # a listing adds its values from its month until the property's next one
+    # (it ends in its own cell, the next one may be in another zipcode)
+    ends = np.flatnonzero(has_next)
+    cells = pd.factorize(cells[order])[0]
+    span = month.max() + 1
+    entries = np.concatenate([cells, cells[ends]]) * span
+    entries += np.concatenate([month, month[ends + 1]])
+    entries, inverse = np.unique(entries, return_inverse=True)
+    signs = np.append(np.ones(len(order)), -np.ones(len(ends)))
+    listed = (signs > 0).astype(np.float64)
+
+    cell_codes, entry_months = np.divmod(entries, span)
+    _, first_rows = np.unique(cells, return_index=True)
+    first_rows = order[first_rows]
+    differences = {
+        "scope_value": __key_values(listings, scope, first_rows)[cell_codes],
+        "zipcode": __key_values(listings, group_by, first_rows)[cell_codes],
+        "month": entry_months,
+    }
+    values = {}
+    for column in dict.fromkeys(column for column, _ in MONTHLY_MEASURES.values()):
+        # a listing missing a value keeps the property's previous one, like ffill
+        values[column] = __forward_filled(
+            listings[column].to_numpy(dtype=np.float64)[order], new_property
+        )
+    for measure, (column, aggregation) in MONTHLY_MEASURES.items():
+        if aggregation == "size":
+            weights = np.ones(len(order))
+        elif aggregation == "count":
+            weights = (~np.isnan(values[column])).astype(np.float64)
+        else:
+            weights = np.nan_to_num(values[column])
+        weights = np.concatenate([weights, weights[ends]]) * signs
+        differences[measure] = np.bincount(inverse, weights, minlength=len(entries))
+    differences["listing_count"] = np.bincount(inverse, listed, minlength=len(entries))
+    return pd.DataFrame(differences)
+
+
+def monthly_property_stats(
+    query_params: Optional[PropertyQueryParams], db_session: Session, series: str
+) -> Optional[pd.DataFrame]:
+    """
+    zipcode, datelisted (monthly periods), property_count and the average price,
+    price_per_square_feet and squarefeet of series for query_params, ordered by
+    month. None if query_params filters on anything but a single state, city or
+    zipcode, or if the stats haven't been built.
+    """
+    filters = query_params.model_dump(exclude_none=True) if query_params else {}
+    if len(filters) > 1 or set(filters) - set(MONTHLY_SCOPES):
+        return None
+    scope, value = next(iter(filters.items()), (None, None))
+    series_stats = db_session.query(PropertyMonthlyStats).filter(
+        PropertyMonthlyStats.series == series
+    )
+    if series_stats.first() is None:
+        return None
+
+    stats = pd.read_sql_query(
+        series_stats.filter(
+            __equals(PropertyMonthlyStats.scope, scope),
+            __equals(PropertyMonthlyStats.scope_value, value),
+        )
+        .order_by(PropertyMonthlyStats.month, PropertyMonthlyStats.zipcode)
+        .statement,
+        db_session.connection(),
+    )
+    result = pd.DataFrame(
+        {
+            "zipcode": stats["zipcode"],
+            "datelisted": pd.PeriodIndex.from_fields(
+                year=stats["month"] // 12, month=stats["month"] % 12 + 1, freq="M"
+            ),
+            "property_count": stats["property_count"],
+        }
+    )
+    for column in ("price", "price_per_square_feet", "squarefeet"):
+        result[column] = stats[f"{column}_sum"] / stats[f"{column}_count"]
+    return result
+
+
+def __equals(column, value):
+    # the unfiltered scope is stored as null
+    return column.is_(None) if value is None else column == value
+
+
+def __scope_value_in(column, scope_values) -> object:
+    values = [value for value in scope_values if value != UNSCOPED]
+    condition = column.in_(values)
+    if UNSCOPED in scope_values:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+
+def __key_values(listings: pd.DataFrame, key: Optional[str], rows) -> np.ndarray:
+    # the values of key at rows, the cell codes index them
+    if key is None:
+        return np.full(len(rows), UNSCOPED, dtype=object)
+    return listings[key].to_numpy(dtype=object)[rows]
+
+
+def __forward_filled(values: np.ndarray, new_property: np.ndarray) -> np.ndarray:
+    # the last value that isn't NaN, never carried over from the property before
+    filled = np.where(~np.isnan(values) | new_property, np.arange(len(values)), 0)
+    return values[np.maximum.accumulate(filled)]
+
+
+def __listings_query():
+    return (
+        select(*[getattr(Property, column) for column in LISTING_COLUMNS])
+        .where(Property.price > 0, Property.datelisted.isnot(None))
+        .order_by(Property.propertyid, Property.datelisted, Property.id)
+    )
+
+
+def __listings_frame(rows) -> pd.DataFrame:
+    listings = pd.DataFrame(rows, columns=LISTING_COLUMNS)
+    listings["datelisted"] = pd.to_datetime(listings["datelisted"])
+    return listings
+
+
+def __listing_batches(db_session: Session):
+    # about MONTHLY_BATCH_SIZE listings at a time, a property's are never split
+    carried = None
+    for listings in pd.read_sql_query(
+        __listings_query(), db_session.connection(), chunksize=MONTHLY_BATCH_SIZE
+    ):
+        if carried is not None:
+            listings = pd.concat([carried, listings], ignore_index=True)
+        last = listings["propertyid"].to_numpy() == listings["propertyid"].iloc[-1]
+        carried = listings[last]
+        if not last.all():
+            yield __listings_frame(listings[~last])
+    if carried is not None:
+        yield __listings_frame(carried)
+
+
+def __populations(listings: pd.DataFrame):
+    # (series, scope, group_by, the listings the series counts) of every series
+    for series, group_by in MONTHLY_SERIES.items():
+        population = listings
+        if series == "zipcode_heatmap":
+            population = listings[
+                listings["zipcode"].notna() & (listings["squarefeet"] > 0)
+            ]
+        for scope in MONTHLY_SCOPES:
+            yield series, scope, group_by, population
+
+
+def __cumulated_stats(
+    differences: pd.DataFrame,
+    since: Optional[int] = None,
+    stored: Optional[pd.DataFrame] = None,
+    earlier_last_months: Optional[pd.Series] = None,
+) -> tuple:
+    # (stats, last_months): STATS_KEYS and STORED_MEASURES of every month some
+    # property is in a cell, up to the last month anything is listed in its
+    # scope_value, and that month per scope_value. Given the stored stats from
+    # since on, the differences are added to them, the last stored month of a
+    # scope_value carried forward as nothing was listed later. A scope_value
+    # listing nothing from since on ends at earlier_last_months (or is gone).
+    if stored is None:
+        stored = pd.DataFrame(columns=[*STATS_KEYS, *STORED_MEASURES])
+    if since is None:
+        since = int(differences["month"].min()) if len(differences) else 0
+    cells = pd.concat([differences[STATS_KEYS[:2]], stored[STATS_KEYS[:2]]])
+    cells = cells.drop_duplicates(ignore_index=True)
+    months = int(
+        np.nanmax([differences["month"].max(), stored["month"].max(), since - 1])
+    )
+    months = months - since + 1
+
+    listed = [
+        frame.groupby(["scope_value", "month"])["listing_count"].sum()
+        for frame in (differences[differences["month"] >= since], stored)
+    ]
+    listed = listed[0].add(listed[1], fill_value=0)
+    listed = listed[np.rint(listed.to_numpy(dtype=np.float64)) > 0].reset_index()
+    last_months = listed.groupby("scope_value")["month"].max()
+    last_months = last_months.reindex(cells["scope_value"].unique())
+    if earlier_last_months is not None:
+        last_months = last_months.fillna(earlier_last_months)
+    last_months = last_months.fillna(-1).astype(np.int64)
+    if cells.empty or months <= 0:
+        return pd.DataFrame(columns=[*STATS_KEYS, *STORED_MEASURES]), last_months
+
+    cell_index = pd.MultiIndex.from_frame(cells)
+    differences = differences.assign(
+        cell=cell_index.get_indexer(
+            pd.MultiIndex.from_frame(differences[STATS_KEYS[:2]])
+        )
+    )
+    stored = stored.assign(
+        cell=cell_index.get_indexer(pd.MultiIndex.from_frame(stored[STATS_KEYS[:2]]))
+    )
+    stored_last_months = stored.groupby("scope_value")["month"].max()
+    ends = cells["scope_value"].map(stored_last_months).fillna(since - 1)
+    ends = ends.to_numpy(dtype=np.int64)
+    ends_in_scope = cells["scope_value"].map(last_months).to_numpy()
+    block = max(1, MONTHLY_GRID_SIZE // (months * len(STORED_MEASURES)))
+    stats = [
+        __cumulated_block(
+            cells,
+            range(start, min(start + block, len(cells))),
+            since,
+            months,
+            differences,
+            stored,
+            ends,
+            ends_in_scope,
+        )
+        for start in range(0, len(cells), block)
+    ]
+    return pd.concat(stats, ignore_index=True), last_months
+
+
+def __cumulated_block(
+    cells, block, since, months, differences, stored, ends, ends_in_scope
+) -> pd.DataFrame:
+    # the stats of the cells in block (a range of positions in cells), ends
+    # the last stored month and ends_in_scope the last month of every cell
+    grid = np.zeros((len(block), months, len(STORED_MEASURES)))
+    differences = differences[differences["cell"].between(block.start, block.stop - 1)]
+    codes = differences["cell"].to_numpy() - block.start
+    offsets = differences["month"].to_numpy(dtype=np.int64) - since
+    values = differences[STORED_MEASURES].to_numpy(dtype=np.float64)
+    # the differences before since add up to what since starts with, listings
+    # before since are in earlier months
+    np.add.at(grid[:, :, :-1], (codes, np.clip(offsets, 0, None)), values[:, :-1])
+    listed = offsets >= 0
+    np.add.at(grid[:, :, -1], (codes[listed], offsets[listed]), values[listed, -1])
+    grid[:, :, :-1] = np.cumsum(grid[:, :, :-1], axis=1)
+
+    stored = stored[stored["cell"].between(block.start, block.stop - 1)]
+    if len(stored):
+        stored_grid = np.zeros_like(grid)
+        stored_grid[
+            stored["cell"].to_numpy() - block.start,
+            stored["month"].to_numpy(dtype=np.int64) - since,
+        ] = stored[STORED_MEASURES].to_numpy(dtype=np.float64)
+        grid[:, :, -1] += stored_grid[:, :, -1]
+        carried = np.minimum(np.arange(months), ends[block, None] - since)
+        stored_grid = np.take_along_axis(
+            stored_grid[:, :, :-1], np.clip(carried, 0, None)[:, :, None], axis=1
+        )
+        grid[:, :, :-1] += np.where((carried >= 0)[:, :, None], stored_grid, 0.0)
+
+    month = since + np.arange(months)
+    in_scope = month[None, :] <= ends_in_scope[block, None]
+    rows, columns = np.nonzero(in_scope & (np.rint(grid[:, :, 0]) > 0))
+    stats = cells.iloc[block.start + rows].reset_index(drop=True)
+    stats["month"] = month[columns]
+    for index, measure in enumerate(STORED_MEASURES):
+        values = grid[rows, columns, index]
+        stats[measure] = np.rint(values) if measure.endswith("_count") else values
+    return stats
+
+
+def __insert_stats(
+    db_session: Session, series: str, scope: Optional[str], stats: pd.DataFrame
+):
+    if stats.empty:
+        return
+    for key in STATS_KEYS[:2]:
+        stats[key] = stats[key].mask(stats[key] == UNSCOPED, None)
+    stats.insert(0, "series", series)
+    stats.insert(1, "scope", scope)
+    db_session.execute(
+        insert(PropertyMonthlyStats),
+        sanitize_pandas_dataframe(
+            stats,
+            integer_columns=[
+                "month",
+                *[m for m in STORED_MEASURES if m.endswith("_count")],
+            ],
+        ),
+    )
+
+
+def __update_stats(
+    db_session: Session,
+    first_month: int,
+    previous_listings: Optional[pd.DataFrame],
+    current_listings: pd.DataFrame,
+):
+    if previous_listings is None:
+        previous_listings = current_listings.iloc[:0]
+    previous_populations = {
+        (series, scope): population
+        for series, scope, _, population in __populations(previous_listings)
+    }
+    for series, scope, group_by, population in __populations(current_listings):
+        previous_differences = monthly_differences(
+            previous_populations[(series, scope)], scope, group_by
+        )
+        previous_differences[STORED_MEASURES] *= -1
+        differences = [
+            frame
+            for frame in (
+                previous_differences,
+                monthly_differences(population, scope, group_by),
+            )
+            if not frame.empty
+        ]
+        if not differences:
+            continue
+        differences = pd.concat(differences)
+        scope_values = differences["scope_value"].unique()
+
+        scoped = db_session.query(PropertyMonthlyStats).filter(
+            PropertyMonthlyStats.series == series,
+            __equals(PropertyMonthlyStats.scope, scope),
+            __scope_value_in(PropertyMonthlyStats.scope_value, scope_values),
+        )
+        # rewritten from the earliest month that changes, or the last stored
+        # month of a scope_value listed past it (carried forward from it)
+        stored_last_months = __last_months(scoped)
+        since = int(np.nanmin([first_month, *stored_last_months]))
+        earlier_last_months = __last_months(
+            scoped.filter(
+                PropertyMonthlyStats.month < since,
+                PropertyMonthlyStats.listing_count > 0,
+            )
+        )
+        scoped = scoped.filter(PropertyMonthlyStats.month >= since)
+        stored = pd.read_sql_query(scoped.statement, db_session.connection())
+        stored[STATS_KEYS[:2]] = stored[STATS_KEYS[:2]].fillna(UNSCOPED)
+        scoped.delete(synchronize_session=False)
+        stats, last_months = __cumulated_stats(
+            differences,
+            since,
+            stored[[*STATS_KEYS, *STORED_MEASURES]],
+            earlier_last_months,
+        )
+        __insert_stats(db_session, series, scope, stats)
+        # a scope_value listing nothing from since on now ends earlier
+        for scope_value, last_month in last_months[last_months < since].items():
+            db_session.query(PropertyMonthlyStats).filter(
+                PropertyMonthlyStats.series == series,
+                __equals(PropertyMonthlyStats.scope, scope),
+                __scope_value_in(PropertyMonthlyStats.scope_value, [scope_value]),
+                PropertyMonthlyStats.month > last_month,
+            ).delete(synchronize_session=False)
+
+
+def __last_months(scoped) -> pd.Series:
+    # the last month of the scope values of the scoped stats
+    return pd.Series(
+        {
+            UNSCOPED if scope_value is None else scope_value: last_month
+            for scope_value, last_month in scoped.with_entities(
+                PropertyMonthlyStats.scope_value, func.max(PropertyMonthlyStats.month)
+            ).group_by(PropertyMonthlyStats.scope_value)
+        },
+        dtype="float64",
+    )
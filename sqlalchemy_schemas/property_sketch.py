@@ -0,0 +1,227 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, Float, Integer, LargeBinary, String, insert, select, text
+from sqlalchemy.orm import Session
+
+from db.sqlite_setup import Base
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import Property, zipcode_in
+from utils.sketch import QuantileSketch
+
+# the PropertyQueryParams filters sketch cells can answer, any other one needs rows
+SKETCH_CELL_COLUMNS = ("state", "city", "zipcode", "bedrooms")
+LISTING_COLUMNS = [*SKETCH_CELL_COLUMNS, "price", "price_per_square_feet"]
+CELL_MEASURES = ("count", "price_sum", "price_per_square_feet_sum", "price_sketch")
+# rows per batch read while building the cells
+SKETCH_BATCH_SIZE = 8192
+
+
+class PropertySketchCell(Base):
+    """
+    Running sums and a price quantile sketch of the rows `/property/statistics/`
+    aggregates (latest listings with a positive price and price per square feet)
+    for one (state, city, zipcode, bedrooms) combination.
+    """
+
+    __tablename__ = "property_sketch_cells"
+    id = Column(Integer, primary_key=True, autoincrement="auto")
+    state = Column(String)
+    city = Column(String)
+    zipcode = Column(String, index=True)
+    bedrooms = Column(Integer)
+    count = Column(Integer)
+    price_sum = Column(Float)
+    price_per_square_feet_sum = Column(Float)
+    # QuantileSketch.to_bytes of the prices
+    price_sketch = Column(LargeBinary)
+
+
+def refresh_property_sketches(
+    db_session: Session,
+    propertyids_from: Optional[str] = None,
+    previous_listings: Optional[pd.DataFrame] = None,
+):
+    """
+    Rebuilds the sketch cells from the `properties` table, reading the rows in
+    batches ordered by cell so only one batch and the cell spanning two batches
+    are held. propertyids_from names a table with a propertyid column after an
+    incremental load: instead of a rebuild the cells are only changed by the
+    difference between the sketched_listings of those properties now and
+    previous_listings, theirs before the load. Counts, sums and sketch buckets
+    are all additive, so this costs the chunk and not the zipcodes it touches.
+    """
+    if propertyids_from is not None:
+        current_listings = sketched_listings(db_session, propertyids_from)
+        __update_cells(db_session, previous_listings, current_listings)
+        return
+
+    db_session.query(PropertySketchCell).delete(synchronize_session=False)
+    cell_columns = [getattr(Property, column) for column in SKETCH_CELL_COLUMNS]
+    rows = db_session.execute(
+        select(*cell_columns, Property.price, Property.price_per_square_feet)
+        .where(*__sketched_filters())
+        .order_by(*cell_columns)
+        .execution_options(yield_per=SKETCH_BATCH_SIZE)
+    )
+    pending = None
+    for batch in rows.partitions():
+        cells = __cells(pd.DataFrame.from_records(batch, columns=LISTING_COLUMNS))
+        if pending is not None:
+            if __cell_key(pending) == __cell_key(cells[0]):
+                # the first cell of the batch continues the last one of the previous
+                cells[0] = __merged_cell(pending, cells[0])
+            else:
+                cells.insert(0, pending)
+        pending = cells.pop()
+        if cells:
+            db_session.execute(insert(PropertySketchCell), cells)
+    if pending is not None:
+        db_session.execute(insert(PropertySketchCell), [pending])
+
+
+def sketched_listings(db_session: Session, propertyids_from: str) -> pd.DataFrame:
+    """
+    LISTING_COLUMNS of the listings of the properties in the propertyids_from
+    table that the sketch cells count (latest, positive price and ppsf).
+    """
+    rows = db_session.execute(
+        select(
+            *[getattr(Property, column) for column in SKETCH_CELL_COLUMNS],
+            Property.price,
+            Property.price_per_square_feet,
+        ).where(
+            *__sketched_filters(),
+            Property.propertyid.in_(text(f"SELECT propertyid FROM {propertyids_from}")),
+        )
+    ).all()
+    return pd.DataFrame.from_records(rows, columns=LISTING_COLUMNS)
+
+
+def merge_property_sketches(
+    query_params: Optional[PropertyQueryParams], db_session: Session
+) -> Optional[tuple]:
+    """
+    (count, price_sum, price_per_square_feet_sum, price sketch) of the cells
+    matching query_params, None if it filters on anything the cells don't cover
+    or no cell matches (a database whose cells were never built has none).
+    """
+    cells = db_session.query(
+        PropertySketchCell.count,
+        PropertySketchCell.price_sum,
+        PropertySketchCell.price_per_square_feet_sum,
+        PropertySketchCell.price_sketch,
+    )
+    if query_params is not None:
+        filters = query_params.model_dump(exclude_none=True)
+        if set(filters) - set(SKETCH_CELL_COLUMNS):
+            return None
+        for column, value in filters.items():
+            cells = cells.filter(getattr(PropertySketchCell, column) == value)
+
+    cells = cells.all()
+    if not cells:
+        return None
+    return (
+        sum(cell.count for cell in cells),
+        sum(cell.price_sum for cell in cells),
+        sum(cell.price_per_square_feet_sum for cell in cells),
+        QuantileSketch.merged(
+            [QuantileSketch.from_bytes(cell.price_sketch) for cell in cells]
+        ),
+    )
+
+
+def __sketched_filters() -> list:
+    return [
+        Property.is_latest.is_(True),
+        Property.price > 0,
+        Property.price_per_square_feet > 0,
+    ]
+
+
+def __cells(listings: pd.DataFrame, sign: int = 1) -> list:
+    # PropertySketchCell dicts of the listings in order of appearance, with
+    # sign=-1 counting them out
+    cells = []
+    for key, group in listings.groupby(
+        list(SKETCH_CELL_COLUMNS), dropna=False, sort=False
+    ):
+        cell = {
+            column: None if pd.isna(value) else value
+            for column, value in zip(SKETCH_CELL_COLUMNS, key)
+        }
+        if cell["bedrooms"] is not None:
+            cell["bedrooms"] = int(cell["bedrooms"])
+        prices = group["price"].to_numpy(dtype=np.float64)
+        ppsf = group["price_per_square_feet"].to_numpy(dtype=np.float64)
+        sketch = QuantileSketch.from_values(prices)
+        cell.update(
+            count=sign * len(group),
+            price_sum=sign * float(prices.sum()),
+            price_per_square_feet_sum=sign * float(ppsf.sum()),
+            price_sketch=QuantileSketch(sketch.keys, sign * sketch.counts).to_bytes(),
+        )
+        cells.append(cell)
+    return cells
+
+
+def __cell_key(cell) -> tuple:
+    if isinstance(cell, dict):
+        return tuple(cell[column] for column in SKETCH_CELL_COLUMNS)
+    return tuple(getattr(cell, column) for column in SKETCH_CELL_COLUMNS)
+
+
+def __merged_cell(cell: dict, other: dict) -> dict:
+    return {
+        **cell,
+        "count": cell["count"] + other["count"],
+        "price_sum": cell["price_sum"] + other["price_sum"],
+        "price_per_square_feet_sum": (
+            cell["price_per_square_feet_sum"] + other["price_per_square_feet_sum"]
+        ),
+        "price_sketch": QuantileSketch.merged(
+            [
+                QuantileSketch.from_bytes(cell["price_sketch"]),
+                QuantileSketch.from_bytes(other["price_sketch"]),
+            ]
+        ).to_bytes(),
+    }
+
+
+def __update_cells(
+    db_session: Session, previous_listings: pd.DataFrame, current_listings: pd.DataFrame
+):
+    # the stored cells plus the current listings minus the previous ones
+    changes = {}
+    previous_cells = []
+    if previous_listings is not None:
+        previous_cells = __cells(previous_listings, sign=-1)
+    for cell in previous_cells + __cells(current_listings):
+        key = __cell_key(cell)
+        changes[key] = __merged_cell(changes[key], cell) if key in changes else cell
+    if not changes:
+        return
+    zipcodes = {key[SKETCH_CELL_COLUMNS.index("zipcode")] for key in changes}
+    stored = db_session.query(PropertySketchCell).filter(
+        zipcode_in(PropertySketchCell.zipcode, zipcodes)
+    )
+    stored_ids = []
+    for cell in stored:
+        key = __cell_key(cell)
+        if key in changes:
+            stored_ids.append(cell.id)
+            changes[key] = __merged_cell(
+                {
+                    column: getattr(cell, column)
+                    for column in (*SKETCH_CELL_COLUMNS, *CELL_MEASURES)
+                },
+                changes[key],
+            )
+    db_session.query(PropertySketchCell).filter(
+        PropertySketchCell.id.in_(stored_ids)
+    ).delete(synchronize_session=False)
+    # a cell whose listings all moved out or were superseded is gone
+    cells = [cell for cell in changes.values() if cell["count"] > 0]
+    if cells:
+        db_session.execute(insert(PropertySketchCell), cells)
@@ -1,65 +1,238 @@
+from typing import Optional
+import numpy as np
 import pandas as pd
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
+from db.bitmap_index import RowSet
+from db.columnar_store import get_columnar_store
 from middleware.pagination import PageRequest
 from pydantic_models.property import (
+    OutlierPaginatedResponse,
+    OutlierPropertyResponse,
     PaginatedResponse,
     PropertyQueryParams,
+    construct_models,
     convert_df_to_PropertyResponse,
 )
-from sqlalchemy_schemas.property import Property, filter_property_query
-from utils.dataframe import calculate_outliers, sqlalchemy_models_to_dataframe
+from sqlalchemy_schemas.property import (
+    RESPONSE_COLUMNS,
+    RESPONSE_FIELDS,
+    Property,
+    filter_property_query,
+    page_window,
+    paginate_query,
+    paginate_store_rows,
+    response_models,
+)
+from statistics_handlers.quantiles import (
+    IQR_POSITIVE_COLUMNS,
+    IQRBounds,
+    cache_iqr_bounds,
+    cached_iqr_bounds,
+    fetch_quantiles,
+    iqr_population,
+)
+from utils.cache import cached_query
+from utils.outlier_methods import detect_outliers, iqr_deviation_score
 
 
+@cached_query
 def fetch_filtered_property_outliers_on_price(
-    query_params: PropertyQueryParams, pagination: PageRequest, db_session: Session
-) -> PaginatedResponse:
-
-    result = (
-        filter_property_query(query_params=query_params, db_session=db_session)
-        .filter(Property.price > 0, Property.squarefeet > 0)
-        .all()
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    method: str = "iqr",
+    partition_by: Optional[str] = None,
+) -> OutlierPaginatedResponse:
+    return __fetch_outliers(
+        query_params, pagination, db_session, "price", method, partition_by
     )
 
-    df = sqlalchemy_models_to_dataframe(result)
 
-    if df.empty:
-        raise ValueError("No data available for the given query parameters.")
+@cached_query
+def fetch_filtered_property_outliers_on_price_per_squarefeet(
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    method: str = "iqr",
+    partition_by: Optional[str] = None,
+) -> OutlierPaginatedResponse:
+    return __fetch_outliers(
+        query_params,
+        pagination,
+        db_session,
+        "price_per_square_feet",
+        method,
+        partition_by,
+    )
 
-    outliers = calculate_outliers(df, df["price"])
-    db_session.close()
-    return __paginate_outliers_dataframe(outliers, pagination)
 
+def __fetch_outliers(
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    column: str,
+    method: str,
+    partition_by: Optional[str],
+) -> OutlierPaginatedResponse:
+    if method == "iqr" and partition_by is None:
+        page, bounds = __paginate_outliers(query_params, pagination, db_session, column)
+        scores = iqr_deviation_score(
+            np.array([getattr(result, column) for result in page.results]),
+            bounds.p25,
+            bounds.p75,
+        )
+        return __with_scores(page, scores)
+    return __paginate_partitioned_outliers(
+        query_params, pagination, db_session, column, method, partition_by
+    )
 
-def fetch_filtered_property_outliers_on_price_per_squarefeet(
-    query_params: PropertyQueryParams, pagination: PageRequest, db_session: Session
-) -> PaginatedResponse:
 
-    result = (
-        filter_property_query(query_params=query_params, db_session=db_session)
-        .filter(Property.price > 0, Property.squarefeet > 0)
-        .all()
+def __paginate_outliers(
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    column: str,
+) -> tuple:
+    """
+    A page of the rows whose column is outside the IQR bounds of the matching
+    rows. The bounds and their outlier total come from the bounds cache after
+    the first page (or the statistics of the same filter), only the page is
+    decoded (store) or fetched (sql), never every matching row. Returns the
+    page and the bounds.
+    """
+    bounds = cached_iqr_bounds(query_params, db_session, column)
+    store = get_columnar_store(db_session)
+    if store is not None:
+        positions = np.flatnonzero(
+            store.filter_mask(query_params)
+            & store.condition_mask(positive=IQR_POSITIVE_COLUMNS)
+        )
+        db_session.close()
+        values = store.column(column, positions)
+        if bounds is None:
+            series = pd.Series(values)
+            bounds = IQRBounds(
+                len(series), series.quantile(0.25), series.quantile(0.75)
+            )
+            cache_iqr_bounds(query_params, db_session, column, bounds)
+        if bounds.count == 0:
+            raise ValueError("No data available for the given query parameters.")
+        outliers = positions[(values < bounds.lower) | (values > bounds.upper)]
+        page = paginate_store_rows(
+            store, RowSet.from_positions(outliers, store.size), pagination
+        )
+        return page, bounds
+
+    value = getattr(Property, column)
+    query = iqr_population(
+        filter_property_query(
+            query_params=query_params, db_session=db_session, columns=RESPONSE_COLUMNS
+        )
     )
+    if bounds is None:
+        # value is never null in the iqr population, the row count is its count
+        count = query.with_entities(func.count()).scalar()
+        quartiles = (
+            fetch_quantiles(query, value, (0.25, 0.75), count, db_session)
+            if count
+            else {0.25: None, 0.75: None}
+        )
+        bounds = IQRBounds(count, quartiles[0.25], quartiles[0.75])
+        cache_iqr_bounds(query_params, db_session, column, bounds)
+    if bounds.count == 0:
+        db_session.close()
+        raise ValueError("No data available for the given query parameters.")
 
-    df = sqlalchemy_models_to_dataframe(result)
+    outliers = query.filter(or_(value < bounds.lower, value > bounds.upper))
+    if bounds.outliers is None and (pagination.cursor is None or pagination.with_total):
+        # counted once per filter, later pages only fetch themselves
+        bounds.outliers = outliers.with_entities(func.count()).scalar()
+    page = paginate_query(outliers, pagination, db_session, total=bounds.outliers)
+    return page, bounds
 
+
+def __paginate_partitioned_outliers(
+    query_params: PropertyQueryParams,
+    pagination: PageRequest,
+    db_session: Session,
+    column: str,
+    method: str,
+    partition_by: Optional[str],
+) -> OutlierPaginatedResponse:
+    """
+    Outliers of a registered method, every partition_by value judged against
+    its own rows. Scores of all rows come from one vectorized pass, only the
+    page is decoded (store) or fetched (sql).
+    """
+    columns = ["id", column] + ([partition_by] if partition_by else [])
+    store = get_columnar_store(db_session)
+    if store is not None:
+        db_session.close()
+        positions = np.flatnonzero(
+            store.filter_mask(query_params)
+            & store.condition_mask(positive=IQR_POSITIVE_COLUMNS)
+        )
+        df = store.frame(columns, positions)
+    else:
+        query = iqr_population(
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[getattr(Property, name) for name in columns],
+            )
+        ).order_by(Property.id)
+        df = pd.read_sql_query(query.statement, db_session.connection())
     if df.empty:
+        db_session.close()
         raise ValueError("No data available for the given query parameters.")
 
-    outliers = calculate_outliers(df, df["price_per_square_feet"])
-    db_session.close()
-    return __paginate_outliers_dataframe(outliers, pagination)
-
-
-def __paginate_outliers_dataframe(
-    outliers: pd.DataFrame, pageRequest: PageRequest
-) -> PaginatedResponse:
-    page = pageRequest.page
-    page_size = pageRequest.page_size
-    total_outliers = len(outliers)
-    outliers_paginated = outliers.iloc[(page - 1) * page_size : page * page_size]
-    return PaginatedResponse(
-        page=page,
-        page_size=page_size,
-        total=total_outliers,
-        results=convert_df_to_PropertyResponse(outliers_paginated),
+    scores, is_outlier = detect_outliers(
+        method, df[column], df[partition_by].to_numpy() if partition_by else None
+    )
+    ids = df["id"].to_numpy()[is_outlier]
+    scores = scores[is_outlier]
+    start, end, next_cursor = page_window(ids, pagination)
+    if store is not None:
+        results = convert_df_to_PropertyResponse(
+            store.frame(RESPONSE_FIELDS, positions[is_outlier][start:end])
+        )
+    else:
+        results = response_models(
+            db_session.query(*RESPONSE_COLUMNS)
+            .filter(Property.id.in_(ids[start:end].tolist()))
+            .order_by(Property.id)
+        )
+        db_session.close()
+
+    total = len(ids)
+    if pagination.cursor is not None and not pagination.with_total:
+        total = None
+    page = PaginatedResponse(
+        page=pagination.page,
+        page_size=pagination.page_size,
+        total=total,
+        results=results,
+        next_cursor=next_cursor,
+    )
+    return __with_scores(page, scores[start:end])
+
+
+def __with_scores(page: PaginatedResponse, scores) -> OutlierPaginatedResponse:
+    # a partition without spread gives infinite scores, which json can't carry
+    finite = np.isfinite(scores)
+    scores = np.asarray(scores, dtype=np.float64).astype(object)
+    scores[~finite] = None
+    return OutlierPaginatedResponse(
+        total=page.total,
+        page=page.page,
+        page_size=page.page_size,
+        next_cursor=page.next_cursor,
+        results=construct_models(
+            OutlierPropertyResponse,
+            [
+                {**result.__dict__, "deviation_score": score}
+                for result, score in zip(page.results, scores)
+            ],
+        ),
     )
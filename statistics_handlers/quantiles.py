@@ -0,0 +1,137 @@
+import math
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import Property
+from utils.cache import bounds_cache, bounds_key
+
+# statistics and outliers are computed over the latest listings where these are
+# positive. The loader only derives price per square feet for a positive price
+# and squarefeet, so this is the price > 0 and squarefeet > 0 population too
+IQR_POSITIVE_COLUMNS = ("price", "price_per_square_feet")
+
+
+def iqr_population(query: Query) -> Query:
+    return query.filter(
+        *[getattr(Property, column) > 0 for column in IQR_POSITIVE_COLUMNS]
+    )
+
+
+def iqr_bounds(p25: float, p75: float) -> tuple:
+    """(lower, upper) outside of which a value is an outlier."""
+    iqr = p75 - p25
+    return p25 - 1.5 * iqr, p75 + 1.5 * iqr
+
+
+class IQRBounds:
+    """
+    Quartiles of a metric over the iqr_population of a filter, with the number
+    of values outside their bounds once something has counted them.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        p25: Optional[float],
+        p75: Optional[float],
+        outliers: Optional[int] = None,
+    ):
+        self.count = count
+        self.p25 = p25
+        self.p75 = p75
+        self.outliers = outliers
+        if count:
+            self.lower, self.upper = iqr_bounds(p25, p75)
+
+
+def cached_iqr_bounds(
+    query_params: Optional[PropertyQueryParams], db_session: Session, metric: str
+) -> Optional[IQRBounds]:
+    hit, bounds = bounds_cache.get(bounds_key(query_params, db_session, metric))
+    return bounds if hit else None
+
+
+def cache_iqr_bounds(
+    query_params: Optional[PropertyQueryParams],
+    db_session: Session,
+    metric: str,
+    bounds: IQRBounds,
+):
+    """Keeps exact bounds for the statistics and outlier pages of the filter."""
+    bounds_cache.set(bounds_key(query_params, db_session, metric), bounds)
+
+
+def quantile_ranks(count: int, quantiles) -> dict:
+    """
+    (gamma, previous, following) per quantile of count sorted values, the ranks
+    numpy's linear method (as pandas uses it) interpolates between.
+    """
+    ranks = {}
+    for q in quantiles:
+        virtual_index = (count - 1) * effective_quantile(q)
+        previous = min(int(math.floor(virtual_index)), count - 1)
+        ranks[q] = (virtual_index - previous, previous, min(previous + 1, count - 1))
+    return ranks
+
+
+def effective_quantile(q: float) -> float:
+    # pandas hands numpy percentiles, which divides them by 100 again
+    return (q * 100.0) / 100
+
+
+def interpolate(previous: float, following: float, gamma: float) -> float:
+    # numpy's _lerp, interpolates from the nearer end
+    difference = following - previous
+    if gamma >= 0.5:
+        return following - difference * (1 - gamma)
+    return previous + difference * gamma
+
+
+def fetch_ranked_values(query: Query, column, ranks, db_session: Session) -> dict:
+    """
+    Values at the given 0 based ranks of column (ascending, nulls left out) over
+    the rows of query. Only those rows leave the database.
+    """
+    ranked = (
+        query.with_entities(
+            column.label("value"),
+            (func.row_number().over(order_by=column) - 1).label("rank"),
+        )
+        .filter(column.isnot(None))
+        .subquery()
+    )
+    return dict(
+        db_session.query(ranked.c.rank, ranked.c.value)
+        .filter(ranked.c.rank.in_(sorted(ranks)))
+        .all()
+    )
+
+
+def fetch_quantiles(
+    query: Query, column, quantiles, count: int, db_session: Session
+) -> dict:
+    """
+    Quantiles of column over the rows of query, identical to Series.quantile.
+    count is the number of non null values of column.
+    """
+    ranks = quantile_ranks(count, quantiles)
+    values = fetch_ranked_values(query, column, interpolated_ranks(ranks), db_session)
+    return interpolate_quantiles(values, ranks)
+
+
+def interpolated_ranks(ranks: dict) -> set:
+    """Every rank the quantile_ranks of a column need the values of."""
+    return {
+        rank
+        for _, previous, following in ranks.values()
+        for rank in (previous, following)
+    }
+
+
+def interpolate_quantiles(values: dict, ranks: dict) -> dict:
+    """Quantiles from the fetch_ranked_values of their quantile_ranks."""
+    return {
+        q: interpolate(values[previous], values[following], gamma)
+        for q, (gamma, previous, following) in ranks.items()
+    }
@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session
+from pydantic_models.property import PropertyQueryParams
+from pydantic_models.statistics import PropertyRollupGroup, PropertyRollupResponse
+from sqlalchemy_schemas.property import Property, filter_property_query
+from sqlalchemy_schemas.property_cube import property_measures, rollup_property_cube
+from utils.cache import cached_query
+
+
+@cached_query
+def calculate_property_rollup(
+    query_params: PropertyQueryParams, db_session: Session, group_by: str
+) -> PropertyRollupResponse:
+    # pure equality filters are summed from the cube, range filters need the rows
+    groups = rollup_property_cube(query_params, db_session, group_by=[group_by])
+    if groups is None:
+        column = getattr(Property, group_by)
+        groups = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[column, *property_measures()],
+            )
+            .group_by(column)
+            .order_by(column)
+            .all()
+        )
+    db_session.close()
+
+    return PropertyRollupResponse(
+        group_by=group_by,
+        groups=[
+            PropertyRollupGroup(
+                value=group[0],
+                total_properties=group.property_count,
+                average_price=__average(group.price_sum, group.price_count),
+                average_price_per_sqft=__average(
+                    group.price_per_square_feet_sum, group.price_per_square_feet_count
+                ),
+                average_squarefeet=__average(
+                    group.squarefeet_sum, group.squarefeet_count
+                ),
+            )
+            for group in groups
+        ],
+    )
+
+
+def __average(total: float, count: int):
+    return total / count if count else None
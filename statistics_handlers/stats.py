@@ -1,28 +1,206 @@
+from typing import Optional
+import numpy as np
 import pandas as pd
-from sqlalchemy.orm import Session
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Query, Session
+from db.columnar_store import get_columnar_store
 from pydantic_models.property import PropertyQueryParams
-from pydantic_models.statistics import Percentiles, PropertyStatisticsResponse
+from pydantic_models.statistics import (
+    GroupedPropertyStatisticsResponse,
+    Percentiles,
+    PropertyGroupStatistics,
+    PropertyStatisticsResponse,
+)
 from sqlalchemy_schemas.property import Property, filter_property_query
+from sqlalchemy_schemas.property_sketch import merge_property_sketches
+from statistics_handlers.quantiles import (
+    IQR_POSITIVE_COLUMNS,
+    IQRBounds,
+    cache_iqr_bounds,
+    cached_iqr_bounds,
+    effective_quantile,
+    fetch_ranked_values,
+    interpolate_quantiles,
+    interpolated_ranks,
+    iqr_bounds,
+    iqr_population,
+    quantile_ranks,
+)
+from utils.cache import cached_query
+from utils.sketch import QuantileSketch
 
+QUANTILES = (0.25, 0.75, 0.90, 0.99)
 
+
+@cached_query
 def calculate_property_statistics(
-    query_params: PropertyQueryParams, db_session: Session
+    query_params: PropertyQueryParams, db_session: Session, approximate: bool = False
 ) -> PropertyStatisticsResponse:
-    result = (
-        filter_property_query(
-            query_params=query_params,
-            db_session=db_session,
-            columns=[Property.price, Property.price_per_square_feet],
+    if approximate:
+        # filters the sketch cells can't answer (or without any matching cell)
+        # fall through to the exact path
+        merged = merge_property_sketches(query_params, db_session)
+        if merged is not None:
+            db_session.close()
+            return __statistics_from_sketch(*merged)
+
+    store = get_columnar_store(db_session)
+    if store is not None:
+        db_session.close()
+        df = store.select(
+            query_params,
+            columns=["price", "price_per_square_feet"],
+            positive=IQR_POSITIVE_COLUMNS,
+        )
+        if df.empty:
+            raise ValueError("No data available for the given query parameters.")
+        statistics = __statistics_from_dataframe(df)
+    else:
+        query = iqr_population(
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[Property.price, Property.price_per_square_feet],
+            )
         )
-        .filter(Property.price > 0, Property.price_per_square_feet > 0)
-        .all()
+        statistics = __statistics_from_query(
+            query, db_session, cached_iqr_bounds(query_params, db_session, "price")
+        )
+        db_session.close()
+
+    # the outlier pages of the same filter start from these bounds and total
+    cache_iqr_bounds(
+        query_params,
+        db_session,
+        "price",
+        IQRBounds(
+            statistics.total_properties,
+            statistics.percentiles.percentile_25_price,
+            statistics.percentiles.percentile_75_price,
+            statistics.outlier_properties_count,
+        ),
     )
-    # Read the prices and squarefeet columns
-    df = pd.DataFrame(result, columns=["price", "price_per_square_feet"])
+    return statistics
 
-    if df.empty:
-        raise ValueError("No data available for the given query parameters.")
 
+@cached_query
+def calculate_grouped_property_statistics(
+    query_params: PropertyQueryParams,
+    db_session: Session,
+    group_by: str,
+    order_by: str = "total_properties",
+    descending: bool = True,
+    limit: Optional[int] = None,
+) -> GroupedPropertyStatisticsResponse:
+    """
+    calculate_property_statistics for every value of group_by from one scan of
+    the matching rows, the limit first groups in order_by order.
+    """
+    columns = [group_by, "price", "price_per_square_feet"]
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(query_params, columns=columns, positive=IQR_POSITIVE_COLUMNS)
+    else:
+        query = iqr_population(
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[getattr(Property, column) for column in columns],
+            )
+        )
+        df = pd.read_sql_query(query.statement, db_session.connection())
+    db_session.close()
+
+    summary = __grouped_statistics(df, group_by)
+    summary = summary.sort_values(order_by, ascending=not descending, kind="stable")
+    groups = summary if limit is None else summary.head(limit)
+    return GroupedPropertyStatisticsResponse(
+        group_by=group_by,
+        order_by=order_by,
+        total_groups=len(summary),
+        groups=[
+            PropertyGroupStatistics(
+                value=__group_value(group.value, group_by),
+                statistics=__statistics_response(
+                    average_price=group.average_price,
+                    average_price_per_sqft=group.average_price_per_sqft,
+                    total_properties=group.total_properties,
+                    percentiles=(
+                        group.percentile_25_price,
+                        group.median_price,
+                        group.percentile_75_price,
+                        group.percentile_90_price,
+                        group.percentile_99_price,
+                    ),
+                    outliers_count=group.outlier_properties_count,
+                ),
+            )
+            for group in groups.itertuples(index=False)
+        ],
+    )
+
+
+def __grouped_statistics(df: pd.DataFrame, group_by: str) -> pd.DataFrame:
+    """
+    One row of statistics per group, vectorized over the groups: the rows are
+    sorted by (group, price) once and every percentile is read at the same
+    ranks calculate_property_statistics interpolates between.
+    """
+    codes, values = pd.factorize(df[group_by], use_na_sentinel=False)
+    prices = df["price"].to_numpy(dtype=np.float64)
+    counts = np.bincount(codes, minlength=len(values))
+    starts = np.cumsum(counts) - counts
+    sorted_prices = prices[np.lexsort((prices, codes))]
+
+    quantiles = {}
+    for q in QUANTILES:
+        virtual_index = (counts - 1) * effective_quantile(q)
+        previous = np.minimum(np.floor(virtual_index).astype(np.int64), counts - 1)
+        following = np.minimum(previous + 1, counts - 1)
+        gamma = virtual_index - previous
+        lower = sorted_prices[starts + previous]
+        upper = sorted_prices[starts + following]
+        difference = upper - lower
+        # numpy's _lerp, interpolates from the nearer end
+        quantiles[q] = np.where(
+            gamma >= 0.5, upper - difference * (1 - gamma), lower + difference * gamma
+        )
+    median = (
+        sorted_prices[starts + (counts - 1) // 2] + sorted_prices[starts + counts // 2]
+    ) / 2
+
+    lower_bound, upper_bound = iqr_bounds(quantiles[0.25], quantiles[0.75])
+    is_outlier = (prices < lower_bound[codes]) | (prices > upper_bound[codes])
+
+    return pd.DataFrame(
+        {
+            "value": np.asarray(values, dtype=object),
+            "total_properties": counts,
+            "average_price": np.bincount(codes, weights=prices) / counts,
+            "average_price_per_sqft": np.bincount(
+                codes, weights=df["price_per_square_feet"].to_numpy(dtype=np.float64)
+            )
+            / counts,
+            "median_price": median,
+            "outlier_properties_count": np.bincount(
+                codes, weights=is_outlier, minlength=len(values)
+            ).astype(np.int64),
+            "percentile_25_price": quantiles[0.25],
+            "percentile_75_price": quantiles[0.75],
+            "percentile_90_price": quantiles[0.90],
+            "percentile_99_price": quantiles[0.99],
+        }
+    )
+
+
+def __group_value(value, group_by: str):
+    if pd.isna(value):
+        return None
+    # bedrooms come back as floats once a group is missing them
+    return int(value) if group_by == "bedrooms" else value
+
+
+def __statistics_from_dataframe(df: pd.DataFrame) -> PropertyStatisticsResponse:
     prices = df["price"]
     ppsf = df["price_per_square_feet"]
     # calculate percentiles
@@ -31,19 +209,102 @@ def calculate_property_statistics(
     p75 = prices.quantile(0.75)
     p90 = prices.quantile(0.90)
     p99 = prices.quantile(0.99)
-    iqr = p75 - p25
-
-    average_price = prices.mean()
-    average_price_per_sqft = ppsf.mean()
-    total_properties = len(prices)
 
     # calculate outliers
-    lower_bound = p25 - 1.5 * iqr
-    upper_bound = p75 + 1.5 * iqr
+    lower_bound, upper_bound = iqr_bounds(p25, p75)
     outliers_count = len(df[(prices < lower_bound) | (prices > upper_bound)])
 
-    db_session.close()
+    return __statistics_response(
+        average_price=prices.mean(),
+        average_price_per_sqft=ppsf.mean(),
+        total_properties=len(prices),
+        percentiles=(p25, p50, p75, p90, p99),
+        outliers_count=outliers_count,
+    )
+
+
+def __statistics_from_query(
+    query: Query, db_session: Session, bounds: Optional[IQRBounds] = None
+) -> PropertyStatisticsResponse:
+    """
+    Same statistics computed inside the database: the count and averages in one
+    aggregate, the percentiles from the few ranks they interpolate between and
+    the outliers as a count against the bounds. Only scalars are returned,
+    however many rows match. Cached bounds save their quartiles and outlier
+    count.
+    """
+    total_properties, average_price, average_price_per_sqft = query.with_entities(
+        func.count(), func.avg(Property.price), func.avg(Property.price_per_square_feet)
+    ).one()
+    if total_properties == 0:
+        raise ValueError("No data available for the given query parameters.")
 
+    ranks = quantile_ranks(
+        total_properties,
+        QUANTILES if bounds is None else [q for q in QUANTILES if q > 0.75],
+    )
+    median_positions = ((total_properties - 1) // 2, total_properties // 2)
+    prices = fetch_ranked_values(
+        query,
+        Property.price,
+        interpolated_ranks(ranks) | set(median_positions),
+        db_session,
+    )
+
+    quantiles = interpolate_quantiles(prices, ranks)
+    if bounds is not None:
+        quantiles[0.25], quantiles[0.75] = bounds.p25, bounds.p75
+    # pandas' median averages the middle pair instead of interpolating
+    p50 = (prices[median_positions[0]] + prices[median_positions[1]]) / 2
+    p25, p75 = quantiles[0.25], quantiles[0.75]
+    lower_bound, upper_bound = iqr_bounds(p25, p75)
+    outliers_count = bounds.outliers if bounds is not None else None
+    if outliers_count is None:
+        outliers_count = (
+            query.with_entities(func.count())
+            .filter(or_(Property.price < lower_bound, Property.price > upper_bound))
+            .scalar()
+        )
+
+    return __statistics_response(
+        average_price=average_price,
+        average_price_per_sqft=average_price_per_sqft,
+        total_properties=total_properties,
+        percentiles=(p25, p50, p75, quantiles[0.90], quantiles[0.99]),
+        outliers_count=outliers_count,
+    )
+
+
+def __statistics_from_sketch(
+    count: int,
+    price_sum: float,
+    price_per_square_feet_sum: float,
+    sketch: QuantileSketch,
+) -> PropertyStatisticsResponse:
+    # count and averages come from exact running sums, only the rest is estimated
+    p25, p50, p75, p90, p99 = (
+        sketch.quantile(q) for q in (0.25, 0.50, 0.75, 0.90, 0.99)
+    )
+    lower_bound, upper_bound = iqr_bounds(p25, p75)
+    return __statistics_response(
+        average_price=price_sum / count,
+        average_price_per_sqft=price_per_square_feet_sum / count,
+        total_properties=count,
+        percentiles=(p25, p50, p75, p90, p99),
+        outliers_count=sketch.count_outside(lower_bound, upper_bound),
+        relative_error=sketch.relative_accuracy,
+    )
+
+
+def __statistics_response(
+    average_price: float,
+    average_price_per_sqft: float,
+    total_properties: int,
+    percentiles: tuple,
+    outliers_count: int,
+    relative_error: Optional[float] = None,
+) -> PropertyStatisticsResponse:
+    p25, p50, p75, p90, p99 = percentiles
     return PropertyStatisticsResponse(
         average_price=average_price,
         median_price=p50,
@@ -57,4 +318,5 @@ def calculate_property_statistics(
             percentile_99_price=p99,
         ),
         outlier_properties_count=outliers_count,
+        relative_error=relative_error,
     )
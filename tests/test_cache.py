@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+from db import sqlite_setup
+from pydantic_models.property import PropertyQueryParams
+from utils.cache import QueryCache, cached_query, normalize_params
+import utils.cache
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = QueryCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_expiry(self):
+        cache = QueryCache(max_entries=2, ttl_seconds=0)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), (False, None))
+
+    def test_normalize_params_ignores_unset_filters(self):
+        self.assertEqual(
+            normalize_params(PropertyQueryParams(city="Miami", price_min=100000)),
+            normalize_params(PropertyQueryParams(price_min=100000.0, city="Miami")),
+        )
+
+    def test_cached_query_invalidated_by_dataset_version(self):
+        calls = []
+
+        @cached_query
+        def handler(query_params, db_session):
+            calls.append(query_params)
+            return len(calls)
+
+        session = mock.MagicMock()
+        with mock.patch.object(
+            utils.cache, "query_cache", QueryCache(max_entries=10, ttl_seconds=60)
+        ):
+            params = PropertyQueryParams(city="Miami")
+            self.assertEqual(handler(query_params=params, db_session=session), 1)
+            self.assertEqual(handler(query_params=params, db_session=session), 1)
+            sqlite_setup.bump_dataset_version()
+            self.assertEqual(handler(query_params=params, db_session=session), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+import datetime
+import unittest
+from unittest import mock
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import sqlalchemy_schemas.property
+from db.bitmap_index import BitmapIndex, RowSet
+from db.columnar_store import ColumnarPropertyStore
+from middleware.pagination import PageRequest
+from pydantic_models.property import PaginatedResponse, PropertyQueryParams
+from sqlalchemy_schemas.property import (
+    Base,
+    Property,
+    filter_properties,
+    filter_property_query,
+)
+from utils.cache import query_cache
+from utils.json_response import ModelJSONResponse
+
+engine = create_engine("sqlite:///:memory:")
+Session = sessionmaker(bind=engine)
+Base.metadata.create_all(engine)
+
+session = Session()
+session.add_all(
+    [
+        Property(
+            propertyid=i,
+            address=f"{i} Main St",
+            city=["Miami", "Orlando", None][i % 3],
+            state="FL",
+            zipcode=["33186", "32801"][i % 2],
+            price=None if i % 7 == 0 else 100000.0 + i * 5000,
+            bedrooms=None if i % 5 == 0 else i % 4,
+            bathrooms=1.5 + i % 2,
+            squarefeet=1000.0 + i * 10,
+            price_per_square_feet=(100000.0 + i * 5000) / (1000.0 + i * 10),
+            datelisted=datetime.datetime(2021, 1, 1) + datetime.timedelta(days=i),
+            is_latest=i % 4 != 0,
+        )
+        for i in range(60)
+    ]
+)
+session.commit()
+
+
+class TestColumnarPropertyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Session()
+        self.store = ColumnarPropertyStore.from_database(engine)
+
+    def tearDown(self):
+        self.session.close()
+
+    def assertSameRows(self, query_params, latest=True):
+        expected = [
+            row.id
+            for row in filter_property_query(
+                query_params=query_params,
+                db_session=self.session,
+                columns=[Property.id],
+                latest=latest,
+            ).order_by(Property.id)
+        ]
+        mask = self.store.filter_mask(query_params, latest=latest)
+        self.assertEqual(list(self.store.id[mask]), expected)
+
+    def test_filter_mask_matches_filter_property_query(self):
+        self.assertSameRows(None)
+        self.assertSameRows(None, latest=False)
+        self.assertSameRows(PropertyQueryParams(city="Miami", bedrooms=2))
+        self.assertSameRows(PropertyQueryParams(zipcode="32801", price_min=200000))
+        self.assertSameRows(
+            PropertyQueryParams(bathrooms=2.5, squarefeet_max=1300), latest=False
+        )
+        self.assertSameRows(PropertyQueryParams(city="Tampa"))
+
+    def test_range_slice(self):
+        positions = self.store.range_slice("price", 200000, 250000)
+        self.assertEqual(
+            sorted(self.store.propertyid[positions]),
+            [i for i in range(20, 31) if i % 7 != 0],
+        )
+        # prices are missing for every 7th row and never match a range
+        self.assertEqual(len(self.store.range_slice("price", minimum=0)), 60 - 9)
+        # a narrow range drives the filter, the bitmaps are checked on its rows
+        self.assertSameRows(PropertyQueryParams(price_min=200000, price_max=210000))
+        self.assertSameRows(
+            PropertyQueryParams(
+                city="Orlando", price_max=180000, squarefeet_min=1050.5
+            ),
+            latest=False,
+        )
+
+    def test_select_decodes_missing_values(self):
+        df = self.store.select(None, columns=["id", "city", "price", "bedrooms"])
+        rows = {row.id: row for row in self.session.query(Property)}
+        for _, row in df.iterrows():
+            expected = rows[row["id"]]
+            self.assertEqual(row["city"], expected.city)
+            if expected.price is None:
+                self.assertTrue(np.isnan(row["price"]))
+            if expected.bedrooms is None:
+                self.assertTrue(np.isnan(row["bedrooms"]))
+            else:
+                self.assertEqual(row["bedrooms"], expected.bedrooms)
+
+    def test_condition_mask(self):
+        mask = self.store.condition_mask(
+            positive=["price"], not_null=["city"], equals={"zipcode": "33186"}
+        )
+        expected = (
+            self.session.query(Property.id)
+            .filter(
+                Property.price > 0,
+                Property.city.isnot(None),
+                Property.zipcode == "33186",
+            )
+            .order_by(Property.id)
+        )
+        self.assertEqual(list(self.store.id[mask]), [row.id for row in expected])
+
+    def test_filter_properties_from_store(self):
+        query_params = PropertyQueryParams(
+            city="Miami", zipcode="33186", price_min=150000
+        )
+        responses = []
+        for store in (None, self.store):
+            query_cache.clear()
+            with mock.patch.object(
+                sqlalchemy_schemas.property,
+                "get_columnar_store",
+                lambda db_session: store,
+            ):
+                responses.append(
+                    filter_properties(
+                        query_params=query_params,
+                        pagination=PageRequest(page=2, page_size=2),
+                        db_session=Session(),
+                    )
+                )
+        self.assertEqual([response.total for response in responses], [3, 3])
+        for response in responses:
+            self.assertEqual([item.propertyid for item in response.results], [54])
+
+    def test_response_bytes_match_validated_response(self):
+        # pages skip validation, both paths must still encode what pydantic would
+        bodies = []
+        for store in (None, self.store):
+            query_cache.clear()
+            with mock.patch.object(
+                sqlalchemy_schemas.property,
+                "get_columnar_store",
+                lambda db_session: store,
+            ):
+                response = filter_properties(
+                    query_params=PropertyQueryParams(city="Miami"),
+                    pagination=PageRequest(page=1, page_size=50),
+                    db_session=Session(),
+                )
+            body = ModelJSONResponse(response).body
+            validated = PaginatedResponse.model_validate(response.model_dump())
+            self.assertEqual(body, validated.model_dump_json().encode())
+            bodies.append(body)
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertIn(b'"price":null', bodies[0])
+        self.assertIn(b'"bedrooms":null', bodies[0])
+
+
+class TestRowSet(unittest.TestCase):
+
+    def test_intersect_sparse_and_bitmap(self):
+        size = 1000
+        dense = RowSet.from_mask(np.arange(size) % 2 == 0)
+        sparse = RowSet.from_positions(np.array([3, 4, 10, 999]), size)
+        self.assertTrue(dense.is_bitmap)
+        self.assertFalse(sparse.is_bitmap)
+        self.assertEqual(dense.count(), 500)
+        self.assertEqual(list(dense.intersect(sparse).positions()), [4, 10])
+        self.assertEqual(list(sparse.intersect(dense).positions()), [4, 10])
+        odd = RowSet.from_mask(np.arange(size) % 2 == 1)
+        self.assertEqual(dense.intersect(odd).count(), 0)
+        self.assertEqual(RowSet.full(size).intersect(odd).count(), 500)
+
+    def test_bitmap_index_lookup(self):
+        index = BitmapIndex.from_values(np.array([2.0, np.nan, 1.5, 2.0, 2.0]))
+        self.assertEqual(list(index.lookup(2).positions()), [0, 3, 4])
+        self.assertEqual(list(index.lookup(1.5).positions()), [2])
+        self.assertEqual(index.lookup(3).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
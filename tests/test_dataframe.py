@@ -0,0 +1,94 @@
+import unittest
+import numpy as np
+import pandas as pd
+from utils.dataframe import forwardfilled_monthly_aggregates
+
+
+def dense_forwardfill(df: pd.DataFrame) -> pd.DataFrame:
+    # the propertyid x month grid forward filled per property, what the
+    # historical visualizations used to group
+    df = df.sort_values("datelisted", kind="stable")
+    df["datelisted"] = df["datelisted"].dt.to_period("M")
+    all_periods = pd.period_range(
+        start=df["datelisted"].min(), end=df["datelisted"].max(), freq="M"
+    )
+    complete_index = pd.MultiIndex.from_product(
+        [df["propertyid"].unique(), all_periods], names=["propertyid", "datelisted"]
+    )
+    df = df.drop_duplicates(subset=["propertyid", "datelisted"]).set_index(
+        ["propertyid", "datelisted"]
+    )
+    df = df.reindex(complete_index).sort_index()
+    return df.groupby("propertyid").ffill().reset_index()
+
+
+class TestForwardfilledMonthlyAggregates(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        size = 4000
+        self.df = pd.DataFrame(
+            {
+                "propertyid": rng.integers(0, 600, size),
+                "price": np.where(
+                    rng.random(size) < 0.1, np.nan, rng.lognormal(12, 1, size)
+                ),
+                "squarefeet": rng.lognormal(7, 0.5, size),
+                "zipcode": np.where(
+                    rng.random(size) < 0.05,
+                    None,
+                    rng.choice(["33186", "32801", "33139"], size),
+                ),
+                "datelisted": pd.Timestamp("2015-01-01")
+                + pd.to_timedelta(rng.integers(0, 5 * 365 * 86400, size), unit="s"),
+            }
+        )
+        self.aggregations = {
+            "average_price": ("price", "mean"),
+            "number_of_listings": ("price", "size"),
+            "average_area": ("squarefeet", "mean"),
+        }
+
+    def test_matches_dense_forwardfill(self):
+        expected = (
+            dense_forwardfill(self.df)
+            .groupby("datelisted")
+            .agg(**self.aggregations)
+            .reset_index()
+        )
+        result = forwardfilled_monthly_aggregates(self.df, self.aggregations)
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
+
+    def test_matches_dense_forwardfill_per_group(self):
+        expected = (
+            dense_forwardfill(self.df)
+            .groupby(["zipcode", "datelisted"])
+            .agg(**self.aggregations)
+            .reset_index()
+        )
+        result = forwardfilled_monthly_aggregates(
+            self.df, self.aggregations, group_by="zipcode"
+        )
+        pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
+
+    def test_carries_earliest_listing_of_the_month_forward(self):
+        df = pd.DataFrame(
+            {
+                "propertyid": [1, 1, 1, 2],
+                "price": [300.0, 100.0, 200.0, 1000.0],
+                "datelisted": pd.to_datetime(
+                    ["2020-01-20", "2020-01-05", "2020-03-01", "2020-02-10"]
+                ),
+            }
+        )
+        result = forwardfilled_monthly_aggregates(
+            df, {"price": ("price", "mean"), "listings": ("price", "size")}
+        )
+        # the earliest listing of a month counts, property 2 only from february
+        self.assertEqual(list(result["price"]), [100.0, 550.0, 600.0])
+        self.assertEqual(list(result["listings"]), [2, 2, 2])
+        self.assertEqual(str(result["datelisted"].iloc[0]), "2020-01")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import csv
+import datetime
+import io
+import json
+import unittest
+from unittest import mock
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import db.export_data
+from db.export_data import (
+    EXPORT_COLUMNS,
+    EXPORT_MEDIA_TYPES,
+    export_properties,
+    export_properties_page,
+)
+from middleware.content_negotiation import negotiate_format
+from middleware.pagination import PageRequest
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import Base, Property, filter_properties
+from utils.arrow import import_pyarrow
+from utils.cache import query_cache
+
+try:
+    pyarrow = import_pyarrow()
+except ImportError:
+    pyarrow = None
+
+engine = create_engine("sqlite:///:memory:")
+Session = sessionmaker(bind=engine)
+Base.metadata.create_all(engine)
+
+session = Session()
+session.add_all(
+    [
+        Property(
+            propertyid=i,
+            address=f"{i} Main St, Unit {i}",
+            city=["Miami", "Orlando"][i % 2],
+            state="FL",
+            zipcode="33186",
+            price=None if i % 7 == 0 else 100000.0 + i * 5000,
+            bedrooms=None if i % 5 == 0 else i % 4,
+            bathrooms=1.5,
+            squarefeet=1000.0 + i * 10,
+            price_per_square_feet=None,
+            datelisted=datetime.datetime(2021, 1, 1) + datetime.timedelta(days=i),
+        )
+        for i in range(25)
+    ]
+)
+session.commit()
+session.close()
+
+
+class TestExportData(unittest.TestCase):
+
+    def setUp(self):
+        self.query_params = PropertyQueryParams(city="Miami")
+        query_cache.clear()
+        self.page = filter_properties(
+            query_params=self.query_params,
+            pagination=PageRequest(page=1, page_size=100),
+            db_session=Session(),
+        )
+
+    def export(self, export_format: str) -> list:
+        # small batches, the rows have to span several chunks
+        with mock.patch.object(db.export_data, "EXPORT_BATCH_SIZE", 5):
+            with mock.patch.object(db.export_data, "COLUMNAR_BATCH_SIZE", 5):
+                return list(export_properties(self.query_params, export_format, engine))
+
+    def test_export_ndjson_matches_pages(self):
+        chunks = self.export("ndjson")
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        self.assertEqual(
+            rows, [result.model_dump(mode="json") for result in self.page.results]
+        )
+
+    def test_export_csv(self):
+        chunks = self.export("csv")
+        # the header goes out before the query runs
+        self.assertEqual(chunks[0].decode().strip(), ",".join(EXPORT_COLUMNS))
+        rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+        self.assertEqual(
+            [int(row["propertyid"]) for row in rows],
+            [result.propertyid for result in self.page.results],
+        )
+        self.assertEqual(rows[1]["address"], "2 Main St, Unit 2")
+        self.assertEqual(rows[0]["bedrooms"], "")
+        self.assertEqual(rows[1]["bedrooms"], "2")
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export_arrow_and_parquet(self):
+        expected = [result.model_dump() for result in self.page.results]
+        stream = b"".join(self.export("arrow"))
+        table = pyarrow.ipc.open_stream(stream).read_all()
+        self.assertEqual(table.to_batches()[0].num_rows, 5)
+        self.assertEqual(table.to_pylist(), expected)
+        parquet = pyarrow.BufferReader(b"".join(self.export("parquet")))
+        self.assertEqual(pyarrow.parquet.read_table(parquet).to_pylist(), expected)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export_properties_page_arrow(self):
+        stream = export_properties_page(
+            query_params=self.query_params,
+            pagination=PageRequest(page=2, page_size=4),
+            db_session=Session(),
+            export_format="arrow",
+        )
+        table = pyarrow.ipc.open_stream(stream).read_all()
+        self.assertEqual(
+            table.column("propertyid").to_pylist(),
+            [result.propertyid for result in self.page.results[4:8]],
+        )
+        self.assertEqual(table.schema.metadata[b"total"], b"13")
+
+
+class TestNegotiateFormat(unittest.TestCase):
+
+    def test_negotiate_format(self):
+        def negotiate(accept, requested=None):
+            return negotiate_format(
+                requested, accept, EXPORT_MEDIA_TYPES, default="ndjson"
+            )
+
+        self.assertEqual(negotiate(None), "ndjson")
+        self.assertEqual(negotiate("text/csv", requested="arrow"), "arrow")
+        self.assertEqual(negotiate("text/html, */*;q=0.8"), "ndjson")
+        self.assertEqual(
+            negotiate("text/csv;q=0.5, application/vnd.apache.parquet"), "parquet"
+        )
+        self.assertEqual(negotiate("text/html, text/csv;q=0.1"), "csv")
+        # a browser's Accept header without */* still gets the default
+        self.assertEqual(negotiate("text/html, text/csv;q=0"), "ndjson")
+        self.assertEqual(negotiate("text/html"), "ndjson")
+        with self.assertRaises(HTTPException) as context:
+            negotiate(None, requested="xml")
+        self.assertEqual(context.exception.status_code, 406)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,432 @@
+import glob
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import pandas as pd
+from sqlalchemy import create_engine, func, inspect
+from sqlalchemy.orm import Session, sessionmaker
+from db import sqlite_setup
+import db.load_data
+from db.load_data import (
+    clean_property_dataframe,
+    insert_property_dataframe,
+    load_data,
+    migrate_database,
+    read_csv_chunks,
+    reload_data,
+)
+from sqlalchemy_schemas.load_checkpoint import LoadCheckpoint
+from sqlalchemy_schemas.property import Base, Property
+from sqlalchemy_schemas.property_cube import PropertyCubeCell
+from sqlalchemy_schemas.property_monthly_stats import PropertyMonthlyStats
+import sqlalchemy_schemas.property_sketch
+from sqlalchemy_schemas.property_sketch import (
+    PropertySketchCell,
+    refresh_property_sketches,
+)
+
+CSV = """propertyid,address,city,state,zipcode,price,bedrooms,bathrooms,squarefeet,datelisted,geometry
+1,1 Main St,Miami,FL,33186,300000.0,3.0,2.0,1500.0,2021-01-01 10:00:00,POINT (0 0)
+2,2 Main St,Miami,FL,33186,0.0,2.0,1.0,900.0,2021-02-01 10:00:00,POINT (0 0)
+3,3 Main St,Miami,FL,33186,,,,,,POINT (0 0)
+4,4 Main St,Miami,FL,33186,100.0,1.0,1.0,,2021-03-01 10:00:00,POINT (0 0)
+5,5 Main St,Miami,FL,33186,600000000.0,4.0,3.0,2000.0,2021-04-01 10:00:00,POINT (0 0)
+6,6 Main St,Miami,FL,33186,1000.0,4.0,3.0,5000.0,2021-05-01 10:00:00,POINT (0 0)
+"""
+
+
+class TestLoadData(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        self.session = self.Session()
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write(CSV)
+        self.csv_file = file.name
+
+    def tearDown(self):
+        self.session.close()
+        os.remove(self.csv_file)
+
+    def fetch_test_session(self):
+        yield self.Session()
+
+    def test_clean_property_dataframe_unfiltered(self):
+        data = clean_property_dataframe(pd.read_csv(io.StringIO(CSV)), False)
+        self.assertEqual(len(data), 6)
+        self.assertAlmostEqual(data["price_per_square_feet"].iloc[0], 200.0)
+        # no price per square feet without a positive price and squarefeet
+        self.assertTrue(data["price_per_square_feet"].iloc[1:4].isna().all())
+        self.assertEqual(data["price"].iloc[1], 0)
+
+    def test_clean_property_dataframe_filtered(self):
+        data = clean_property_dataframe(pd.read_csv(io.StringIO(CSV)), True)
+        # 100.0 is below the price floor, 600M above the ceiling, 0.2 ppsf below 1
+        self.assertEqual(list(data["propertyid"]), [1, 2, 3])
+        self.assertTrue(pd.isna(data["price"].iloc[1]))
+
+    def test_insert_property_dataframe(self):
+        data = clean_property_dataframe(pd.read_csv(io.StringIO(CSV)), True)
+        insert_property_dataframe(data, self.session)
+        properties = self.session.query(Property).order_by(Property.id).all()
+        self.assertEqual(len(properties), 3)
+        self.assertEqual(properties[0].zipcode, "33186")
+        self.assertEqual(properties[0].bedrooms, 3)
+        self.assertEqual(properties[0].datelisted, pd.Timestamp("2021-01-01 10:00:00"))
+        self.assertIsNone(properties[1].price)
+        self.assertIsNone(properties[2].datelisted)
+        self.assertIsNone(properties[2].bedrooms)
+
+    def test_read_csv_chunks_keeps_quoted_newlines(self):
+        with open(self.csv_file, "a") as file:
+            file.write('7,"7 Main St\nUnit 2",Miami,FL,33186,,,,,,POINT (0 0)\n')
+        chunks = list(read_csv_chunks(self.csv_file, chunk_size=4))
+        self.assertEqual([rows for _, _, _, rows in chunks], [4, 3])
+        self.assertEqual(chunks[-1][2], os.path.getsize(self.csv_file))
+        last = pd.read_csv(io.BytesIO(chunks[-1][0] + chunks[-1][1]))
+        self.assertEqual(last["address"].iloc[-1], "7 Main St\nUnit 2")
+
+    def test_load_data_resumes_from_checkpoint(self):
+        original_insert = db.load_data.insert_property_dataframe
+        inserts = []
+
+        def failing_insert(data, db_session):
+            if len(inserts) == 1:
+                raise RuntimeError("interrupted")
+            inserts.append(len(data))
+            original_insert(data, db_session)
+
+        with mock.patch.object(
+            db.load_data, "fetch_db_session", self.fetch_test_session
+        ):
+            with mock.patch.object(
+                db.load_data, "insert_property_dataframe", failing_insert
+            ):
+                with self.assertRaises(RuntimeError):
+                    load_data(self.csv_file, False, chunk_size=2)
+            self.assertEqual(self.session.query(Property).count(), 2)
+
+            load_data(self.csv_file, False, chunk_size=2, resume=True)
+
+        checkpoint = self.session.query(LoadCheckpoint).one()
+        self.assertTrue(checkpoint.is_complete)
+        self.assertEqual(checkpoint.rows_loaded, 6)
+        self.assertEqual(
+            [p.propertyid for p in self.session.query(Property).order_by(Property.id)],
+            [1, 2, 3, 4, 5, 6],
+        )
+
+    def test_load_data_parallel_parse_matches_serial(self):
+        lines = CSV.splitlines()
+        with open(self.csv_file, "w") as file:
+            file.write("\n".join(lines + lines[1:] * 4) + "\n")
+            file.write('7,"7 Main St\nUnit 2",Miami,FL,33186,5000.0,,,,,POINT (0 0)\n')
+
+        loads = []
+        for workers in (1, 2):
+            engine = create_engine("sqlite:///:memory:")
+            Base.metadata.create_all(engine)
+            checkpoints = []
+            load_data(
+                self.csv_file,
+                True,
+                chunk_size=4,
+                workers=workers,
+                on_progress=lambda checkpoint: checkpoints.append(
+                    (
+                        checkpoint.byte_offset,
+                        checkpoint.rows_read,
+                        checkpoint.rows_loaded,
+                    )
+                ),
+                bind=engine,
+            )
+            with engine.connect() as connection:
+                properties = pd.read_sql_query(
+                    "SELECT * FROM properties ORDER BY id", connection
+                )
+            loads.append((properties, checkpoints))
+
+        (serial, serial_checkpoints), (parallel, parallel_checkpoints) = loads
+        pd.testing.assert_frame_equal(parallel, serial)
+        self.assertEqual(len(serial), 16)
+        # every chunk is committed at the same resume offset either way
+        self.assertEqual(parallel_checkpoints, serial_checkpoints)
+        self.assertEqual(len(serial_checkpoints), 9)
+        self.assertEqual(serial_checkpoints[-1][0], os.path.getsize(self.csv_file))
+
+    def test_load_data_append_mode_upserts(self):
+        with mock.patch.object(
+            db.load_data, "fetch_db_session", self.fetch_test_session
+        ):
+            load_data(self.csv_file, False)
+            delta = CSV.splitlines()[0:3] + [
+                # price changed for an existing listing
+                "3,3 Main St,Miami,FL,33186,250000.0,,,,,POINT (0 0)",
+                # a new listing of an existing property
+                "1,1 Main St,Miami,FL,33186,310000.0,3.0,2.0,1500.0,2022-01-01 10:00:00,",
+            ]
+            with open(self.csv_file, "w") as file:
+                file.write("\n".join(delta) + "\n")
+            load_data(self.csv_file, False, mode="append")
+
+        self.assertEqual(self.session.query(Property).count(), 7)
+        self.assertEqual(
+            self.session.query(Property).filter(Property.propertyid == 3).one().price,
+            250000.0,
+        )
+        listings = (
+            self.session.query(Property)
+            .filter(Property.propertyid == 1)
+            .order_by(Property.datelisted)
+            .all()
+        )
+        self.assertEqual([listing.is_latest for listing in listings], [False, True])
+        self.assertEqual(self.session.query(LoadCheckpoint).one().rows_loaded, 2)
+        # the zipcode's sketch cells were rebuilt from the latest listings
+        cells = self.session.query(PropertySketchCell).order_by(
+            PropertySketchCell.bedrooms
+        )
+        self.assertEqual(
+            [(cell.bedrooms, cell.count, cell.price_sum) for cell in cells],
+            [(3, 1, 310000.0), (4, 2, 600001000.0)],
+        )
+        # and so was its slice of the cube
+        self.assertEqual(
+            self.session.query(func.sum(PropertyCubeCell.property_count)).scalar(),
+            self.session.query(Property).filter(Property.is_latest.is_(True)).count(),
+        )
+
+    def append(self, rows: list):
+        with open(self.csv_file, "w") as file:
+            file.write("\n".join(CSV.splitlines()[:1] + rows) + "\n")
+        with mock.patch.object(
+            db.load_data, "fetch_db_session", self.fetch_test_session
+        ):
+            load_data(self.csv_file, False, mode="append")
+
+    def test_load_data_append_mode_moves_a_listing_to_another_zipcode(self):
+        with mock.patch.object(
+            db.load_data, "fetch_db_session", self.fetch_test_session
+        ):
+            load_data(self.csv_file, False)
+        self.append(
+            ["6,6 Main St,Miami,FL,33999,1000.0,4.0,3.0,5000.0,2021-05-01 10:00:00,"]
+        )
+
+        # the cell the listing moved out of no longer counts it
+        cells = self.session.query(PropertySketchCell).order_by(
+            PropertySketchCell.zipcode, PropertySketchCell.bedrooms
+        )
+        self.assertEqual(
+            [(cell.zipcode, cell.bedrooms, cell.count) for cell in cells],
+            [("33186", 3, 1), ("33186", 4, 1), ("33999", 4, 1)],
+        )
+        # nor its cube cells, the listing is counted once
+        counts = (
+            self.session.query(
+                PropertyCubeCell.zipcode, func.sum(PropertyCubeCell.property_count)
+            )
+            .group_by(PropertyCubeCell.zipcode)
+            .order_by(PropertyCubeCell.zipcode)
+        )
+        self.assertEqual([tuple(row) for row in counts], [("33186", 5), ("33999", 1)])
+        # and the zipcode's monthly stats end with its last remaining listing
+        months = (
+            self.session.query(
+                PropertyMonthlyStats.scope_value,
+                func.max(PropertyMonthlyStats.month),
+                func.max(PropertyMonthlyStats.property_count),
+            )
+            .filter(
+                PropertyMonthlyStats.series == "price_trend",
+                PropertyMonthlyStats.scope == "zipcode",
+            )
+            .group_by(PropertyMonthlyStats.scope_value)
+            .order_by(PropertyMonthlyStats.scope_value)
+        )
+        self.assertEqual(
+            [tuple(row) for row in months],
+            [("33186", 2021 * 12 + 3, 3), ("33999", 2021 * 12 + 4, 1)],
+        )
+
+    def test_load_data_append_mode_sketches_match_a_rebuild(self):
+        with mock.patch.object(
+            db.load_data, "fetch_db_session", self.fetch_test_session
+        ):
+            load_data(self.csv_file, False)
+        self.append(
+            [
+                # a price change, a move and a listing superseding the latest one
+                "5,5 Main St,Miami,FL,33186,700000.0,4.0,3.0,2000.0,2021-04-01 10:00:00,",
+                "1,1 Main St,Miami,FL,33101,300000.0,3.0,2.0,1500.0,2021-01-01 10:00:00,",
+                "6,6 Main St,Miami,FL,33101,2000.0,2.0,3.0,5000.0,2022-05-01 10:00:00,",
+                # a property not seen before
+                "7,7 Main St,Miami,FL,33186,400000.0,3.0,2.0,1600.0,2022-01-01 10:00:00,",
+            ]
+        )
+
+        def sketch_cells():
+            cells = self.session.query(PropertySketchCell).all()
+            return sorted(
+                (
+                    cell.zipcode,
+                    cell.bedrooms,
+                    cell.count,
+                    round(cell.price_sum, 6),
+                    round(cell.price_per_square_feet_sum, 6),
+                    cell.price_sketch,
+                )
+                for cell in cells
+            )
+
+        appended = sketch_cells()
+        # rebuilt in batches of two rows, cells span batches
+        with mock.patch.object(
+            sqlalchemy_schemas.property_sketch, "SKETCH_BATCH_SIZE", 2
+        ):
+            refresh_property_sketches(self.session)
+        self.assertEqual(appended, sketch_cells())
+        self.assertEqual(
+            [cell[:3] for cell in appended],
+            [("33101", 2, 1), ("33101", 3, 1), ("33186", 3, 1), ("33186", 4, 1)],
+        )
+
+
+class TestReloadData(unittest.TestCase):
+
+    def setUp(self):
+        self.served = (
+            sqlite_setup.DATABASE_DIRECTORY,
+            sqlite_setup.DATABASE_FILE,
+            sqlite_setup.engine,
+        )
+        self.directory = tempfile.mkdtemp()
+        sqlite_setup.DATABASE_DIRECTORY = self.directory
+        sqlite_setup.DATABASE_FILE = sqlite_setup.DEFAULT_DATABASE_FILE
+        sqlite_setup.engine = sqlite_setup.create_sqlite_engine(
+            sqlite_setup.DEFAULT_DATABASE_FILE
+        )
+        sqlite_setup.SessionLocal.configure(bind=sqlite_setup.engine)
+        sqlite_setup.create_db_tables()
+        self.csv_file = os.path.join(self.directory, "properties.csv")
+
+    def tearDown(self):
+        sqlite_setup.engine.dispose()
+        (
+            sqlite_setup.DATABASE_DIRECTORY,
+            sqlite_setup.DATABASE_FILE,
+            sqlite_setup.engine,
+        ) = self.served
+        sqlite_setup.SessionLocal.configure(bind=sqlite_setup.engine)
+        shutil.rmtree(self.directory)
+
+    def reload(self, rows: int):
+        with open(self.csv_file, "w") as file:
+            file.write("\n".join(CSV.splitlines()[: rows + 1]) + "\n")
+        reload_data(self.csv_file, False)
+
+    def generations(self) -> set:
+        return {
+            os.path.basename(path)
+            for path in glob.glob(os.path.join(self.directory, "real_estate.*.db"))
+        }
+
+    def test_reload_swaps_in_a_new_generation(self):
+        self.reload(rows=6)
+        first_generation = sqlite_setup.DATABASE_FILE
+        reader = sqlite_setup.SessionLocal()
+        self.assertEqual(reader.query(Property).count(), 6)
+
+        self.reload(rows=4)
+        second_generation = sqlite_setup.DATABASE_FILE
+        self.assertNotEqual(second_generation, first_generation)
+        with open(
+            os.path.join(self.directory, sqlite_setup.CURRENT_DATABASE_POINTER)
+        ) as file:
+            self.assertEqual(file.read(), second_generation)
+        # a session opened before the swap keeps reading its own generation
+        self.assertEqual(reader.query(Property).count(), 6)
+        reader.close()
+        session = sqlite_setup.SessionLocal()
+        self.assertEqual(session.query(Property).count(), 4)
+        session.close()
+        self.assertEqual(self.generations(), {first_generation, second_generation})
+
+        self.reload(rows=2)
+        # only the served generation and the one before it are kept
+        self.assertEqual(
+            self.generations(), {second_generation, sqlite_setup.DATABASE_FILE}
+        )
+        shadow = os.path.join(self.directory, sqlite_setup.SHADOW_DATABASE_FILE)
+        self.assertFalse(os.path.exists(shadow))
+
+
+class TestMigrateDatabase(unittest.TestCase):
+
+    def test_migrates_a_database_loaded_before_is_latest(self):
+        engine = create_engine("sqlite:///:memory:")
+        with engine.begin() as connection:
+            # the properties table as it was created before is_latest
+            connection.exec_driver_sql(
+                "CREATE TABLE properties (id INTEGER PRIMARY KEY, propertyid INTEGER, "
+                "address VARCHAR, city VARCHAR, state VARCHAR, zipcode VARCHAR, "
+                "price FLOAT, bedrooms INTEGER, bathrooms FLOAT, squarefeet FLOAT, "
+                "price_per_square_feet FLOAT, datelisted DATETIME)"
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO properties (propertyid, zipcode, price, datelisted) "
+                "VALUES (?, '33186', ?, ?)",
+                [
+                    (1, 100000.0, "2021-01-01 00:00:00.000000"),
+                    (1, 110000.0, "2022-01-01 00:00:00.000000"),
+                    # two listings on the latest date are both latest
+                    (2, 200000.0, "2022-03-01 00:00:00.000000"),
+                    (2, 210000.0, "2022-03-01 00:00:00.000000"),
+                    (2, 190000.0, "2021-03-01 00:00:00.000000"),
+                    # listings without a date always count
+                    (3, 300000.0, None),
+                    (3, 310000.0, "2020-01-01 00:00:00.000000"),
+                    (3, 320000.0, "2019-01-01 00:00:00.000000"),
+                    (4, 400000.0, None),
+                ],
+            )
+        Base.metadata.create_all(engine)
+
+        migrate_database(engine)
+        migrate_database(engine)
+
+        with engine.connect() as connection:
+            latest = connection.exec_driver_sql(
+                "SELECT id FROM properties WHERE is_latest ORDER BY id"
+            ).scalars()
+            # the rule filter_property_query(latest=True) joined on before
+            max_datelisted = connection.exec_driver_sql(
+                "SELECT properties.id FROM properties LEFT JOIN ("
+                "SELECT propertyid, MAX(datelisted) AS max_datelisted FROM properties "
+                "WHERE datelisted IS NOT NULL GROUP BY propertyid) AS latest "
+                "ON properties.propertyid = latest.propertyid "
+                "AND properties.datelisted = latest.max_datelisted "
+                "WHERE properties.datelisted = latest.max_datelisted "
+                "OR properties.datelisted IS NULL ORDER BY properties.id"
+            ).scalars()
+            self.assertEqual(list(latest), list(max_datelisted))
+            indexes = inspect(connection).get_indexes("properties")
+            self.assertLessEqual(
+                {index.name for index in Property.__table__.indexes},
+                {index["name"] for index in indexes},
+            )
+        session = Session(bind=engine)
+        self.assertEqual(
+            session.query(func.sum(PropertyCubeCell.property_count)).scalar(), 6
+        )
+        session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading
+import unittest
+from unittest import mock
+import db.load_jobs
+from db.load_jobs import fetch_active_load_job, fetch_load_job, submit_load_job
+from sqlalchemy_schemas.load_checkpoint import LoadCheckpoint
+
+
+class TestLoadJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        patcher = mock.patch.object(db.load_jobs, "reload_data", self.fake_reload_data)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_reload_data(self, csv_file, is_filtered, on_progress, on_phase, **kwargs):
+        on_phase("loading")
+        checkpoint = LoadCheckpoint(
+            csv_file=csv_file, file_size=1000, byte_offset=0, rows_read=0, rows_loaded=0
+        )
+        on_progress(checkpoint)
+        checkpoint.byte_offset, checkpoint.rows_read, checkpoint.rows_loaded = (
+            250,
+            10,
+            9,
+        )
+        on_progress(checkpoint)
+        self.release.wait(5)
+
+    def wait_for_job(self, job_id):
+        for _ in range(100):
+            job = fetch_load_job(job_id)
+            if job.phase not in ("queued", "preparing"):
+                return job
+            threading.Event().wait(0.01)
+        return job
+
+    def test_load_job_reports_progress_and_rejects_concurrent_loads(self):
+        job = submit_load_job("data.csv", False, 10, False, 1, "replace")
+        self.assertIsNotNone(job)
+        running = self.wait_for_job(job.job_id)
+        self.assertEqual(running.phase, "loading")
+        self.assertEqual(running.rows_loaded, 9)
+        self.assertEqual(running.bytes_read, 250)
+        self.assertIsNotNone(running.eta_seconds)
+        self.assertIsNone(submit_load_job("data.csv", False, 10, False, 1, "replace"))
+        self.assertEqual(fetch_active_load_job().job_id, job.job_id)
+
+        self.release.set()
+        for _ in range(100):
+            if fetch_load_job(job.job_id).phase == "completed":
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(fetch_load_job(job.job_id).phase, "completed")
+        self.assertIsNone(fetch_active_load_job())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import pandas as pd
+from utils.outlier_methods import OUTLIER_METHODS, detect_outliers
+
+
+class TestOutlierMethods(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.values = pd.Series(rng.lognormal(12, 1, 3000))
+        self.partitions = rng.choice(
+            np.array(["33186", "32801", "33139", None], dtype=object), 3000
+        )
+
+    def reference_outliers(self, method: str, values: pd.Series) -> pd.Series:
+        # the textbook definitions, one partition at a time
+        if method == "iqr":
+            p25, p75 = values.quantile(0.25), values.quantile(0.75)
+            iqr = p75 - p25
+            return (values < p25 - 1.5 * iqr) | (values > p75 + 1.5 * iqr)
+        if method == "mad":
+            median = values.median()
+            mad = (values - median).abs().median()
+            return (0.6745 * (values - median) / mad).abs() > 3.5
+        return ((values - values.mean()) / values.std()).abs() > 3.0
+
+    def test_partitions_match_per_partition_loop(self):
+        for method in OUTLIER_METHODS:
+            _, is_outlier = detect_outliers(method, self.values, self.partitions)
+            expected = np.zeros(len(self.values), dtype=bool)
+            for partition in ["33186", "32801", "33139", None]:
+                rows = np.array([value == partition for value in self.partitions])
+                expected[rows] = self.reference_outliers(
+                    method, self.values[rows]
+                ).to_numpy()
+            self.assertTrue(np.array_equal(is_outlier, expected), method)
+            self.assertGreater(is_outlier.sum(), 0)
+
+    def test_iqr_scores_are_iqrs_beyond_the_quartiles(self):
+        scores, is_outlier = detect_outliers("iqr", self.values)
+        self.assertTrue(np.array_equal(is_outlier, np.abs(scores) > 1.5))
+
+    def test_partition_without_spread_has_no_mad_or_zscore_outliers(self):
+        values = pd.Series([5.0, 5.0, 5.0, 5.0, 9.0])
+        for method in ("mad", "zscore"):
+            _, is_outlier = detect_outliers(method, values[:4])
+            self.assertFalse(is_outlier.any(), method)
+        # more than half equal, the mad is zero and nothing can be judged
+        self.assertFalse(detect_outliers("mad", values)[1].any())
+
+
+if __name__ == "__main__":
+    unittest.main()
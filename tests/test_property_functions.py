@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 import pandas as pd
 from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
@@ -6,16 +7,35 @@ from statistics_handlers.outlier_properties import (
     fetch_filtered_property_outliers_on_price,
     fetch_filtered_property_outliers_on_price_per_squarefeet,
 )
+import statistics_handlers.outlier_properties
+import statistics_handlers.rollup
+from statistics_handlers.rollup import calculate_property_rollup
 from statistics_handlers.stats import (
+    calculate_grouped_property_statistics,
     calculate_property_statistics,
 )
 from sqlalchemy_schemas.property import (
     Property,
+    explain_query_plan,
     filter_properties,
+    filter_property_query,
     Base,
 )  # Import the Property class and Base
-from pydantic_models.property import PageRequest, PaginatedResponse
+from sqlalchemy_schemas.property_cube import refresh_property_cube
+from sqlalchemy_schemas.property_sketch import (
+    PropertySketchCell,
+    refresh_property_sketches,
+)
+from middleware.pagination import PageRequest
+from pydantic_models.property import (
+    PaginatedResponse,
+    PropertyQueryParams,
+    PropertyResponse,
+    convert_df_to_PropertyResponse,
+)
 from pydantic_models.statistics import PropertyStatisticsResponse
+from utils.cache import bounds_cache, query_cache
+from utils.dataframe import calculate_outliers
 
 # Setup for the in-memory SQLite database
 engine = create_engine("sqlite:///:memory:")
@@ -82,6 +102,74 @@ class TestPropertyFunctions(unittest.TestCase):
         self.assertEqual(response.total, 100)
         self.assertEqual(len(response.results), 10)
 
+    def test_construct_models_matches_pydantic(self):
+        # the list validation has to build what model_construct and model_validate do
+        df = pd.DataFrame(
+            {
+                "propertyid": [1.0, 2.0],
+                "address": ["1 Main St", "2 Main St"],
+                "city": ["Miami", "Miami"],
+                "state": ["FL", "FL"],
+                "zipcode": ["33186", "33101"],
+                "price": [300000.0, None],
+                "bedrooms": [3.0, None],
+                "bathrooms": [2.5, None],
+                "squarefeet": [1500.0, None],
+                "price_per_square_feet": [200.0, None],
+                "datelisted": pd.to_datetime(["2021-01-01 10:00:00", None]),
+            }
+        )
+        records = df.astype(object).where(df.notna(), None).to_dict("records")
+        for model, record in zip(convert_df_to_PropertyResponse(df), records):
+            validated = PropertyResponse.model_validate(record)
+            for expected in (
+                validated,
+                PropertyResponse.model_construct(**validated.model_dump()),
+            ):
+                self.assertEqual(model, expected)
+                self.assertEqual(model.model_fields_set, expected.model_fields_set)
+                self.assertEqual(model.model_dump_json(), expected.model_dump_json())
+        first, second = convert_df_to_PropertyResponse(df)
+        self.assertIsNot(first.model_fields_set, second.model_fields_set)
+
+    def test_filter_properties_keyset_pagination(self):
+        pagination = PageRequest(page_size=30, cursor="")
+        seen = []
+        while True:
+            response = filter_properties(
+                query_params=None, pagination=pagination, db_session=self.session
+            )
+            self.assertIsNone(response.total)
+            seen += [result.propertyid for result in response.results]
+            if response.next_cursor is None:
+                break
+            pagination = PageRequest(page_size=30, cursor=response.next_cursor)
+        self.assertEqual(seen, list(range(100)))
+
+        response = filter_properties(
+            query_params=None,
+            pagination=PageRequest(page_size=30, cursor="", with_total=True),
+            db_session=self.session,
+        )
+        self.assertEqual(response.total, 100)
+
+    def test_fetch_filtered_property_outliers_keyset_pagination(self):
+        first = fetch_filtered_property_outliers_on_price(
+            query_params=None,
+            pagination=PageRequest(page_size=3, cursor=""),
+            db_session=self.session,
+        )
+        second = fetch_filtered_property_outliers_on_price(
+            query_params=None,
+            pagination=PageRequest(page_size=3, cursor=first.next_cursor),
+            db_session=self.session,
+        )
+        self.assertIsNone(second.next_cursor)
+        self.assertEqual(
+            [result.price for result in first.results + second.results],
+            [1000000, 1500000, 2000000, 2500000, 3000000],
+        )
+
     def test_fetch_filtered_property_outliers_on_price(self):
         # query_params = PropertyQueryParams()
         pagination = PageRequest(page=1, page_size=10)
@@ -108,6 +196,53 @@ class TestPropertyFunctions(unittest.TestCase):
         for result in response.results:
             self.assertIn(result.price, outlier_prices)
 
+    def test_fetch_filtered_property_outliers_total_matches_pandas(self):
+        # bounds come from sql quantiles, only the page is fetched
+        query_params = PropertyQueryParams(price_min=60000)
+        response = fetch_filtered_property_outliers_on_price(
+            query_params=query_params,
+            pagination=PageRequest(page=2, page_size=2),
+            db_session=Session(),
+        )
+        df = pd.DataFrame(
+            filter_property_query(
+                query_params=query_params,
+                db_session=self.session,
+                columns=[Property.id, Property.price],
+            ).order_by(Property.id),
+            columns=["id", "price"],
+        )
+        outliers = calculate_outliers(df, df["price"])
+        self.assertEqual(response.total, len(outliers))
+        self.assertEqual(
+            [result.price for result in response.results],
+            list(outliers["price"].iloc[2:4]),
+        )
+
+    def test_outlier_pages_reuse_statistics_bounds(self):
+        query_params = PropertyQueryParams(price_max=2500000)
+        query_cache.clear()
+        bounds_cache.clear()
+        statistics = calculate_property_statistics(
+            query_params=query_params, db_session=Session()
+        )
+        # neither the quartiles nor the total are computed again for any page
+        with mock.patch.object(
+            statistics_handlers.outlier_properties,
+            "fetch_quantiles",
+            side_effect=AssertionError("quartiles recomputed"),
+        ):
+            for page in (1, 2):
+                response = fetch_filtered_property_outliers_on_price(
+                    query_params=query_params,
+                    pagination=PageRequest(page=page, page_size=2),
+                    db_session=Session(),
+                )
+                self.assertEqual(response.total, statistics.outlier_properties_count)
+        self.assertEqual(
+            [result.price for result in response.results], [2000000, 2500000]
+        )
+
     def test_calculate_property_statistics(self):
         response = calculate_property_statistics(
             query_params=None, db_session=self.session
@@ -140,6 +275,133 @@ class TestPropertyFunctions(unittest.TestCase):
         )
         self.assertEqual(response.outlier_properties_count, outliers_count)
 
+    def test_calculate_property_statistics_percentiles_match_pandas(self):
+        # odd and even counts, the quantiles interpolate between ranks in sql
+        for price_max in (100000, 101000, 3000000):
+            query_params = PropertyQueryParams(price_max=price_max)
+            response = calculate_property_statistics(
+                query_params=query_params, db_session=Session()
+            )
+            prices = pd.Series(
+                [
+                    row.price
+                    for row in filter_property_query(
+                        query_params=query_params,
+                        db_session=self.session,
+                        columns=[Property.price],
+                    )
+                ]
+            )
+            self.assertEqual(response.total_properties, len(prices))
+            self.assertEqual(response.median_price, prices.median())
+            percentiles = response.percentiles
+            self.assertEqual(percentiles.percentile_25_price, prices.quantile(0.25))
+            self.assertEqual(percentiles.percentile_75_price, prices.quantile(0.75))
+            self.assertEqual(percentiles.percentile_90_price, prices.quantile(0.90))
+            self.assertEqual(percentiles.percentile_99_price, prices.quantile(0.99))
+
+    def test_calculate_property_statistics_approximate(self):
+        refresh_property_sketches(self.session)
+        self.session.commit()
+        exact = calculate_property_statistics(query_params=None, db_session=Session())
+        approximate = calculate_property_statistics(
+            query_params=None, db_session=Session(), approximate=True
+        )
+        self.assertIsNone(exact.relative_error)
+        self.assertEqual(approximate.relative_error, 0.01)
+        self.assertEqual(approximate.total_properties, exact.total_properties)
+        self.assertAlmostEqual(approximate.average_price, exact.average_price)
+        # exact percentiles interpolate between ranks, the sketch returns a rank
+        for name, value in exact.percentiles.model_dump().items():
+            estimate = getattr(approximate.percentiles, name)
+            self.assertLessEqual(abs(estimate - value) / value, 0.02)
+
+    def test_calculate_property_statistics_approximate_without_cells(self):
+        # a database whose sketch cells were never built answers exactly
+        self.session.query(PropertySketchCell).delete()
+        self.session.commit()
+        query_cache.clear()
+        approximate = calculate_property_statistics(
+            query_params=PropertyQueryParams(zipcode=""),
+            db_session=Session(),
+            approximate=True,
+        )
+        exact = calculate_property_statistics(
+            query_params=PropertyQueryParams(zipcode=""), db_session=Session()
+        )
+        self.assertIsNone(approximate.relative_error)
+        self.assertEqual(approximate, exact)
+
+    def test_calculate_grouped_property_statistics(self):
+        query_params = PropertyQueryParams(price_max=1500000)
+        grouped = calculate_grouped_property_statistics(
+            query_params=query_params,
+            db_session=Session(),
+            group_by="zipcode",
+            order_by="median_price",
+            limit=1,
+        )
+        self.assertEqual(grouped.total_groups, 1)
+        self.assertEqual([group.value for group in grouped.groups], [""])
+        single = calculate_property_statistics(
+            query_params=PropertyQueryParams(price_max=1500000, zipcode=""),
+            db_session=Session(),
+        )
+        statistics = grouped.groups[0].statistics
+        self.assertEqual(statistics.percentiles, single.percentiles)
+        self.assertEqual(statistics.median_price, single.median_price)
+        self.assertEqual(
+            statistics.outlier_properties_count, single.outlier_properties_count
+        )
+        self.assertAlmostEqual(statistics.average_price, single.average_price)
+
+    def test_calculate_property_rollup_from_cube(self):
+        refresh_property_cube(self.session)
+        self.session.commit()
+        query_params = PropertyQueryParams(city="")
+        rollups = []
+        for cube in (True, False):
+            query_cache.clear()
+            with mock.patch.object(
+                statistics_handlers.rollup,
+                "rollup_property_cube",
+                (
+                    statistics_handlers.rollup.rollup_property_cube
+                    if cube
+                    else lambda *args, **kwargs: None
+                ),
+            ):
+                rollups.append(
+                    calculate_property_rollup(
+                        query_params=query_params,
+                        db_session=Session(),
+                        group_by="state",
+                    )
+                )
+        self.assertEqual([group.total_properties for group in rollups[0].groups], [100])
+        self.assertEqual(len(rollups[0].groups), len(rollups[1].groups))
+        for cube_group, row_group in zip(rollups[0].groups, rollups[1].groups):
+            self.assertEqual(cube_group.value, row_group.value)
+            self.assertEqual(cube_group.total_properties, row_group.total_properties)
+            self.assertAlmostEqual(cube_group.average_price, row_group.average_price)
+            self.assertAlmostEqual(
+                cube_group.average_squarefeet, row_group.average_squarefeet
+            )
+        # a range filter can't be answered from the cube
+        self.assertIsNone(
+            statistics_handlers.rollup.rollup_property_cube(
+                PropertyQueryParams(price_min=1), self.session, group_by=["city"]
+            )
+        )
+
+    def test_explain_query_plan_uses_filter_index(self):
+        query = filter_property_query(
+            query_params=PropertyQueryParams(zipcode="33186"),
+            db_session=self.session,
+        )
+        details = [row[3] for row in explain_query_plan(query, self.session)]
+        self.assertTrue(any("ix_property_zipcode" in detail for detail in details))
+
 
 if __name__ == "__main__":
     unittest.main()
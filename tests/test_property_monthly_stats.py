@@ -0,0 +1,213 @@
+import unittest
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from pydantic_models.property import PropertyQueryParams
+from sqlalchemy_schemas.property import Base, Property
+from sqlalchemy_schemas.property_monthly_stats import (
+    PropertyMonthlyStats,
+    monthly_listings,
+    monthly_property_stats,
+    refresh_property_monthly_stats,
+)
+from utils.dataframe import forwardfilled_monthly_aggregates
+
+STATS_COLUMNS = [
+    "series",
+    "scope",
+    "scope_value",
+    "zipcode",
+    "month",
+    "property_count",
+    "price_sum",
+    "price_per_square_feet_count",
+    "squarefeet_sum",
+    "listing_count",
+]
+
+
+class TestPropertyMonthlyStats(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        rng = np.random.default_rng(5)
+        size = 3000
+        # properties move between zipcodes and cities now and then
+        zipcodes = rng.choice(
+            ["33186", "33101", "32801", None], size, p=[0.4, 0.4, 0.15, 0.05]
+        )
+        self.listings = pd.DataFrame(
+            {
+                "propertyid": rng.integers(0, 400, size),
+                "state": "FL",
+                "city": np.where(zipcodes == "32801", "Orlando", "Miami"),
+                "zipcode": zipcodes,
+                "price": np.where(
+                    rng.random(size) < 0.1, 0.0, rng.lognormal(12, 1, size)
+                ),
+                "squarefeet": np.where(
+                    rng.random(size) < 0.1, np.nan, rng.lognormal(7, 0.5, size)
+                ),
+                "datelisted": pd.Timestamp("2016-01-01")
+                + pd.to_timedelta(rng.integers(0, 4 * 365 * 86400, size), unit="s"),
+            }
+        )
+        self.listings["price_per_square_feet"] = (
+            self.listings["price"] / self.listings["squarefeet"]
+        ).where(self.listings["price"] > 0)
+        self.insert(self.listings)
+
+    def tearDown(self):
+        self.session.close()
+
+    def insert(self, listings: pd.DataFrame):
+        self.session.add_all(
+            [
+                Property(
+                    **{
+                        column: None if pd.isna(value) else value
+                        for column, value in row.items()
+                    }
+                )
+                for row in listings.astype(object).to_dict("records")
+            ]
+        )
+        self.session.flush()
+
+    def stored_stats(self) -> pd.DataFrame:
+        stats = pd.read_sql_query(
+            self.session.query(PropertyMonthlyStats).statement,
+            self.session.connection(),
+        )
+        return (
+            stats[STATS_COLUMNS]
+            .sort_values(["series", "scope", "scope_value", "zipcode", "month"])
+            .reset_index(drop=True)
+        )
+
+    def test_matches_forwardfill_of_filtered_listings(self):
+        self.assertIsNone(
+            monthly_property_stats(PropertyQueryParams(), self.session, "price_trend")
+        )
+        refresh_property_monthly_stats(self.session)
+        listed = self.listings[self.listings["price"] > 0]
+        for filters in ({}, {"city": "Miami"}, {"zipcode": "32801"}):
+            rows = listed
+            for column, value in filters.items():
+                rows = rows[rows[column] == value]
+            query_params = PropertyQueryParams(**filters)
+
+            expected = forwardfilled_monthly_aggregates(
+                rows,
+                {
+                    "price": ("price", "mean"),
+                    "price_per_square_feet": ("price_per_square_feet", "mean"),
+                },
+            )
+            stats = monthly_property_stats(query_params, self.session, "price_trend")
+            pd.testing.assert_frame_equal(
+                stats[["datelisted", "price", "price_per_square_feet"]],
+                expected,
+                check_exact=False,
+                rtol=1e-9,
+            )
+
+            rows = rows[rows["zipcode"].notna() & (rows["squarefeet"] > 0)]
+            expected = forwardfilled_monthly_aggregates(
+                rows,
+                {"property_count": ("price", "size"), "price": ("price", "mean")},
+                group_by="zipcode",
+            )
+            stats = monthly_property_stats(
+                query_params, self.session, "zipcode_heatmap"
+            )
+            pd.testing.assert_frame_equal(
+                stats[["zipcode", "datelisted", "property_count", "price"]],
+                expected.sort_values(["datelisted", "zipcode"], ignore_index=True),
+                check_exact=False,
+                check_dtype=False,
+                rtol=1e-9,
+            )
+
+        # anything but a single state, city or zipcode is answered from the rows
+        for query_params in (
+            PropertyQueryParams(city="Miami", zipcode="33186"),
+            PropertyQueryParams(price_min=1),
+        ):
+            self.assertIsNone(
+                monthly_property_stats(query_params, self.session, "price_trend")
+            )
+
+    def test_append_matches_a_rebuild(self):
+        # a zipcode whose last listing the chunk moves away, it ends earlier
+        self.insert(
+            pd.DataFrame(
+                {
+                    "propertyid": [1000, 1001],
+                    "state": "FL",
+                    "city": "Naples",
+                    "zipcode": "34102",
+                    "price": [300000.0, 400000.0],
+                    "squarefeet": [1500.0, 2000.0],
+                    "price_per_square_feet": [200.0, 200.0],
+                    "datelisted": pd.to_datetime(["2016-01-15", "2017-06-15"]),
+                }
+            )
+        )
+        refresh_property_monthly_stats(self.session)
+        # a chunk from 2017 on updating listings (moving some to another zipcode
+        # and city, or out of the stats without a price) and adding later ones
+        rng = np.random.default_rng(7)
+        listings = (
+            self.session.query(Property)
+            .filter(Property.datelisted >= pd.Timestamp("2017-01-01").to_pydatetime())
+            .order_by(Property.datelisted.desc())
+            .all()
+        )
+        updated = [listings[i] for i in rng.choice(len(listings), 80, replace=False)]
+        updated[20] = next(row for row in listings if row.propertyid == 1001)
+        appended = self.listings.sample(40, random_state=2).assign(
+            datelisted=lambda df: df["datelisted"] + pd.Timedelta(days=400)
+        )
+        self.session.execute(
+            text("CREATE TEMP TABLE staged (propertyid INTEGER, datelisted DATETIME)")
+        )
+        self.session.execute(
+            text("INSERT INTO staged VALUES (:propertyid, :datelisted)"),
+            [
+                {"propertyid": int(propertyid), "datelisted": str(datelisted)}
+                for propertyid, datelisted in [
+                    *[(row.propertyid, row.datelisted) for row in updated],
+                    *zip(appended["propertyid"], appended["datelisted"]),
+                ]
+            ],
+        )
+        previous_listings = monthly_listings(self.session, "staged")
+        for row in updated[:20]:
+            row.price *= 1.1
+        for row in updated[20:50]:
+            row.zipcode, row.city = "33602", "Tampa"
+        for row in updated[50:60]:
+            row.price = 0.0
+        for row in updated[60:]:
+            row.squarefeet = None
+        self.insert(appended)
+
+        refresh_property_monthly_stats(
+            self.session, propertyids_from="staged", previous_listings=previous_listings
+        )
+        appended_stats = self.stored_stats()
+        refresh_property_monthly_stats(self.session)
+        pd.testing.assert_frame_equal(
+            appended_stats, self.stored_stats(), check_exact=False, rtol=1e-9
+        )
+        self.assertIn("Tampa", set(appended_stats["scope_value"]))
+        naples = appended_stats[appended_stats["scope_value"] == "Naples"]
+        self.assertEqual(set(naples["month"]), {2016 * 12})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from utils.sketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.random.default_rng(7).lognormal(12.5, 0.8, 20000)
+
+    def test_quantiles_within_relative_accuracy(self):
+        sketch = QuantileSketch.from_values(self.values)
+        self.assertEqual(sketch.count(), len(self.values))
+        for q in (0.01, 0.25, 0.5, 0.75, 0.9, 0.99):
+            exact = np.quantile(self.values, q, method="lower")
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - exact) / exact, sketch.relative_accuracy
+            )
+
+    def test_merge_equals_sketch_of_union(self):
+        parts = np.array_split(self.values, 3)
+        merged = QuantileSketch.merged(
+            [
+                QuantileSketch.from_bytes(QuantileSketch.from_values(part).to_bytes())
+                for part in parts
+            ]
+        )
+        whole = QuantileSketch.from_values(self.values)
+        np.testing.assert_array_equal(merged.keys, whole.keys)
+        np.testing.assert_array_equal(merged.counts, whole.counts)
+        self.assertEqual(merged.quantile(0.5), whole.quantile(0.5))
+
+    def test_merge_with_negative_counts_removes_values(self):
+        parts = np.array_split(self.values, 2)
+        removed = QuantileSketch.from_values(parts[1])
+        merged = QuantileSketch.merged(
+            [
+                QuantileSketch.from_values(self.values),
+                QuantileSketch(removed.keys, -removed.counts),
+            ]
+        )
+        kept = QuantileSketch.from_values(parts[0])
+        np.testing.assert_array_equal(merged.keys, kept.keys)
+        np.testing.assert_array_equal(merged.counts, kept.counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from pydantic import BaseModel
+
+from db import sqlite_setup
+
+
+class QueryCache:
+    """
+    Thread safe LRU cache with a per entry TTL. Keys carry the dataset version,
+    so entries computed before a load are never served after it.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.__entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            # drop the entries of older dataset versions while we hold the lock
+            version = sqlite_setup.dataset_version
+            for key in [key for key in self.__entries if key[0] != version]:
+                del self.__entries[key]
+            return {
+                "entries": len(self.__entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "dataset_version": version,
+            }
+
+
+query_cache = QueryCache(
+    max_entries=int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 1024)),
+    ttl_seconds=float(os.environ.get("QUERY_CACHE_TTL_SECONDS", 300)),
+)
+
+# quartiles of a metric per filter, shared by the statistics and every outlier
+# page. They only change with the dataset, which is in the key
+bounds_cache = QueryCache(
+    max_entries=int(os.environ.get("BOUNDS_CACHE_MAX_ENTRIES", 4096)),
+    ttl_seconds=float(os.environ.get("BOUNDS_CACHE_TTL_SECONDS", 3600)),
+)
+
+
+def normalize_params(params):
+    """
+    Hashable form of a pydantic params model, unset filters are left out. Plain
+    values (flags like approximate) are already hashable and kept as they are.
+    """
+    if params is None:
+        return ()
+    if not isinstance(params, BaseModel):
+        return params
+    return tuple(sorted(params.model_dump(exclude_none=True).items()))
+
+
+def cached_query(function):
+    """
+    Caches a handler taking (query_params, db_session, [pagination, flags]) on
+    its normalized params. A hit closes the session like the handler itself would.
+    """
+
+    @functools.wraps(function)
+    def wrapper(query_params, db_session, **kwargs):
+        key = (
+            sqlite_setup.dataset_version,
+            id(db_session.get_bind()),
+            function.__qualname__,
+            normalize_params(query_params),
+            tuple(
+                (name, normalize_params(value))
+                for name, value in sorted(kwargs.items())
+            ),
+        )
+        hit, value = query_cache.get(key)
+        if hit:
+            db_session.close()
+            return value
+        value = function(query_params=query_params, db_session=db_session, **kwargs)
+        query_cache.set(key, value)
+        return value
+
+    return wrapper
+
+
+def bounds_key(query_params, db_session, metric: str) -> tuple:
+    """bounds_cache key of a metric under the filters of query_params."""
+    return (
+        sqlite_setup.dataset_version,
+        id(db_session.get_bind()),
+        normalize_params(query_params),
+        metric,
+    )
@@ -1,18 +1,27 @@
+from typing import Optional
+import numpy as np
 import pandas as pd
 
 
-def sanitize_pandas_dataframe(df: pd.DataFrame) -> list:
-    outlier_records = df.to_dict(orient="records")
-    sanitized_records = []
-    for record in outlier_records:
-        sanitized_record = {}
-        for key, value in record.items():
-            if pd.isna(value):
-                sanitized_record[key] = None
-            else:
-                sanitized_record[key] = value
-        sanitized_records.append(sanitized_record)
-    return sanitized_records
+def sanitize_pandas_dataframe(df: pd.DataFrame, integer_columns=()) -> list:
+    """
+    Records of df with missing values as None and plain python values (ints for
+    integer_columns, datetimes for datetime columns), converted a column at a
+    time instead of a pd.isna per cell.
+    """
+    columns = {}
+    for name, series in df.items():
+        missing = series.isna().to_numpy()
+        values = series.to_numpy()
+        if name in integer_columns:
+            values = np.where(missing, 0, values).astype(np.int64)
+        elif series.dtype.kind == "M":
+            # datetime64[ns] turns into integers as objects, microseconds into datetimes
+            values = values.astype("datetime64[us]")
+        values = values.astype(object)
+        values[missing] = None
+        columns[name] = values
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
 
 
 def calculate_outliers(df: pd.DataFrame, series: pd.Series) -> pd.DataFrame:
@@ -28,26 +37,104 @@ def calculate_outliers(df: pd.DataFrame, series: pd.Series) -> pd.DataFrame:
     return outliers
 
 
-def forwardfill_price_for_historical_property_data(df: pd.DataFrame) -> pd.DataFrame:
-    df["datelisted"] = pd.to_datetime(df["datelisted"]).dt.to_period("M")
-
-    all_periods = pd.period_range(
-        start=df["datelisted"].min(), end=df["datelisted"].max(), freq="M"
-    )
-    all_propertyids = df["propertyid"].unique()
-    complete_index = pd.MultiIndex.from_product(
-        [all_propertyids, all_periods], names=["propertyid", "datelisted"]
+def forwardfilled_monthly_aggregates(
+    df: pd.DataFrame, aggregations: dict, group_by: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Monthly aggregates of the listings in df (propertyid, datelisted and the
+    aggregated columns) with every property's last listing carried forward
+    through each month until its next listing, up to the last month of df.
+    aggregations maps output columns to (column, "mean" | "sum" | "count" | "size")
+    like a DataFrame.agg, group_by optionally splits them by a (carried forward)
+    column.
+
+    Returns the rows `groupby([group_by, "datelisted"]).agg(...)` would give on
+    the dense propertyid x month grid forward filled per property, without
+    building it: each listing adds its values to the interval of months until
+    the property's next one through difference arrays, so memory scales with
+    the listings instead of properties x months.
+    """
+    dates = pd.to_datetime(df["datelisted"])
+    listings = df.assign(
+        listed=dates, month=dates.dt.year * 12 + dates.dt.month - 1
+    ).dropna(subset=["listed"])
+    listings["month"] = listings["month"].astype(np.int64)
+    # the grid holds the earliest listing of a property in a month, whatever
+    # order the rows were queried in
+    order = np.lexsort(
+        (listings["listed"].to_numpy(), listings["propertyid"].to_numpy())
     )
-    df.set_index(["propertyid", "datelisted"], inplace=True)
-    df = (
-        df.reset_index()
-        .drop_duplicates(subset=["propertyid", "datelisted"])
-        .set_index(["propertyid", "datelisted"])
+    listings = listings.iloc[order]
+    listings = listings.drop_duplicates(subset=["propertyid", "month"])
+    columns = list(dict.fromkeys(column for column, _ in aggregations.values()))
+    if group_by is not None and group_by not in columns:
+        columns.append(group_by)
+    # a listing missing a value keeps the property's previous one, like ffill
+    listings[columns] = listings.groupby("propertyid")[columns].ffill()
+
+    first_month = int(listings["month"].min())
+    months = int(listings["month"].max()) - first_month + 1
+    start = listings["month"].to_numpy() - first_month
+    propertyids = listings["propertyid"].to_numpy()
+    # a listing lasts until the property's next one, the last until the end
+    is_last = np.append(propertyids[1:] != propertyids[:-1], True)
+    end = np.where(is_last, months, np.roll(start, -1))
+
+    if group_by is not None:
+        codes, groups = pd.factorize(listings[group_by], sort=True)
+    else:
+        codes, groups = np.zeros(len(listings), dtype=np.int64), np.array([None])
+    # listings before the property has a group_by value fall in no group
+    has_group = codes >= 0
+    width = months + 1
+    starts = (codes * width + start)[has_group]
+    ends = (codes * width + end)[has_group]
+
+    def interval_sums(weights=None) -> np.ndarray:
+        if weights is not None:
+            weights = weights[has_group]
+        size = len(groups) * width
+        differences = np.bincount(starts, weights, minlength=size) - np.bincount(
+            ends, weights, minlength=size
+        )
+        return np.cumsum(differences.reshape(len(groups), width), axis=1)[
+            :, :months
+        ].ravel()
+
+    sizes = interval_sums()
+    if group_by is None:
+        # the grid has a row for every property every month, listed yet or not
+        sizes = np.full(months, df["propertyid"].nunique())
+    data = {}
+    for output, (column, aggregation) in aggregations.items():
+        if aggregation == "size":
+            data[output] = sizes
+            continue
+        values = listings[column].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        totals = interval_sums(np.where(present, values, 0.0))
+        counts = interval_sums(present.astype(np.float64))
+        if aggregation == "sum":
+            data[output] = totals
+        elif aggregation == "count":
+            data[output] = np.rint(counts).astype(np.int64)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                data[output] = np.where(counts > 0, totals / counts, np.nan)
+
+    # the grid only has the group x month combinations some property is in
+    cells = np.flatnonzero(sizes > 0)
+    periods = pd.period_range(
+        start=pd.Period(year=first_month // 12, month=first_month % 12 + 1, freq="M"),
+        periods=months,
+        freq="M",
     )
-    df = df.reindex(complete_index).sort_index()
-    df = df.groupby("propertyid").ffill().reset_index()
-
-    return df
+    result = pd.DataFrame({"datelisted": periods[cells % months]})
+    if group_by is not None:
+        result.insert(0, group_by, np.asarray(groups, dtype=object)[cells // months])
+    for output, values in data.items():
+        result[output] = values[cells]
+    return result
 
 
 def sqlalchemy_models_to_dataframe(models):
@@ -0,0 +1,24 @@
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+class ModelJSONResponse(Response):
+    """
+    Encodes a response model we built ourselves straight to json bytes with
+    orjson. Returning it from a route skips fastapi validating the model again
+    against the response_model (which still documents the route) and
+    jsonable_encoder walking every value in python.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        # non finite floats come out as null, as pydantic writes them
+        return orjson.dumps(content, default=ModelJSONResponse.__fields)
+
+    @staticmethod
+    def __fields(model):
+        if isinstance(model, BaseModel):
+            return model.__dict__
+        raise TypeError
@@ -0,0 +1,74 @@
+from typing import Callable, Optional
+import numpy as np
+import pandas as pd
+
+# name -> function(values, partitions) returning (deviation scores, outlier mask),
+# every statistic is a groupby transform so all partitions are done in one pass
+OUTLIER_METHODS: dict[str, Callable] = {}
+
+# a modified z-score (Iglewicz and Hoaglin) beyond this is an outlier
+MAD_THRESHOLD = 3.5
+# as is a z-score beyond this
+ZSCORE_THRESHOLD = 3.0
+# the scale that makes the median absolute deviation comparable to a std
+MAD_SCALE = 0.6745
+
+
+def outlier_method(name: str):
+    def register(function: Callable) -> Callable:
+        OUTLIER_METHODS[name] = function
+        return function
+
+    return register
+
+
+def detect_outliers(
+    method: str, values: pd.Series, partitions: Optional[np.ndarray] = None
+) -> tuple:
+    """
+    (deviation scores, outlier mask) of values, every partition (missing
+    partition values form one of their own) judged on its own statistics.
+    """
+    if partitions is None:
+        partitions = np.zeros(len(values), dtype=np.int8)
+    grouped = values.groupby(partitions, dropna=False, sort=False)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores, is_outlier = OUTLIER_METHODS[method](values, grouped)
+    return np.asarray(scores, dtype=np.float64), np.asarray(is_outlier, dtype=bool)
+
+
+def iqr_deviation_score(values, p25, p75):
+    """IQRs a value lies beyond the quartiles, 0 between them."""
+    iqr = p75 - p25
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            values > p75,
+            (values - p75) / iqr,
+            np.where(values < p25, (values - p25) / iqr, 0.0),
+        )
+
+
+@outlier_method("iqr")
+def iqr_outliers(values: pd.Series, grouped) -> tuple:
+    # the same 1.5 IQR fences as the global outliers
+    p25 = grouped.transform("quantile", 0.25)
+    p75 = grouped.transform("quantile", 0.75)
+    scores = iqr_deviation_score(values, p25, p75)
+    iqr = p75 - p25
+    return scores, (values < p25 - 1.5 * iqr) | (values > p75 + 1.5 * iqr)
+
+
+@outlier_method("mad")
+def mad_outliers(values: pd.Series, grouped) -> tuple:
+    median = grouped.transform("median")
+    deviation = values - median
+    mad = deviation.abs().groupby(grouped.ngroup()).transform("median")
+    scores = MAD_SCALE * deviation / mad
+    # a partition with a zero mad has no spread to measure outliers against
+    return scores, (np.abs(scores) > MAD_THRESHOLD) & (mad > 0)
+
+
+@outlier_method("zscore")
+def zscore_outliers(values: pd.Series, grouped) -> tuple:
+    scores = (values - grouped.transform("mean")) / grouped.transform("std")
+    return scores, np.abs(scores) > ZSCORE_THRESHOLD
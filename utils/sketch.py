@@ -0,0 +1,87 @@
+import math
+from typing import Optional
+import numpy as np
+
+# every quantile of a sketch is within 1% of the exact value
+RELATIVE_ACCURACY = 0.01
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch for positive values (DDSketch): values are counted
+    in logarithmic buckets (gamma^(k-1), gamma^k], so a quantile read off the
+    sketch is within relative_accuracy of the exact one and two sketches merge by
+    adding their bucket counts.
+    """
+
+    def __init__(
+        self,
+        keys: Optional[np.ndarray] = None,
+        counts: Optional[np.ndarray] = None,
+        relative_accuracy: float = RELATIVE_ACCURACY,
+    ):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # sorted unique bucket keys and the number of values in each
+        self.keys = np.empty(0, np.int64) if keys is None else keys
+        self.counts = np.empty(0, np.int64) if counts is None else counts
+
+    @classmethod
+    def from_values(
+        cls, values: np.ndarray, relative_accuracy: float = RELATIVE_ACCURACY
+    ) -> "QuantileSketch":
+        sketch = cls(relative_accuracy=relative_accuracy)
+        keys, counts = np.unique(sketch.bucket_keys(values), return_counts=True)
+        sketch.keys, sketch.counts = keys, counts.astype(np.int64)
+        return sketch
+
+    @classmethod
+    def merged(
+        cls, sketches: list, relative_accuracy: float = RELATIVE_ACCURACY
+    ) -> "QuantileSketch":
+        if not sketches:
+            return cls(relative_accuracy=relative_accuracy)
+        keys, inverse = np.unique(
+            np.concatenate([sketch.keys for sketch in sketches]), return_inverse=True
+        )
+        counts = np.rint(
+            np.bincount(
+                inverse,
+                weights=np.concatenate([sketch.counts for sketch in sketches]),
+                minlength=len(keys),
+            )
+        ).astype(np.int64)
+        # a sketch with negative counts deletes values, emptied buckets go
+        nonempty = counts != 0
+        return cls(keys[nonempty], counts[nonempty], relative_accuracy)
+
+    @classmethod
+    def from_bytes(
+        cls, data: bytes, relative_accuracy: float = RELATIVE_ACCURACY
+    ) -> "QuantileSketch":
+        keys, counts = np.frombuffer(data, dtype=np.int64).reshape(2, -1)
+        return cls(keys, counts, relative_accuracy)
+
+    def to_bytes(self) -> bytes:
+        return np.stack([self.keys, self.counts]).astype(np.int64).tobytes()
+
+    def bucket_keys(self, values: np.ndarray) -> np.ndarray:
+        return np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+
+    def bucket_values(self, keys: np.ndarray) -> np.ndarray:
+        # the point of a bucket with the same relative distance to both ends
+        return 2 * np.power(self.gamma, keys) / (self.gamma + 1)
+
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float:
+        rank = q * (self.count() - 1)
+        index = np.searchsorted(np.cumsum(self.counts), rank, side="right")
+        return float(self.bucket_values(self.keys[index]))
+
+    def count_outside(self, lower: float, upper: float) -> int:
+        """Estimated number of values below lower or above upper."""
+        values = self.bucket_values(self.keys)
+        return int(self.counts[(values < lower) | (values > upper)].sum())
@@ -1,36 +1,48 @@
 import pandas as pd
 from sqlalchemy.orm import Session
+from db.columnar_store import get_columnar_store
 from pydantic_models.property import PropertyQueryParams
 from sqlalchemy_schemas.property import Property, filter_property_query
+from sqlalchemy_schemas.property_monthly_stats import monthly_property_stats
 import plotly.express as px
-from utils.dataframe import forwardfill_price_for_historical_property_data
+from utils.dataframe import forwardfilled_monthly_aggregates
 import visualizations.constants as constants
 
 
 def heatmaps_zipcode(query_params: PropertyQueryParams, db_session: Session):
-    query = (
-        filter_property_query(
-            query_params=query_params,
-            db_session=db_session,
-            columns=[
-                Property.price,
-                Property.zipcode,
-                Property.squarefeet,
-                Property.price_per_square_feet,
-            ],
+    columns = ["price", "zipcode", "squarefeet", "price_per_square_feet"]
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(
+            query_params,
+            columns=columns,
+            positive=["squarefeet"],
+            not_null=["zipcode"],
+            equals={"city": "Miami"},
         )
-        .filter(
-            Property.zipcode.isnot(None), Property.city == "Miami", Property.squarefeet > 0
+    else:
+        query = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[
+                    Property.price,
+                    Property.zipcode,
+                    Property.squarefeet,
+                    Property.price_per_square_feet,
+                ],
+            )
+            .filter(
+                Property.zipcode.isnot(None),
+                Property.city == "Miami",
+                Property.squarefeet > 0,
+            )
+            .all()
         )
-        .all()
-    )
+        df = pd.DataFrame(query, columns=columns)
 
-    if not query:
+    if df.empty:
         return "<h3>No data available for the given query parameters</h3>"
-
-    df = pd.DataFrame(
-        query, columns=["price", "zipcode", "squarefeet", "price_per_square_feet"]
-    )
     zipcode_data = (
         df.groupby("zipcode")
         .agg(
@@ -162,57 +174,10 @@ def heatmaps_zipcode(query_params: PropertyQueryParams, db_session: Session):
 
 
 def historical_heatmaps_zipcode(query_params: PropertyQueryParams, db_session: Session):
-    query = (
-        filter_property_query(
-            query_params=query_params,
-            db_session=db_session,
-            columns=[
-                Property.propertyid,
-                Property.price,
-                Property.zipcode,
-                Property.squarefeet,
-                Property.datelisted,
-                Property.price_per_square_feet,
-            ],
-            latest=False,
-        )
-        .filter(
-            Property.zipcode.isnot(None),
-            Property.squarefeet > 0,
-            Property.price > 0,
-            Property.datelisted.isnot(None),
-        )
-        .all()
-    )
-
-    if not query:
+    zipcode_data = __monthly_zipcode_data(query_params, db_session)
+    if zipcode_data.empty:
         return "<h3>No data available for the given query parameters</h3>"
 
-    df = pd.DataFrame(
-        query,
-        columns=[
-            "propertyid",
-            "price",
-            "zipcode",
-            "squarefeet",
-            "datelisted",
-            "price_per_square_feet",
-        ],
-    )
-
-    df = forwardfill_price_for_historical_property_data(df=df)
-
-    zipcode_data = (
-        df.groupby(["zipcode", "datelisted"])
-        .agg(
-            average_price=("price", "mean"),
-            number_of_listings=("price", "size"),
-            average_price_per_sqft=("price_per_square_feet", "mean"),
-            average_area=("squarefeet", "mean"),
-        )
-        .reset_index()
-    )
-
     zipcode_data = zipcode_data.sort_values(by="datelisted")
 
     zipcode_data["price_range"] = pd.cut(
@@ -284,3 +249,81 @@ def historical_heatmaps_zipcode(query_params: PropertyQueryParams, db_session: S
         + fig_ppsf.to_html(full_html=False, include_plotlyjs="cdn")
         + fig_listings.to_html(full_html=False, include_plotlyjs="cdn")
     )
+
+
+def __monthly_zipcode_data(
+    query_params: PropertyQueryParams, db_session: Session
+) -> pd.DataFrame:
+    """
+    Averages and listings per zipcode and month, every property counting in
+    each month with its last listing.
+    """
+    # a single state, city or zipcode filter is precomputed at load
+    stats = monthly_property_stats(query_params, db_session, series="zipcode_heatmap")
+    if stats is not None:
+        return pd.DataFrame(
+            {
+                "zipcode": stats["zipcode"],
+                "datelisted": stats["datelisted"],
+                "average_price": stats["price"],
+                "number_of_listings": stats["property_count"],
+                "average_price_per_sqft": stats["price_per_square_feet"],
+                "average_area": stats["squarefeet"],
+            }
+        )
+
+    columns = [
+        "propertyid",
+        "price",
+        "zipcode",
+        "squarefeet",
+        "datelisted",
+        "price_per_square_feet",
+    ]
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(
+            query_params,
+            columns=columns,
+            latest=False,
+            positive=["squarefeet", "price"],
+            not_null=["zipcode", "datelisted"],
+        )
+    else:
+        query = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[
+                    Property.propertyid,
+                    Property.price,
+                    Property.zipcode,
+                    Property.squarefeet,
+                    Property.datelisted,
+                    Property.price_per_square_feet,
+                ],
+                latest=False,
+            )
+            .filter(
+                Property.zipcode.isnot(None),
+                Property.squarefeet > 0,
+                Property.price > 0,
+                Property.datelisted.isnot(None),
+            )
+            .all()
+        )
+        df = pd.DataFrame(query, columns=columns)
+
+    if df.empty:
+        return pd.DataFrame()
+
+    return forwardfilled_monthly_aggregates(
+        df=df,
+        aggregations={
+            "average_price": ("price", "mean"),
+            "number_of_listings": ("price", "size"),
+            "average_price_per_sqft": ("price_per_square_feet", "mean"),
+            "average_area": ("squarefeet", "mean"),
+        },
+        group_by="zipcode",
+    )
@@ -1,37 +1,21 @@
 import pandas as pd
 from sqlalchemy import func
 from sqlalchemy.orm import Session
+from db.columnar_store import get_columnar_store
 from pydantic_models.property import PropertyQueryParams
 from sqlalchemy_schemas.property import Property, filter_property_query
+from sqlalchemy_schemas.property_cube import rollup_property_cube
+from sqlalchemy_schemas.property_monthly_stats import monthly_property_stats
 import plotly.express as px
 import visualizations.constants as constants
-from utils.dataframe import forwardfill_price_for_historical_property_data
+from utils.dataframe import forwardfilled_monthly_aggregates
 
 
 def price_distribution(query_params: PropertyQueryParams, db_session: Session):
-    query = (
-        filter_property_query(
-            query_params=query_params, db_session=db_session, columns=[Property.price]
-        )
-        .filter(Property.price > 0)
-        .all()
-    )
-
-    if not query:
+    df_grouped = __price_histogram_counts(query_params, db_session)
+    if df_grouped.empty:
         return "<h3>No data available for the given query parameters</h3>"
 
-    df = pd.DataFrame(query, columns=["price"])
-
-    df["price_bins"] = pd.cut(
-        df["price"],
-        bins=constants.bins_price_histogram,
-        labels=constants.labels_price_histogram,
-        right=False,
-        include_lowest=True,
-    )
-
-    df["price_bins"] = df["price_bins"].astype(str)
-    df_grouped = df.groupby("price_bins").size().reset_index(name="count")
     df_grouped["price_bins"] = pd.Categorical(
         df_grouped["price_bins"],
         categories=constants.labels_price_histogram,
@@ -57,19 +41,9 @@ def price_distribution(query_params: PropertyQueryParams, db_session: Session):
 
 
 def bedrooms_distribution(query_params: PropertyQueryParams, db_session: Session):
-    query = (
-        filter_property_query(
-            query_params=query_params,
-            db_session=db_session,
-            columns=[Property.bedrooms, func.count(Property.id).label("count")],
-        )
-        .filter(Property.bedrooms.isnot(None))
-        .group_by(Property.bedrooms)
-    )
-    result = query.all()
-    if not query:
+    df = __bedroom_counts(query_params, db_session)
+    if df.empty:
         return "<h3>No data available for the given query parameters</h3>"
-    df = pd.DataFrame(result, columns=["bedrooms", "count"])
 
     df["bedroom_bins"] = pd.cut(
         df["bedrooms"],
@@ -99,24 +73,105 @@ def bedrooms_distribution(query_params: PropertyQueryParams, db_session: Session
     return fig.to_html(full_html=False, include_plotlyjs="cdn")
 
 
-def price_vs_zipcode_box_plot(query_params: PropertyQueryParams, db_session: Session):
-    query = (
+def __price_histogram_counts(
+    query_params: PropertyQueryParams, db_session: Session
+) -> pd.DataFrame:
+    """Listings with a positive price per constants.labels_price_histogram bin."""
+    # pure equality filters are answered from the cube, range filters need rows
+    cells = rollup_property_cube(
+        query_params, db_session, group_by=["price_bin"], not_null=["price_bin"]
+    )
+    if cells is not None:
+        return pd.DataFrame(
+            [
+                (constants.labels_price_histogram[cell.price_bin], cell.property_count)
+                for cell in cells
+            ],
+            columns=["price_bins", "count"],
+        )
+
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(query_params, columns=["price"], positive=["price"])
+    else:
+        query = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[Property.price],
+            )
+            .filter(Property.price > 0)
+            .all()
+        )
+        df = pd.DataFrame(query, columns=["price"])
+
+    df["price_bins"] = pd.cut(
+        df["price"],
+        bins=constants.bins_price_histogram,
+        labels=constants.labels_price_histogram,
+        right=False,
+        include_lowest=True,
+    )
+    df["price_bins"] = df["price_bins"].astype(str)
+    return df.groupby("price_bins").size().reset_index(name="count")
+
+
+def __bedroom_counts(
+    query_params: PropertyQueryParams, db_session: Session
+) -> pd.DataFrame:
+    """Listings per bedroom count, listings without one are left out."""
+    cells = rollup_property_cube(
+        query_params, db_session, group_by=["bedrooms"], not_null=["bedrooms"]
+    )
+    if cells is not None:
+        return pd.DataFrame(
+            [(cell.bedrooms, cell.property_count) for cell in cells],
+            columns=["bedrooms", "count"],
+        )
+
+    store = get_columnar_store(db_session)
+    if store is not None:
+        return (
+            store.select(query_params, columns=["bedrooms"], not_null=["bedrooms"])
+            .value_counts()
+            .reset_index(name="count")
+        )
+    result = (
         filter_property_query(
             query_params=query_params,
             db_session=db_session,
-            columns=[
-                Property.price,
-                Property.zipcode,
-                Property.squarefeet,
-                Property.price_per_square_feet,
-            ],
+            columns=[Property.bedrooms, func.count(Property.id).label("count")],
         )
-        .filter(Property.price > 0, Property.squarefeet > 0)
+        .filter(Property.bedrooms.isnot(None))
+        .group_by(Property.bedrooms)
         .all()
     )
-    df = pd.DataFrame(
-        query, columns=["price", "zipcode", "squarefeet", "price_per_square_feet"]
-    )
+    return pd.DataFrame(result, columns=["bedrooms", "count"])
+
+
+def price_vs_zipcode_box_plot(query_params: PropertyQueryParams, db_session: Session):
+    columns = ["price", "zipcode", "squarefeet", "price_per_square_feet"]
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(
+            query_params, columns=columns, positive=["price", "squarefeet"]
+        )
+    else:
+        query = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[
+                    Property.price,
+                    Property.zipcode,
+                    Property.squarefeet,
+                    Property.price_per_square_feet,
+                ],
+            )
+            .filter(Property.price > 0, Property.squarefeet > 0)
+            .all()
+        )
+        df = pd.DataFrame(query, columns=columns)
 
     fig_price = px.box(
         df,
@@ -151,39 +206,16 @@ def price_vs_zipcode_box_plot(query_params: PropertyQueryParams, db_session: Ses
 
 
 def historical_price_trends(query_params: PropertyQueryParams, db_session: Session):
-    query = (
-        filter_property_query(
-            query_params=query_params,
-            db_session=db_session,
-            columns=[
-                Property.propertyid,
-                Property.price,
-                Property.datelisted,
-                Property.price_per_square_feet,
-            ],
-            latest=False,
-        )
-        .filter(Property.price > 0, Property.datelisted.isnot(None))
-        .all()
-    )
-
-    if not query:
+    df_monthly = __monthly_average_prices(query_params, db_session)
+    if df_monthly.empty:
         return "<h3>No data available for the given query parameters</h3>"
 
-    df = pd.DataFrame(
-        query, columns=["propertyid", "price", "datelisted", "price_per_square_feet"]
-    )
-
-    df = forwardfill_price_for_historical_property_data(df=df)
+    df_monthly["datelisted"] = df_monthly["datelisted"].dt.to_timestamp()
 
-    df_grouped_price = df.groupby("datelisted")["price"].mean().reset_index()
-    df_grouped_price["datelisted"] = df_grouped_price["datelisted"].dt.to_timestamp()
+    df_grouped_price = df_monthly[["datelisted", "price"]]
     df_grouped_price = df_grouped_price.sort_values(by="datelisted")
 
-    df_grouped_ppsf = (
-        df.groupby("datelisted")["price_per_square_feet"].mean().reset_index()
-    )
-    df_grouped_ppsf["datelisted"] = df_grouped_ppsf["datelisted"].dt.to_timestamp()
+    df_grouped_ppsf = df_monthly[["datelisted", "price_per_square_feet"]]
     df_grouped_ppsf = df_grouped_ppsf.sort_values(by="datelisted")
 
     fig_price = px.line(
@@ -221,3 +253,55 @@ def historical_price_trends(query_params: PropertyQueryParams, db_session: Sessi
     return fig_price.to_html(
         full_html=False, include_plotlyjs="cdn"
     ) + fig_ppsf.to_html(full_html=False, include_plotlyjs="cdn")
+
+
+def __monthly_average_prices(
+    query_params: PropertyQueryParams, db_session: Session
+) -> pd.DataFrame:
+    """
+    Average price and price per square feet per month, every property counting
+    in each month with its last listed price.
+    """
+    # a single state, city or zipcode filter is precomputed at load
+    stats = monthly_property_stats(query_params, db_session, series="price_trend")
+    if stats is not None:
+        return stats[["datelisted", "price", "price_per_square_feet"]].copy()
+
+    columns = ["propertyid", "price", "datelisted", "price_per_square_feet"]
+    store = get_columnar_store(db_session)
+    if store is not None:
+        df = store.select(
+            query_params,
+            columns=columns,
+            latest=False,
+            positive=["price"],
+            not_null=["datelisted"],
+        )
+    else:
+        query = (
+            filter_property_query(
+                query_params=query_params,
+                db_session=db_session,
+                columns=[
+                    Property.propertyid,
+                    Property.price,
+                    Property.datelisted,
+                    Property.price_per_square_feet,
+                ],
+                latest=False,
+            )
+            .filter(Property.price > 0, Property.datelisted.isnot(None))
+            .all()
+        )
+        df = pd.DataFrame(query, columns=columns)
+
+    if df.empty:
+        return pd.DataFrame()
+
+    return forwardfilled_monthly_aggregates(
+        df=df,
+        aggregations={
+            "price": ("price", "mean"),
+            "price_per_square_feet": ("price_per_square_feet", "mean"),
+        },
+    )